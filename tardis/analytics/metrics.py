@@ -0,0 +1,132 @@
+"""
+Download metrics in the Prometheus format
+
+Metrics are only recorded when METRICS_ENABLED is set and the optional
+prometheus_client package is installed.  When several worker processes
+serve requests, set the PROMETHEUS_MULTIPROC_DIR environment variable
+so that the /metrics endpoint reports the totals of all of them.
+"""
+import hmac
+import ipaddress
+import os
+
+from django.conf import settings
+from django.http import (HttpResponse, HttpResponseForbidden,
+                         HttpResponseNotFound)
+
+try:
+    import prometheus_client
+    from prometheus_client import multiprocess
+except ImportError:
+    prometheus_client = None
+
+# seconds, from fast local disks to slow object stores and tape recalls
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+DURATION_BUCKETS = (0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0,
+                    1800.0, 3600.0, 10800.0, 43200.0)
+THROUGHPUT_BUCKETS = tuple(2 ** power for power in range(10, 34, 2))
+
+if prometheus_client is not None:
+    DOWNLOADS = prometheus_client.Counter(
+        'mytardis_downloads_total',
+        'Downloads by type and whether they completed or were aborted',
+        ['label', 'status'])
+    DOWNLOAD_BYTES = prometheus_client.Counter(
+        'mytardis_download_bytes_total',
+        'Bytes sent to download clients',
+        ['label'])
+    DOWNLOAD_DURATION = prometheus_client.Histogram(
+        'mytardis_download_duration_seconds',
+        'Time from creating a download response until it is closed',
+        ['label'], buckets=DURATION_BUCKETS)
+    DOWNLOAD_TTFB = prometheus_client.Histogram(
+        'mytardis_download_time_to_first_byte_seconds',
+        'Time from creating a download response until its first bytes '
+        'are sent',
+        ['label'], buckets=LATENCY_BUCKETS)
+    DOWNLOAD_THROUGHPUT = prometheus_client.Histogram(
+        'mytardis_download_throughput_bytes_per_second',
+        'Average throughput of each completed download',
+        ['label'], buckets=THROUGHPUT_BUCKETS)
+    STORAGE_BOX_READ_LATENCY = prometheus_client.Histogram(
+        'mytardis_storage_box_read_seconds',
+        'Time taken by each read from a storage box while downloading',
+        ['storage_box'], buckets=LATENCY_BUCKETS)
+
+
+def metrics_enabled():
+    return prometheus_client is not None and \
+        getattr(settings, 'METRICS_ENABLED', False)
+
+
+def record_download(label, num_bytes, duration, ttfb, complete):
+    """
+    records a finished download
+
+    :param str label: type of download, e.g. 'file' or 'tar'
+    :param int num_bytes: bytes sent
+    :param float duration: seconds the download took
+    :param float ttfb: seconds until the first bytes were sent, or None if
+        nothing was sent
+    :param bool complete: False if the download was aborted
+    """
+    if not metrics_enabled():
+        return
+    DOWNLOADS.labels(label, 'complete' if complete else 'aborted').inc()
+    DOWNLOAD_BYTES.labels(label).inc(num_bytes)
+    DOWNLOAD_DURATION.labels(label).observe(duration)
+    if ttfb is not None:
+        DOWNLOAD_TTFB.labels(label).observe(ttfb)
+    if complete and duration > 0:
+        DOWNLOAD_THROUGHPUT.labels(label).observe(num_bytes / duration)
+
+
+def observe_storage_read(storage_box, seconds):
+    """
+    records the latency of one read from a storage box
+
+    :param str storage_box: name of the storage box
+    :param float seconds: time the read took
+    """
+    if not metrics_enabled():
+        return
+    STORAGE_BOX_READ_LATENCY.labels(storage_box).observe(seconds)
+
+
+def can_scrape(request):
+    """
+    Whether a request may read the metrics, i.e. whether it comes from one
+    of the METRICS_ALLOWED_IPS or carries the METRICS_BEARER_TOKEN
+    """
+    token = getattr(settings, 'METRICS_BEARER_TOKEN', None)
+    if token:
+        auth = request.META.get('HTTP_AUTHORIZATION', '')
+        if hmac.compare_digest(auth.encode(),
+                               ('Bearer %s' % token).encode()):
+            return True
+    try:
+        address = ipaddress.ip_address(request.META.get('REMOTE_ADDR', ''))
+    except ValueError:
+        return False
+    return any(address in ipaddress.ip_network(network)
+               for network in getattr(settings, 'METRICS_ALLOWED_IPS', []))
+
+
+def metrics_view(request):
+    """
+    Prometheus scrape endpoint, for the clients allowed by
+    :func:`can_scrape`
+    """
+    if not metrics_enabled():
+        return HttpResponseNotFound()
+    if not can_scrape(request):
+        return HttpResponseForbidden()
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR') or \
+            os.environ.get('prometheus_multiproc_dir'):
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return HttpResponse(prometheus_client.generate_latest(registry),
+                        content_type=prometheus_client.CONTENT_TYPE_LATEST)
@@ -2,9 +2,12 @@
 Generic tracking and analytics interface
 Supports Google Analytics through ga.py, others may follow
 """
+import time
+
 import six
 
 from tardis.analytics import ga
+from tardis.analytics import metrics
 
 service = ga
 """This can become a setting to other service in the future"""
@@ -18,12 +21,20 @@ track_download = service.track_download
 
 
 class IteratorTracker(object):
-    """wraps file iterator to track successful and incomplete downloads"""
+    """wraps file iterator to track successful and incomplete downloads,
+    and to record download metrics"""
 
-    def __init__(self, iterator, tracker_data=None):
+    def __init__(self, iterator, tracker_data=None, label=None):
         self._iterator = iterator
         self.tracker_data = tracker_data
+        if label is None:
+            label = (tracker_data or {}).get('label', 'unknown')
+        self.label = label
         self.complete = False
+        self.start_time = time.time()
+        self.first_byte_time = None
+        self.bytes_sent = 0
+        self.recorded = False
 
     def __iter__(self):
         return self
@@ -31,20 +42,40 @@ class IteratorTracker(object):
     def close(self):
         if hasattr(self._iterator, 'close'):
             self._iterator.close()
+        self.record_metrics()
 
     def __next__(self):
         try:
             if six.PY3:
-                return self._iterator.__next__()
-            return self._iterator.next()
+                data = self._iterator.__next__()
+            else:
+                data = self._iterator.next()
         except StopIteration:
             self.complete = True
             raise StopIteration()
+        if self.first_byte_time is None:
+            self.first_byte_time = time.time()
+        self.bytes_sent += len(data)
+        return data
 
     def next(self):
         return self.__next__()
 
+    def record_metrics(self):
+        if self.recorded:
+            return
+        self.recorded = True
+        ttfb = None
+        if self.first_byte_time is not None:
+            ttfb = self.first_byte_time - self.start_time
+        metrics.record_download(self.label, self.bytes_sent,
+                                time.time() - self.start_time, ttfb,
+                                self.complete)
+
     def __del__(self):
+        self.record_metrics()
+        if self.tracker_data is None:
+            return
         if not self.complete:
             self.tracker_data['label'] = self.tracker_data.get(
                 'label', '') + '-aborted'
@@ -8,3 +8,16 @@ A short expiry (30 seconds) is used, because it is only
 intended to provide access long enough for an authenticated
 MyTardis user to be redirected to the signed URL.
 '''
+
+S3_CHECKSUM_PART_SIZE = 8 * 1024 * 1024
+'''
+Objects larger than this many bytes are downloaded for checksum
+verification with several ranged GET requests of this size.
+'''
+
+S3_CHECKSUM_CONCURRENCY = 4
+'''
+Number of ranged GET requests which are made at once when downloading a
+large object for checksum verification.  At most this many parts are held
+in memory by each verification.
+'''
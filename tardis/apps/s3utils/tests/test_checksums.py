@@ -3,20 +3,30 @@ Testing the s3util app's ability to calculate checksums for S3 objects
 
 .. moduleauthor:: James Wettenhall <james.wettenhall@monash.edu>
 '''
-import unittest
-import sys
+from io import BytesIO
 
-from unittest.mock import patch
+from botocore.response import StreamingBody
+from botocore.stub import Stubber
 
 from django.test import TestCase
+from django.test.utils import override_settings
 
 from tardis.tardis_portal.models.dataset import Dataset
 from tardis.tardis_portal.models.datafile import DataFile, DataFileObject
 from tardis.tardis_portal.models.storage import StorageBox, StorageBoxOption
 
+from ..utils import get_s3_client
+
+
+def get_object_response(content, start=0, size=None):
+    response = {'Body': StreamingBody(BytesIO(content), len(content)),
+                'ContentLength': len(content)}
+    if size is not None:
+        response['ContentRange'] = 'bytes %d-%d/%d' % (
+            start, start + len(content) - 1, size)
+    return response
+
 
-@unittest.skipIf(sys.platform == 'win32',
-                 "Windows doesn't have md5sum and sha512sum binaries")
 class S3UtilsAppChecksumsTestCase(TestCase):
     def setUp(self):
         super().setUp()
@@ -49,24 +59,51 @@ class S3UtilsAppChecksumsTestCase(TestCase):
     def test_checksums(self):
         '''
         Ensure that we can calculate an MD5 sum and a SHA512 sum for
-        a file in S3 object storage
+        a file in S3 object storage, downloading it once
         '''
         dfo = DataFileObject(
-            storage_box=self.s3_storage_box, datafile=self.datafile)
-
-        def mock_download_fileobj(*args, **kwargs):
-
-            def download(self, uri, pipe):
-                pipe.write(b'test')
-
-            return download
-
-        with patch('boto3.s3.inject.bucket_download_fileobj',
-                   new_callable=mock_download_fileobj):
+            storage_box=self.s3_storage_box, datafile=self.datafile,
+            uri='test.txt')
+        s3client, _ = get_s3_client(self.s3_storage_box)
+        with Stubber(s3client) as stubber:
+            stubber.add_response(
+                'get_object', get_object_response(b'test', 0, 4),
+                {'Bucket': 'test-bucket', 'Key': 'test.txt',
+                 'Range': 'bytes=0-%d' % (8 * 1024 * 1024 - 1)})
             checksums = dfo.calculate_checksums(
                 compute_md5=True, compute_sha512=True)
-            self.assertEqual(checksums['md5sum'], self.datafile.md5sum)
-            self.assertEqual(checksums['sha512sum'], self.datafile.sha512sum)
+            stubber.assert_no_pending_responses()
+        self.assertEqual(checksums['md5sum'], self.datafile.md5sum)
+        self.assertEqual(checksums['sha512sum'], self.datafile.sha512sum)
+        self.assertNotIn('head', checksums)
+
+    @override_settings(S3_CHECKSUM_PART_SIZE=3)
+    def test_ranged_checksums(self):
+        '''
+        Ensure that objects larger than S3_CHECKSUM_PART_SIZE are hashed
+        in order from ranged GETs
+        '''
+        dfo = DataFileObject(
+            storage_box=self.s3_storage_box, datafile=self.datafile,
+            uri='test.txt')
+        s3client, _ = get_s3_client(self.s3_storage_box)
+        self.assertIs(get_s3_client(self.s3_storage_box)[0], s3client)
+        with Stubber(s3client) as stubber:
+            stubber.add_response(
+                'get_object', get_object_response(b'tes', 0, 4),
+                {'Bucket': 'test-bucket', 'Key': 'test.txt',
+                 'Range': 'bytes=0-2'})
+            stubber.add_response(
+                'get_object', get_object_response(b't', 3, 4),
+                {'Bucket': 'test-bucket', 'Key': 'test.txt',
+                 'Range': 'bytes=3-3'})
+            checksums = dfo.calculate_checksums(
+                compute_md5=True, compute_sha512=True, head_size=4)
+            stubber.assert_no_pending_responses()
+        self.assertEqual(checksums['md5sum'], self.datafile.md5sum)
+        self.assertEqual(checksums['sha512sum'], self.datafile.sha512sum)
+        # the first bytes, for detecting the MIME type
+        self.assertEqual(checksums['head'], b'test')
 
     def tearDown(self):
         super().tearDown()
@@ -1,17 +1,24 @@
 """
 Utilities for S3 objects
 """
-import re
-import subprocess
-import sys
+import hashlib
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 
 from django.conf import settings
 
 import boto3
 from botocore.client import Config
+from botocore.exceptions import ClientError
 
 from . import default_settings
 
+# storage box id -> (options, client, bucket name)
+_s3_clients = {}
+_s3_clients_lock = threading.Lock()
+
 
 def generate_presigned_url(dfo, expiry=None):
     """
@@ -57,31 +64,36 @@ def generate_presigned_url(dfo, expiry=None):
         ExpiresIn=expiry)
 
 
-def calculate_checksums(dfo, compute_md5=True, compute_sha512=False):
-    """Calculates checksums for an S3 DataFileObject instance.
-    For files in S3, using the django-storages abstraction is
-    inefficient - we end up with a clash of chunking algorithms
-    between the download from S3 and MyTardis's Python-based checksum
-    calculation.  So for S3 files, we calculate checksums using external
-    binaries (md5sum and shasum) instead.
+def get_s3_client(storage_box):
+    """
+    Returns a boto3 S3 client and the bucket name for a storage box
 
-    :param dfo : The DataFileObject instance
-    :type dfo: DataFileObject
-    :param compute_md5: whether to compute md5 default=True
-    :type compute_md5: bool
-    :param compute_sha512: whether to compute sha512, default=True
-    :type compute_sha512: bool
+    Clients are thread safe and keep a pool of HTTP connections, so one is
+    kept per storage box and reused for as long as the box's options don't
+    change.  The options are read with ``storage_box.options.all()``, so
+    they can be prefetched before calling this from a worker thread.
 
-    :return: the checksums as {'md5sum': result, 'sha512sum': result}
-    :rtype: dict
+    :param StorageBox storage_box: the S3 storage box
+    :return: the client and the bucket name
+    :rtype: tuple
     """
-    from botocore.client import Config
-    options = dfo.storage_box.options.all()
-    boto3_kwargs = dict(config=Config())
-    for option in options:
-        key = option.key
+    options = tuple(sorted((option.key, option.value)
+                           for option in storage_box.options.all()))
+    with _s3_clients_lock:
+        cached = _s3_clients.get(storage_box.id)
+        if cached is not None and cached[0] == options:
+            return cached[1], cached[2]
+    concurrency = getattr(settings, 'S3_CHECKSUM_CONCURRENCY',
+                          default_settings.S3_CHECKSUM_CONCURRENCY)
+    config_kwargs = dict(max_pool_connections=max(10, concurrency))
+    boto3_kwargs = {}
+    bucket_name = None
+    for key, value in options:
         if key == 'signature_version':
-            boto3_kwargs['config'] = Config(signature_version=option.value)
+            config_kwargs['signature_version'] = value
+            continue
+        if key == 'bucket_name':
+            bucket_name = value
             continue
         key = key.replace('access_key', 'aws_access_key_id')
         key = key.replace('secret_key', 'aws_secret_access_key')
@@ -90,32 +102,122 @@ def calculate_checksums(dfo, compute_md5=True, compute_sha512=False):
                 'endpoint_url', 'aws_access_key_id', 'aws_secret_access_key',
                 'aws_session_token']:
             continue
-        boto3_kwargs[key] = option.value
-    s3resource = boto3.resource('s3', **boto3_kwargs)
-    bucket = s3resource.Bucket(options.get(key='bucket_name').value)
+        boto3_kwargs[key] = value
+    s3client = boto3.session.Session().client(
+        's3', config=Config(**config_kwargs), **boto3_kwargs)
+    with _s3_clients_lock:
+        _s3_clients[storage_box.id] = (options, s3client, bucket_name)
+    return s3client, bucket_name
 
-    checksums = {}
 
-    if compute_md5:
-        md5sum_binary = 'md5sum'
-        if sys.platform == 'darwin':
-            md5sum_binary = 'md5'
-        proc = subprocess.Popen(
-            [md5sum_binary],
-            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
-        bucket.download_fileobj(dfo.uri, proc.stdin)
-        stdout, _ = proc.communicate()
-        checksums['md5sum'] = \
-            re.match(b'\w+', stdout).group(0).decode('utf8')
+def _read_body(body, update, chunk_size=1024 * 1024):
+    try:
+        for chunk in iter(lambda: body.read(chunk_size), b''):
+            update(chunk)
+    finally:
+        body.close()
 
-    if compute_sha512:
-        shasum_binary = 'shasum'
-        proc = subprocess.Popen(
-            [shasum_binary, '-a', '512'],
-            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
-        bucket.download_fileobj(dfo.uri, proc.stdin)
-        stdout, _ = proc.communicate()
-        checksums['sha512sum'] = \
-            re.match(b'\w+', stdout).group(0).decode('utf8')
 
+def _iter_ranges(s3client, bucket_name, key, offset, size, part_size,
+                 concurrency):
+    """
+    Yields the contents of an object from offset onwards in order, fetching
+    up to concurrency parts of part_size bytes at once with ranged GETs
+    """
+    def get_range(start):
+        end = min(start + part_size, size) - 1
+        response = s3client.get_object(
+            Bucket=bucket_name, Key=key,
+            Range='bytes=%d-%d' % (start, end))
+        data = response['Body'].read()
+        if len(data) != end - start + 1:
+            raise IOError('short read of %s bytes %d-%d' % (key, start, end))
+        return data
+
+    starts = iter(range(offset, size, part_size))
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = deque(executor.submit(get_range, start)
+                        for start in islice(starts, concurrency))
+        while pending:
+            data = pending.popleft().result()
+            for start in islice(starts, 1):
+                pending.append(executor.submit(get_range, start))
+            yield data
+
+
+def calculate_checksums(dfo, compute_md5=True, compute_sha512=False,
+                        head_size=0):
+    """Calculates checksums for an S3 DataFileObject instance.
+    For files in S3, using the django-storages abstraction is
+    inefficient - we end up with a clash of chunking algorithms
+    between the download from S3 and MyTardis's Python-based checksum
+    calculation.  So for S3 files, we download the object directly with
+    boto3, updating all of the requested digests in a single pass.
+    Objects larger than S3_CHECKSUM_PART_SIZE are fetched with
+    concurrent ranged GETs, which are hashed in order.
+
+    :param dfo : The DataFileObject instance
+    :type dfo: DataFileObject
+    :param compute_md5: whether to compute md5 default=True
+    :type compute_md5: bool
+    :param compute_sha512: whether to compute sha512, default=True
+    :type compute_sha512: bool
+    :param int head_size: number of bytes from the start of the object to
+        return as 'head', default=0
+
+    :return: the checksums as {'md5sum': result, 'sha512sum': result}, and
+        'head' if head_size was given
+    :rtype: dict
+    """
+    hashers = {}
+    if compute_md5:
+        hashers['md5sum'] = hashlib.md5()
+    if compute_sha512:
+        hashers['sha512sum'] = hashlib.sha512()
+    if not hashers:
+        return {}
+
+    head = []
+    head_needed = [head_size]
+
+    def update(chunk):
+        if head_needed[0] > 0:
+            head.append(chunk[:head_needed[0]])
+            head_needed[0] -= len(head[-1])
+        for hasher in hashers.values():
+            hasher.update(chunk)
+
+    s3client, bucket_name = get_s3_client(dfo.storage_box)
+    part_size = getattr(settings, 'S3_CHECKSUM_PART_SIZE',
+                        default_settings.S3_CHECKSUM_PART_SIZE)
+    concurrency = getattr(settings, 'S3_CHECKSUM_CONCURRENCY',
+                          default_settings.S3_CHECKSUM_CONCURRENCY)
+    try:
+        response = s3client.get_object(
+            Bucket=bucket_name, Key=dfo.uri,
+            Range='bytes=0-%d' % (part_size - 1))
+    except ClientError as error:
+        if error.response.get('Error', {}).get('Code') != 'InvalidRange':
+            raise
+        # the object is empty
+        response = s3client.get_object(Bucket=bucket_name, Key=dfo.uri)
+    if 'ContentRange' in response:
+        size = int(response['ContentRange'].rsplit('/', 1)[1])
+    else:
+        size = response['ContentLength']
+    _read_body(response['Body'], update)
+    if size > part_size:
+        if concurrency > 1:
+            for data in _iter_ranges(
+                    s3client, bucket_name, dfo.uri, part_size, size,
+                    part_size, concurrency):
+                update(data)
+        else:
+            response = s3client.get_object(
+                Bucket=bucket_name, Key=dfo.uri,
+                Range='bytes=%d-' % part_size)
+            _read_body(response['Body'], update)
+    checksums = {key: hasher.hexdigest() for key, hasher in hashers.items()}
+    if head_size:
+        checksums['head'] = b''.join(head)
     return checksums
@@ -11,3 +11,28 @@
 #    INSTALLED_APPS = INSTALLED_APPS + ('django_user_agents',)
 #    MIDDLEWARE = MIDDLEWARE + \
 #        ('django_user_agents.middleware.UserAgentMiddleware',)
+
+METRICS_ENABLED = False
+'''
+Record download metrics (bytes sent, duration, time to first byte, aborted
+downloads and the read latency of each storage box) and serve them in the
+Prometheus format at /metrics.  Needs the prometheus_client package from
+requirements-metrics.txt.  Only the clients allowed by METRICS_ALLOWED_IPS
+or METRICS_BEARER_TOKEN can read /metrics.  With several worker processes,
+set the PROMETHEUS_MULTIPROC_DIR environment variable to an empty directory
+shared by the workers.
+'''
+
+METRICS_ALLOWED_IPS = []
+'''
+IP addresses and networks, e.g. ['10.0.0.5', '192.168.1.0/24'], which may
+read /metrics.  Behind a reverse proxy the requests come from the proxy's
+address, so use METRICS_BEARER_TOKEN instead unless the proxy only passes
+on requests from the monitoring system.
+'''
+
+METRICS_BEARER_TOKEN = None
+'''
+Secret which Prometheus can send in an "Authorization: Bearer <token>"
+header to read /metrics from any address.
+'''
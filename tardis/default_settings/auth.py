@@ -52,6 +52,22 @@ AUTH_PROFILE_MODULE = 'tardis_portal.UserProfile'
 # New users are added to these groups by default.
 NEW_USER_INITIAL_GROUPS = []
 
+GROUPS_CACHE_SECONDS = 300
+'''
+Seconds for which the groups of a user from each of the GROUP_PROVIDERS
+are cached, so that requests don't each query e.g. the LDAP server.  The
+cached groups are removed when the user logs in or out and when their
+Django groups change.  The Django groups themselves aren't cached, as they
+are read with one query.  Set to 0 to disable the cache.
+'''
+
+GROUPS_CACHE = 'default'
+'''
+The cache from CACHES to keep the groups of users in.  Use a cache shared
+by all of the web and Celery processes, i.e. not a LocMemCache, or changes
+to the groups only take effect in the process which made them.
+'''
+
 # Turn on/off the self-registration link and form
 REGISTRATION_OPEN = True
 '''Enable/disable the self-registration link and form in the UI.
@@ -112,3 +128,15 @@ LDAP_ADMIN_PASSWORD = ''
 LDAP_BASE = 'dc=example, dc=com'
 LDAP_USER_BASE = 'ou=People, ' + LDAP_BASE
 LDAP_GROUP_BASE = 'ou=Group, ' + LDAP_BASE
+
+LDAP_POOL_SIZE = 10
+'''
+The most connections to the LDAP server, bound as LDAP_ADMIN_USER, which
+each process keeps open for searching.
+'''
+
+LDAP_POOL_CHECK_SECONDS = 60
+'''
+Pooled LDAP connections which have been idle for longer than this are
+checked before they are reused, and replaced if the server has closed them.
+'''
@@ -34,5 +34,15 @@ CELERYBEAT_SCHEDULE = {
         "task": "tardis_portal.verify_dfos",
         "schedule": timedelta(seconds=300),
         "kwargs": {'priority': DEFAULT_TASK_PRIORITY}
+    },
+    "reverify-files": {
+        "task": "tardis_portal.reverify_dfos",
+        "schedule": timedelta(seconds=600),
+        "kwargs": {'priority': DEFAULT_TASK_PRIORITY}
+    },
+    "sweep-experiment-access": {
+        "task": "tardis_portal.sweep_experiment_access",
+        "schedule": timedelta(seconds=3600),
+        "kwargs": {'priority': DEFAULT_TASK_PRIORITY}
     }
 }
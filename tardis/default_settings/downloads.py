@@ -41,7 +41,114 @@ DATASET_SPACES_TO_UNDERSCORES = True
 DEFAULT_ARCHIVE_FORMATS = ['tar']
 '''
 Site's preferred archive types, with the most preferred first
-other available option: 'tgz'. Add to list if desired
+other available options: 'tgz' and 'tar.zst' (which needs the zstandard
+package). Add to list if desired
+'''
+
+DOWNLOAD_PREFETCH_DEPTH = 2
+'''
+Number of archive members which are opened and read ahead on background
+threads while the current member of an experiment, dataset or selection
+archive is being streamed.  Reading ahead keeps the HTTP client busy on
+slow or high-latency storage boxes.  Set to 0 to read members one after
+another in the request thread.
+'''
+
+DOWNLOAD_PREFETCH_BUFFER_SIZE = 64 * 1024 * 1024
+'''
+Memory budget in bytes for data read ahead by DOWNLOAD_PREFETCH_DEPTH.
+The budget is shared by all members being read concurrently for one
+archive download.
+'''
+
+DOWNLOAD_STREAMING_ARCHIVE_THRESHOLD = None
+'''
+Experiment and dataset archives with more files than this are generated
+in streaming mode: DataFiles are read from the database in chunks, and tar
+headers are built as each file is sent.  Only the id and size of each
+member are kept while the archive is sent, 16 bytes per file, instead of
+its DataFile and tar header.  All of the DataFiles are still read once to
+compute the archive's size before it starts.
+
+Streaming archives have no ETag or member offsets, so they can't be
+resumed with HTTP Range requests and aren't kept in the
+ARCHIVE_CACHE_STORAGE_BOX.  Only set this on servers where building the
+member list of the largest archives runs out of memory.  None never uses
+streaming mode.
+'''
+
+DOWNLOAD_STREAMING_ARCHIVE_CHUNK_SIZE = 2000
+'''
+Number of DataFiles fetched from the database at a time for streaming
+archives.
+'''
+
+DOWNLOAD_COMPRESSION_WORKERS = None
+'''
+Number of threads compressing 'tgz' and 'tar.zst' archives.  'tgz'
+archives are compressed in blocks on a pool of this many threads shared
+by all downloads in the process, and 'tar.zst' archives use this many zstd
+worker threads each.  Defaults to the number of CPUs.  Set to 0 to
+compress in the request thread.
+'''
+
+DOWNLOAD_COMPRESSION_BLOCK_SIZE = 1024 * 1024
+'''
+Number of uncompressed bytes in each independently compressed block of a
+'tgz' archive.  Smaller blocks spread the work over more threads sooner,
+larger blocks compress slightly better.
+'''
+
+ARCHIVE_CACHE_STORAGE_BOX = None
+'''
+Name of a StorageBox to keep experiment and dataset archives in, so that
+archives downloaded again are sent from the cache instead of being
+rebuilt and recompressed.  The first download of an archive queues the
+tardis_portal.cache_archive task to write it to the box.  Cached archives
+are keyed by the checksums and paths of their members, so changed
+archives are rebuilt, and the tardis_portal.delete_cached_archives task
+deletes them when the name, size or dataset of a member DataFile changes
+or it is deleted.  When the box's max_size is set, the least recently used
+archives are evicted to stay within it.
+'''
+
+ARCHIVE_CACHE_BUILD_TIMEOUT = 24 * 60 * 60
+'''
+Seconds after which an archive cache task which hasn't finished is
+assumed to have failed, so the archive is queued again on the next
+download.
+'''
+
+DOWNLOAD_OFFLOAD_HEADER = None
+'''
+Set to 'X-Accel-Redirect' (nginx) or 'X-Sendfile' (Apache mod_xsendfile,
+lighttpd) to let the web server send single file downloads from local
+file system storage boxes, once access has been checked.  The web server
+reads the file with sendfile and handles range requests, so the
+application worker is freed straight away.  Files in offline (tape)
+storage boxes are always sent by the application.
+'''
+
+DOWNLOAD_OFFLOAD_LOCATIONS = {}
+'''
+Maps storage box names to the location which DOWNLOAD_OFFLOAD_HEADER
+points into.  For X-Accel-Redirect this is an internal nginx location
+aliased to the storage box's directory, and boxes without one are sent by
+the application.  For X-Sendfile it is the storage box's directory as
+seen by the web server, defaulting to the box's own location.
+
+For example,
+
+  DOWNLOAD_OFFLOAD_LOCATIONS = {
+      'master store': '/protected/master-store/'
+  }
+
+with the nginx location
+
+  location /protected/master-store/ {
+      internal;
+      alias /var/lib/mytardis/store/;
+  }
 '''
 
 DOWNLOAD_URI_TEMPLATES = {}
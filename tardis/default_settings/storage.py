@@ -13,6 +13,113 @@ REQUIRE_VALIDATION_ON_INGESTION = True
 COMPUTE_MD5 = True
 COMPUTE_SHA512 = False
 
+VERIFY_BATCH_SIZE = 100
+'''
+Number of unverified DataFileObjects from one storage box which the
+verify_dfos task hands to each verification task.  The files in a batch are
+hashed concurrently and their results are saved with one bulk update.  Set to
+1 to queue one verification task per DataFileObject instead.
+'''
+
+VERIFY_CONCURRENCY = 4
+'''
+Number of files which a batch verification task hashes at once.  This can be
+set per storage box with a "verify_concurrency" StorageBoxAttribute, e.g. a
+lower value for a box on spinning disks and a higher one for an object store.
+'''
+
+VERIFY_LEASE_DURATION = 6 * 3600
+'''
+Seconds for which the verify_dfos task leases each DataFileObject it queues
+for verification.  Later runs of verify_dfos skip leased DataFileObjects, so
+this should be longer than it takes the workers to get through the queue.  A
+DataFileObject whose verification task is lost is queued again once its lease
+expires.
+'''
+
+VERIFY_SWEEP_PAGE_SIZE = 1000
+'''
+Number of unverified DataFileObjects which verify_dfos leases and queues at
+a time.
+'''
+
+REVERIFY_INTERVAL = 90 * 24 * 3600
+'''
+Seconds after which a verified DataFileObject is due to have its fixity
+checked again by the reverify_dfos task.  The files which were verified
+longest ago are checked first.
+'''
+
+REVERIFY_PERIOD = 600
+'''
+Seconds of reading at each storage box's re-verification rate which
+reverify_dfos queues for the box at a time.  reverify_dfos should be
+scheduled at least this often, see CELERYBEAT_SCHEDULE.
+'''
+
+REVERIFY_BYTES_PER_SECOND = 10 * 1024 * 1024
+'''
+Average rate at which files are read to re-verify them, so that fixity
+checks don't starve downloads.  This can be set per storage box with a
+"reverify_bytes_per_second" StorageBoxAttribute.
+'''
+
+REVERIFY_CONCURRENCY = 1
+'''
+Number of files which are read at once to re-verify them.  This can be set
+per storage box with a "reverify_concurrency" StorageBoxAttribute.
+'''
+
+REVERIFY_MAX_FILES = 10000
+'''
+Most DataFileObjects which reverify_dfos queues for a storage box at a time,
+however small they are.
+'''
+
+CLEANUP_BATCH_SIZE = 1000
+'''
+Number of rows which the cleanup_dfs and cleanup_dfos tasks delete in each
+transaction.
+'''
+
+CLEANUP_DELETE_WORKERS = 8
+'''
+Number of files which the cleanup_dfos task deletes from storage at once.
+'''
+
+STORAGE_PLACEMENT_POLICY = \
+    'tardis.tardis_portal.storage.placement.LeastLoadedPolicy'
+'''
+Class which chooses the storage box for a new file when several boxes have a
+'default' attribute, and the cache box for a file when a box has several.
+LeastLoadedPolicy chooses the least loaded box which has room for the file,
+FirstBoxPolicy always chooses the box with the lowest id.
+'''
+
+PLACEMENT_USAGE_CACHE_SECONDS = 300
+'''
+Number of seconds for which each process reuses its count of the bytes in a
+storage box when placing files, adding the files it places in the meantime.
+'''
+
+PLACEMENT_LOAD_TOLERANCE = 0.25
+'''
+Storage boxes whose load is within this fraction of the least loaded box's
+count as equally loaded in LeastLoadedPolicy, which then chooses the one
+with the smallest fraction of its max_size used.
+'''
+
+TRANSFER_BATCH_SIZE = 100
+'''
+Number of files which StorageBox.copy_files and move_files transfer between
+checkpoints.  An interrupted transfer resumes after the last checkpoint.
+'''
+
+TRANSFER_WORKERS = 4
+'''
+Number of files which StorageBox.copy_files and move_files copy at once.
+'''
+
 CALCULATE_CHECKSUMS_METHODS = {
 }
 '''
@@ -30,6 +137,11 @@ the classic compute_checksums method which uses the file_object to calculate the
 checksums one chunk at a time.  For some storage backends (e.g. S3), representing
 the file as file-like object with Django's file storage API is not the most
 efficient way to calculate the checksum.
+
+A custom method is called as method(dfo, compute_md5, compute_sha512), with a
+head_size keyword argument when the DataFile has no MIME type yet.  It should
+then return the first head_size bytes of the file as 'head' along with the
+checksums, so that the MIME type is detected without reading the file again.
 '''
 
 DEFAULT_FILE_STORAGE = \
@@ -231,3 +231,4 @@ admin.site.register(models.StorageBox, StorageBoxAdmin)
 admin.site.register(models.StorageBoxOption)
 admin.site.register(models.StorageBoxAttribute)
 admin.site.register(models.DataFileObject)
+admin.site.register(models.StorageBoxTransfer)
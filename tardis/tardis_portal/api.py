@@ -8,7 +8,6 @@ Implemented with Tastypie.
 '''
 import json
 import re
-from wsgiref.util import FileWrapper
 
 from django.conf import settings
 from django.conf.urls import url
@@ -17,7 +16,7 @@ from django.contrib.auth.models import User
 from django.contrib.auth.models import Group
 from django.db import IntegrityError
 from django.http import HttpResponse, HttpResponseForbidden, \
-    StreamingHttpResponse, HttpResponseNotFound, JsonResponse
+    HttpResponseNotFound, JsonResponse
 from django.shortcuts import redirect
 
 from tastypie import fields
@@ -37,7 +36,8 @@ from tastypie.contrib.contenttypes.fields import GenericForeignKeyField
 
 from uritemplate import URITemplate
 
-from tardis.analytics.tracker import IteratorTracker
+from tardis.analytics.tracker import track_download
+
 from . import tasks
 from .auth.decorators import (
     get_accessible_datafiles_for_user,
@@ -49,6 +49,8 @@ from .auth.decorators import (
     has_experiment_access,
     has_write_permissions)
 from .auth.localdb_auth import django_user
+from .download import get_datafile_etag, get_file_response
+from .download import get_offload_response
 from .models.access_control import ObjectACL
 from .models.datafile import DataFile, DataFileObject, compute_checksums
 from .models.dataset import Dataset
@@ -143,7 +145,8 @@ class ACLAuthorization(Authorization):
     '''Authorisation class for Tastypie.
     '''
     def read_list(self, object_list, bundle):  # noqa # too complex
-        obj_ids = [obj.id for obj in object_list]
+        # a subquery, so that the objects aren't loaded before filtering
+        obj_ids = object_list.values('id')
         if bundle.request.user.is_authenticated and \
            bundle.request.user.is_superuser:
             return object_list
@@ -165,16 +168,19 @@ class ACLAuthorization(Authorization):
                 id__in=obj_ids
             )
         if isinstance(bundle.obj, Dataset):
-            dataset_ids = [ds.id for ds in object_list
-                           if has_dataset_access(bundle.request, ds.id)]
-            return Dataset.objects.filter(id__in=dataset_ids)
+            experiments = Experiment.safe.all(bundle.request.user)
+            return Dataset.objects.filter(
+                experiments__in=experiments, id__in=obj_ids).distinct()
         if isinstance(bundle.obj, DatasetParameterSet):
-            return [dps for dps in object_list
-                    if has_dataset_access(bundle.request, dps.dataset.id)]
+            experiments = Experiment.safe.all(bundle.request.user)
+            return DatasetParameterSet.objects.filter(
+                dataset__experiments__in=experiments,
+                id__in=obj_ids).distinct()
         if isinstance(bundle.obj, DatasetParameter):
-            return [dp for dp in object_list
-                    if has_dataset_access(bundle.request,
-                                          dp.parameterset.dataset.id)]
+            experiments = Experiment.safe.all(bundle.request.user)
+            return DatasetParameter.objects.filter(
+                parameterset__dataset__experiments__in=experiments,
+                id__in=obj_ids).distinct()
         if isinstance(bundle.obj, DataFile):
             all_files = get_accessible_datafiles_for_user(bundle.request)
             return all_files.filter(id__in=obj_ids)
@@ -946,8 +952,6 @@ class DataFileResource(MyTardisModelResource):
             template = URITemplate(download_uri_templates[storage_class_name])
             return redirect(template.expand(dfo_id=preferred_dfo.id))
 
-        file_object = file_record.get_file()
-        wrapper = FileWrapper(file_object)
         tracker_data = dict(
             label='file',
             session_id=request.COOKIES.get('_ga'),
@@ -956,10 +960,18 @@ class DataFileResource(MyTardisModelResource):
             total_size=file_record.size,
             num_files=1,
             ua=request.META.get('HTTP_USER_AGENT', None))
-        response = StreamingHttpResponse(
-            IteratorTracker(wrapper, tracker_data),
-            content_type=file_record.mimetype)
-        response['Content-Length'] = file_record.size
+        response = get_offload_response(file_record, dfo=preferred_dfo)
+        if response is not None:
+            track_download(**tracker_data)
+            self.log_throttled_access(request)
+            return response
+
+        file_object = file_record.get_file()
+        response = get_file_response(
+            request, file_object, file_record.mimetype,
+            size=file_record.size, etag=get_datafile_etag(file_record),
+            tracker_data=tracker_data, blksize=8192,
+            storage_box=preferred_dfo.storage_box.name)
         response['Content-Disposition'] = 'attachment; filename="%s"' % \
                                           file_record.filename
         self.log_throttled_access(request)
@@ -1211,7 +1223,8 @@ class ReplicaResource(MyTardisModelResource):
         else:
             bundle.obj.storage_box = datafile.get_default_storage_box()
 
-        bundle.obj.save()
+        # writing an attached file verifies it, or queues its verification
+        bundle.obj.save(skip_verify='file_object' in bundle.data)
         if 'file_object' in bundle.data:
             bundle.obj.file_object = bundle.data['file_object']
             bundle.data['file_object'].close()
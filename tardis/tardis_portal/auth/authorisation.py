@@ -3,14 +3,50 @@ Object-level authorisation backend
 
 .. moduleauthor:: Grischa Meyer <grischa@gmail.com>
 '''
-from django.contrib.auth.models import AnonymousUser
+from django.contrib.auth.models import AnonymousUser, User
 from django.contrib.contenttypes.models import ContentType
 from django.db.models import Q
 from django.db.models.query import QuerySet
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
 
 from ..models.access_control import ObjectACL
 from .token_auth import TokenGroupProvider
 
+# ObjectACL fields which grant each action, as in get_perm_bool
+PERM_FIELDS = {
+    'change': ('canWrite', 'isOwner'),
+    'view': ('canRead', 'isOwner'),
+    'delete': ('canDelete', 'isOwner'),
+    'owns': ('isOwner',),
+    'share': ('isOwner',),
+}
+ACL_FIELDS = ('canRead', 'canWrite', 'canDelete', 'isOwner')
+
+_acl_generation = 0
+
+
+def invalidate_acl_cache():
+    '''
+    Makes the permissions which ACLAwareBackend has cached on user objects
+    in this process stale, e.g. after ObjectACLs are changed with
+    QuerySet.update, which sends no signals
+    '''
+    global _acl_generation
+    _acl_generation += 1
+
+
+@receiver([post_save, post_delete], sender=ObjectACL,
+          dispatch_uid='objectacl_invalidate_acl_cache')
+def objectacl_changed(sender, **kwargs):
+    invalidate_acl_cache()
+
+
+@receiver(m2m_changed, sender=User.groups.through,
+          dispatch_uid='user_groups_invalidate_acl_cache')
+def user_groups_changed(sender, **kwargs):
+    invalidate_acl_cache()
+
 
 class ACLAwareBackend(object):
     supports_object_permissions = True
@@ -37,10 +73,59 @@ class ACLAwareBackend(object):
             return Q(isOwner=True)
         return Q()
 
+    def get_entities(self, user_obj):
+        '''
+        :return: the (pluginId, entityId) pairs of the ObjectACLs which
+            apply to a user, i.e. the user and their groups
+        :rtype: frozenset
+        '''
+        entities = {('django_user', str(user_obj.id))}
+        if user_obj.is_authenticated:
+            for name, group in user_obj.userprofile.ext_groups:
+                entities.add((name, str(group)))
+        else:
+            # the only authorisation available for anonymous users is tokenauth
+            tgp = TokenGroupProvider()
+            for group in tgp.getGroups(user_obj):
+                entities.add((tgp.name, str(group)))
+        return frozenset(entities)
+
+    def get_acl_perms(self, user_obj, cache_obj):
+        '''
+        Loads the effective ObjectACLs of a user with one query, and caches
+        them on cache_obj, usually request.user, so that the rest of the
+        request checks permissions without querying ObjectACLs.  The cache
+        is reloaded when ObjectACLs or the user's groups change.
+
+        :return: the ACL flags granted to the user on each object, as
+            {(content_type_id, object_id): set of ObjectACL field names}
+        :rtype: dict
+        '''
+        entities = self.get_entities(user_obj)
+        cached = getattr(cache_obj, '_acl_perm_cache', None)
+        if cached is not None and cached[0] == _acl_generation and \
+                cached[1] == entities:
+            return cached[2]
+        generation = _acl_generation
+        query = Q()
+        for plugin_id, entity_id in entities:
+            query |= Q(pluginId=plugin_id, entityId=entity_id)
+        perms = {}
+        acls = ObjectACL.objects.filter(query)\
+            .filter(ObjectACL.get_effective_query())\
+            .values_list('content_type_id', 'object_id', *ACL_FIELDS)
+        for acl in acls:
+            flags = perms.setdefault((acl[0], acl[1]), set())
+            flags.update(field for field, value in zip(ACL_FIELDS, acl[2:])
+                         if value)
+        cache_obj._acl_perm_cache = (generation, entities, perms)
+        return perms
+
     def has_perm(self, user_obj, perm, obj=None):
         '''
         main method, calls other methods based on permission type queried
         '''
+        cache_obj = user_obj
         if not user_obj.is_authenticated:
             allowed_tokens = getattr(user_obj, 'allowed_tokens', [])
             user_obj = AnonymousUser()
@@ -93,21 +178,10 @@ class ACLAwareBackend(object):
                     return True
 
         # get_acls
-        obj_acls = ObjectACL.objects\
-            .filter(content_type=ct, object_id=obj.id)\
-            .filter(self.get_perm_bool(perm_action))\
-            .filter(ObjectACL.get_effective_query())
-
-        query = Q(pluginId='django_user',
-                  entityId=str(user_obj.id))
-
-        if user_obj.is_authenticated:
-            for name, group in user_obj.userprofile.ext_groups:
-                query |= Q(pluginId=name, entityId=str(group))
-        else:
-            # the only authorisation available for anonymous users is tokenauth
-            tgp = TokenGroupProvider()
-            for group in tgp.getGroups(user_obj):
-                query |= Q(pluginId=tgp.name, entityId=str(group))
-
-        return obj_acls.filter(query).count() > 0
+        flags = self.get_acl_perms(user_obj, cache_obj).get((ct.id, obj.id))
+        if flags is None:
+            return False
+        if perm_action not in PERM_FIELDS:
+            # any ACL on the object, as get_perm_bool returns Q()
+            return True
+        return any(field in flags for field in PERM_FIELDS[perm_action])
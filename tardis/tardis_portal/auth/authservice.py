@@ -38,18 +38,99 @@ models.py
 """
 from functools import cmp_to_key
 import logging
+import time
 from importlib import import_module
+from uuid import uuid4
 
 from django.conf import settings
+from django.core.cache import caches
 from django.core.exceptions import ImproperlyConfigured
-from django.contrib.auth.models import User
+from django.contrib.auth.models import Group, User
 from django.contrib.auth.models import Permission
+from django.contrib.auth.signals import user_logged_in, user_logged_out
+from django.db.models.signals import m2m_changed, post_delete, post_save, \
+    pre_delete
+from django.dispatch import receiver
 
 from ..auth.localdb_auth import auth_key as localdb_auth_key
 from ..auth.utils import get_or_create_user
 
 logger = logging.getLogger(__name__)
 
+# seconds before the lock of a user's groups, held while a group provider
+# is asked for them, is given up
+GROUPS_LOCK_SECONDS = 10
+GROUPS_LOCK_POLL_SECONDS = 0.05
+GROUPS_LOCK_WAIT_SECONDS = 1
+
+
+def get_groups_cache():
+    return caches[getattr(settings, 'GROUPS_CACHE', 'default')]
+
+
+def _groups_version_key(user_id):
+    return 'ext_groups_version:%s' % user_id
+
+
+def _get_groups_version(cache, user_id, ttl):
+    '''
+    Returns the token which is part of the keys of a user's cached groups,
+    and which changes when they are invalidated
+    '''
+    key = _groups_version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        version = uuid4().hex
+        if not cache.add(key, version, ttl):
+            version = cache.get(key, version)
+    return version
+
+
+def invalidate_groups(user_ids):
+    '''
+    Makes the cached groups of users stale, so that the group providers are
+    asked for them again
+
+    :param user_ids: ids of the users
+    :type user_ids: iterable of int
+    '''
+    ttl = getattr(settings, 'GROUPS_CACHE_SECONDS', 300)
+    if ttl:
+        get_groups_cache().set_many({
+            _groups_version_key(user_id): uuid4().hex
+            for user_id in user_ids}, ttl)
+
+
+@receiver([user_logged_in, user_logged_out],
+          dispatch_uid='auth_invalidate_groups')
+def user_logged_in_or_out(sender, request, user, **kwargs):
+    if user is not None and user.id is not None:
+        invalidate_groups([user.id])
+
+
+@receiver(m2m_changed, sender=User.groups.through,
+          dispatch_uid='user_groups_invalidate_groups')
+def user_groups_changed(sender, instance, action, reverse, pk_set,
+                        **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            invalidate_groups([instance.id])
+    elif action in ('post_add', 'post_remove'):
+        invalidate_groups(pk_set)
+    elif action == 'pre_clear':
+        invalidate_groups(instance.user_set.values_list('id', flat=True))
+
+
+@receiver(pre_delete, sender=Group, dispatch_uid='group_invalidate_groups')
+def group_deleted(sender, instance, **kwargs):
+    invalidate_groups(instance.user_set.values_list('id', flat=True))
+
+
+@receiver([post_save, post_delete], sender='tardis_portal.GroupAdmin',
+          dispatch_uid='groupadmin_invalidate_groups')
+def group_admin_changed(sender, instance, **kwargs):
+    invalidate_groups([instance.user_id])
+
 
 class AuthService():
     """The AuthService provides an interface for querying the
@@ -252,12 +333,55 @@ class AuthService():
         if not self._initialised:
             self._manual_init()
         grouplist = []
+        ttl = getattr(settings, 'GROUPS_CACHE_SECONDS', 300)
+        cache = get_groups_cache() if ttl and user.id is not None else None
+        version = None
         for gp in self._group_providers:
             # logger.debug("group provider: " + gp.name)
-            for group in gp.getGroups(user):
+            if cache is None or not getattr(gp, 'cache_groups', True):
+                groups = gp.getGroups(user)
+            else:
+                if version is None:
+                    version = _get_groups_version(cache, user.id, ttl)
+                groups = self._get_cached_groups(
+                    cache, 'ext_groups:%s:%s:%s' % (gp.name, user.id, version),
+                    gp, user, ttl)
+            for group in groups:
                 grouplist.append((gp.name, group))
         return grouplist
 
+    def _get_cached_groups(self, cache, key, gp, user, ttl):
+        """Return a user's groups from one group provider, via the cache
+        named by GROUPS_CACHE for GROUPS_CACHE_SECONDS.
+
+        When the groups aren't cached, only one process at a time asks the
+        provider for them, and the others wait for its answer, so that a
+        burst of requests doesn't send a burst of queries to e.g. an LDAP
+        server.  If no answer comes within GROUPS_LOCK_WAIT_SECONDS, e.g.
+        because the process holding the lock died, the provider is asked
+        directly.
+        """
+        groups = cache.get(key)
+        if groups is not None:
+            return groups
+        lock_key = '%s:lock' % key
+        deadline = time.monotonic() + GROUPS_LOCK_WAIT_SECONDS
+        while not cache.add(lock_key, True, GROUPS_LOCK_SECONDS):
+            if time.monotonic() >= deadline:
+                groups = list(gp.getGroups(user))
+                cache.set(key, groups, ttl)
+                return groups
+            time.sleep(GROUPS_LOCK_POLL_SECONDS)
+            groups = cache.get(key)
+            if groups is not None:
+                return groups
+        try:
+            groups = list(gp.getGroups(user))
+            cache.set(key, groups, ttl)
+        finally:
+            cache.delete(lock_key)
+        return groups
+
     def searchEntities(self, filter):
         """Return a list of users and/or groups
 
@@ -94,6 +94,11 @@ class UserProvider:
 
 class GroupProvider:
 
+    #: whether AuthService may cache the groups of a user for
+    #: GROUPS_CACHE_SECONDS.  Providers whose groups depend on the request
+    #: rather than the user must set this to False.
+    cache_groups = True
+
     def getGroups(self, user):
         """
         return an iteration of the available groups.
@@ -37,6 +37,11 @@ LDAP Authentication module.
 
 
 import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
 import ldap
 
 from django.conf import settings
@@ -52,6 +57,116 @@ auth_key = u'ldap'
 auth_display_name = u'LDAP'
 
 
+class LDAPConnectionPool(object):
+    """A thread-safe pool of connections to an LDAP server, bound as the
+    admin user if there is one, or anonymously, for searching.
+
+    Connections are reused instead of connecting and binding for each
+    search.  A connection which has been idle for longer than
+    LDAP_POOL_CHECK_SECONDS is checked with a WhoAmI request before it is
+    reused, and searches which find the server gone are retried once on a
+    new connection.
+
+    :param str url: the LDAP server's URL
+    :param str admin_user: DN to bind as, or '' to bind anonymously
+    :param str admin_pass: password of admin_user
+    :param int max_size: most connections open at once, callers wait for
+        a connection when they are all in use
+    """
+
+    def __init__(self, url, admin_user='', admin_pass='', max_size=10):
+        self._url = url
+        self._admin_user = admin_user
+        self._admin_pass = admin_pass
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._lock = threading.Lock()
+        # (connection, time it was returned to the pool)
+        self._idle = deque()
+
+    def _connect(self):
+        conn = ldap.initialize(self._url)
+        conn.protocol_version = ldap.VERSION3
+        try:
+            if self._admin_user and self._admin_pass:
+                conn.simple_bind_s(self._admin_user, self._admin_pass)
+            else:
+                conn.simple_bind_s()
+        except ldap.LDAPError:
+            self._close(conn)
+            raise
+        return conn
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.unbind_s()
+        except ldap.LDAPError:
+            pass
+
+    def _get(self):
+        check_seconds = getattr(settings, 'LDAP_POOL_CHECK_SECONDS', 60)
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                conn, idle_since = self._idle.pop()
+            if time.monotonic() - idle_since <= check_seconds:
+                return conn
+            try:
+                conn.whoami_s()
+                return conn
+            except ldap.LDAPError:
+                logger.debug('discarding stale LDAP connection to %s' %
+                             self._url)
+                self._close(conn)
+        return self._connect()
+
+    @contextmanager
+    def connection(self):
+        """Lends a bound connection for the duration of the block.  The
+        connection is closed instead of being returned to the pool if the
+        block raises an exception.
+        """
+        self._slots.acquire()
+        conn = None
+        try:
+            conn = self._get()
+            yield conn
+        except BaseException:
+            if conn is not None:
+                self._close(conn)
+            raise
+        else:
+            with self._lock:
+                self._idle.append((conn, time.monotonic()))
+        finally:
+            self._slots.release()
+
+    def search_s(self, base, scope, filterstr, attrlist=None):
+        """LDAPObject.search_s on a pooled connection, retried on a new
+        connection if the server has closed the connection
+        """
+        try:
+            with self.connection() as conn:
+                return conn.search_s(base, scope, filterstr, attrlist)
+        except ldap.SERVER_DOWN:
+            logger.info('LDAP connection to %s was lost, reconnecting' %
+                        self._url)
+        # the server has probably closed the idle connections too, e.g.
+        # when it was restarted
+        self.close()
+        with self.connection() as conn:
+            return conn.search_s(base, scope, filterstr, attrlist)
+
+    def close(self):
+        """Closes the idle connections
+        """
+        with self._lock:
+            idle, self._idle = self._idle, deque()
+        for conn, _ in idle:
+            self._close(conn)
+
+
 class LDAPBackend(AuthProvider, UserProvider, GroupProvider):
     def __init__(self, name, url, base, login_attr, user_base,
                  user_attr_map, group_id_attr, group_base,
@@ -80,39 +195,19 @@ class LDAPBackend(AuthProvider, UserProvider, GroupProvider):
         self._group_attr_map = group_attr_map
         self._group_attr_map[self._group_id] = "id"
 
+        # Connections for searching
+        self._pool = LDAPConnectionPool(
+            url, admin_user, admin_pass,
+            max_size=getattr(settings, 'LDAP_POOL_SIZE', 10))
+
     def _query(self, base, filterstr, attrlist):
         """Safely query LDAP
         """
-        l = None
-        searchScope = ldap.SCOPE_SUBTREE
-
         try:
-            l = ldap.initialize(self._url)
+            return self._pool.search_s(base, ldap.SCOPE_SUBTREE,
+                                       filterstr, attrlist)
         except ldap.LDAPError as e:
             logger.error("%s: %s" % (str(e), self._url))
-            return None
-        l.protocol_version = ldap.VERSION3
-
-        try:
-            if self._admin_user and self._admin_pass:
-                l.simple_bind_s(self._admin_user, self._admin_pass)
-            else:
-                l.simple_bind_s()
-        except ldap.LDAPError as e:
-            logger.error(e.args[0]['desc'])
-            if l:
-                l.unbind_s()
-            return None
-
-        try:
-            ldap_result_id = l.search(base, searchScope,
-                                      filterstr, attrlist)
-            _, result_data = l.result(ldap_result_id, 1)
-            return result_data
-        except ldap.LDAPError as e:
-            logger.error(str(e))
-        finally:
-            l and l.unbind_s()
         return None
 
     #
@@ -144,21 +239,23 @@ class LDAPBackend(AuthProvider, UserProvider, GroupProvider):
             except ldap.LDAPError:
                 # We failed to bind using the simple method of constructing
                 # the userDN, so let's query the directory for the userDN.
-                if self._admin_user and self._admin_pass:
-                    l.simple_bind_s(self._admin_user, self._admin_pass)
-                ldap_result = l.search_s(self._base, ldap.SCOPE_SUBTREE,
-                                         userRDN)
+                ldap_result = self._pool.search_s(
+                    self._base, ldap.SCOPE_SUBTREE, userRDN)
                 userDN = ldap_result[0][0]
                 l.simple_bind_s(userDN, password)
 
             # No LDAPError raised so far, so authentication was successful.
-            # Now let's get the attributes we need for this user:
-            if self._admin_user and self._admin_pass:
-                l.simple_bind_s(self._admin_user, self._admin_pass)
+            # Now let's get the attributes we need for this user, as the
+            # admin user if there is one, or else as the user:
             retrieveAttributes = list(self._user_attr_map.keys()) + \
                                  [self._login_attr]
-            ldap_result = l.search_s(self._base, ldap.SCOPE_SUBTREE,
-                                     userRDN, retrieveAttributes)
+            if self._admin_user and self._admin_pass:
+                ldap_result = self._pool.search_s(
+                    self._base, ldap.SCOPE_SUBTREE, userRDN,
+                    retrieveAttributes)
+            else:
+                ldap_result = l.search_s(self._base, ldap.SCOPE_SUBTREE,
+                                         userRDN, retrieveAttributes)
 
             if ldap_result[0][1][self._login_attr][0] == username.encode():
                 # check if the given username in combination with the LDAP
@@ -213,15 +310,13 @@ class LDAPBackend(AuthProvider, UserProvider, GroupProvider):
             #input is username not email so return username
             return email
 
-        l = None
         try:
             retrieveAttributes = [self._login_attr]
-            l = ldap.initialize(self._url)
-            l.protocol_version = ldap.VERSION3
             searchFilter = '(|(mail=%s)(mailalternateaddress=%s))' % (email,
                                                                       email)
-            ldap_result = l.search_s(self._base, ldap.SCOPE_SUBTREE,
-                                      searchFilter, retrieveAttributes)
+            ldap_result = self._pool.search_s(
+                self._base, ldap.SCOPE_SUBTREE, searchFilter,
+                retrieveAttributes)
 
             logger.debug(ldap_result)
             if ldap_result[0][1][self._login_attr][0]:
@@ -234,9 +329,6 @@ class LDAPBackend(AuthProvider, UserProvider, GroupProvider):
         except IndexError:
             logger.exception("index error")
             return None
-        finally:
-            if l:
-                l.unbind_s()
 
     #
     # Group Provider
@@ -328,6 +420,8 @@ def ldap_auth(force_create=False):
     global _ldap_auth
     if _ldap_auth and not force_create:
         return _ldap_auth
+    if _ldap_auth:
+        _ldap_auth._pool.close()
     try:
         base = settings.LDAP_BASE
     except:
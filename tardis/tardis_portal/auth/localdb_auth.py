@@ -54,6 +54,8 @@ class DjangoAuthBackend(AuthProvider):
 
 class DjangoGroupProvider(GroupProvider):
     name = u'django_group'
+    # one indexed query, no slower than fetching the groups from a cache
+    cache_groups = False
 
     def getGroups(self, user):
         """return an iteration of the available groups.
@@ -23,6 +23,8 @@ class TokenGroupProvider(GroupProvider):
     Transforms tokens into auth groups
     '''
     name = u'token_group'
+    # the tokens are those of the user's session
+    cache_groups = False
 
     def getGroups(self, user):
         if hasattr(user, 'allowed_tokens'):
@@ -10,7 +10,15 @@ download.py
 import logging
 import urllib
 import os
+import queue
+import re
+import struct
+import threading
 import time
+from array import array
+from collections import deque
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
 from importlib import import_module
 
 try:
@@ -21,24 +29,38 @@ except ImportError:
     import binascii
     crc32 = binascii.crc32
 
-from itertools import chain
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from bisect import bisect_left, bisect_right
+from urllib.parse import quote
 import tarfile
 from tarfile import TarFile
-import gzip
+import hashlib
 import io
 from wsgiref.util import FileWrapper
 
-from django.http import StreamingHttpResponse
+from django.db.models import prefetch_related_objects, Q, Sum
+from django.db.models.query import QuerySet
+from django.http import HttpResponse, StreamingHttpResponse
 from django.conf import settings
+from django.utils import timezone
 from django.utils.dateformat import format as dateformatter
 from django.core.exceptions import ImproperlyConfigured
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
 from django.contrib.auth.decorators import login_required
 
+from tardis.analytics.metrics import metrics_enabled, observe_storage_read
 from tardis.analytics.tracker import IteratorTracker
 from .models import Dataset
 from .models import DataFile
 from .models import DataFileObject
 from .models import Experiment
+from .models import StorageBox
+from .auth.decorators import get_downloadable_datafiles
 from .auth.decorators import has_datafile_download_access
 from .auth.decorators import experiment_download_required
 from .auth.decorators import dataset_download_required
@@ -52,6 +74,264 @@ logger = logging.getLogger(__name__)
 
 DEFAULT_ORGANIZATION = settings.DEFAULT_PATH_MAPPER
 
+# compression used for each archive comptype
+ARCHIVE_COMPRESSION = {
+    'tar': None,
+    'tgz': 'gzip',
+    'tar.zst': 'zstd',
+}
+
+# content type and file name suffix of archives for each compression
+ARCHIVE_CONTENT_TYPES = {
+    None: ('application/x-tar', ''),
+    'gzip': ('application/x-gzip', '.gz'),
+    'zstd': ('application/zstd', '.zst'),
+}
+
+
+RANGE_HEADER_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class RangeNotSatisfiable(Exception):
+    """
+    Raised when a requested byte range lies outside of the file
+    """
+
+
+def parse_range_header(range_header, size):
+    """
+    Parses a single byte range from an HTTP Range header.
+
+    Multiple ranges and malformed headers are ignored, as allowed by
+    RFC 7233, in which case the whole file should be sent.
+
+    :param str range_header: value of the Range header or None
+    :param int size: size of the file in bytes
+    :returns: inclusive (start, end) byte positions or None
+    :rtype: tuple
+    :raises RangeNotSatisfiable: if the range does not overlap the file
+    """
+    if not range_header:
+        return None
+    match = RANGE_HEADER_RE.match(range_header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if first == '':
+        if last == '':
+            return None
+        # suffix range, i.e. the last N bytes
+        suffix_length = int(last)
+        if suffix_length == 0 or size == 0:
+            raise RangeNotSatisfiable()
+        return max(size - suffix_length, 0), size - 1
+    start = int(first)
+    end = size - 1 if last == '' else min(int(last), size - 1)
+    if last != '' and int(last) < start:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable()
+    return start, end
+
+
+def get_datafile_etag(datafile):
+    """
+    Returns a strong ETag derived from the DataFile's checksum, or None if
+    the DataFile has no checksum
+    """
+    if datafile.sha512sum:
+        return '"sha512-%s"' % datafile.sha512sum
+    if datafile.md5sum:
+        return '"md5-%s"' % datafile.md5sum
+    return None
+
+
+def _if_range_matches(request, etag):
+    """
+    A Range request is only honoured if the If-Range validator (when
+    supplied) matches the current ETag.  HTTP-date validators are treated
+    as not matching, so the whole file is sent instead.
+    """
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if if_range is None:
+        return True
+    return etag is not None and if_range.strip() == etag
+
+
+def get_storage_box_name(datafile, verified_only=True):
+    """
+    returns the name of the storage box a DataFile is read from, to label
+    download metrics, or None if metrics aren't recorded
+    """
+    if not metrics_enabled():
+        return None
+    dfo = datafile.get_preferred_dfo(verified_only)
+    if dfo is None:
+        return None
+    return dfo.storage_box.name
+
+
+def _timed_read(read, storage_box):
+    def timed_read(size):
+        start_time = time.time()
+        try:
+            return read(size)
+        finally:
+            observe_storage_read(storage_box, time.time() - start_time)
+    return timed_read
+
+
+def read_file_range(file_obj, start, length, blksize=65535,
+                    storage_box=None):
+    """
+    Generator which yields length bytes of file_obj, starting at start, or
+    the rest of the file if length is None.
+    Seeks to the start position when the storage backend allows it,
+    otherwise reads and discards the leading bytes.
+    The latency of each read is recorded in the download metrics for
+    storage_box, if given.
+    """
+    read = file_obj.read
+    if storage_box is not None:
+        read = _timed_read(read, storage_box)
+    try:
+        try:
+            file_obj.seek(start)
+        except (AttributeError, IOError, io.UnsupportedOperation):
+            skip = start
+            while skip > 0:
+                buf = read(min(blksize, skip))
+                if not buf:
+                    raise IOError("end of file reached")
+                skip -= len(buf)
+        remaining = length
+        while remaining is None or remaining > 0:
+            buf = read(blksize if remaining is None
+                       else min(blksize, remaining))
+            if not buf:
+                if remaining is None:
+                    return
+                raise IOError("end of file reached")
+            if remaining is not None:
+                remaining -= len(buf)
+            yield buf
+    finally:
+        file_obj.close()
+
+
+def get_file_response(request, file_obj, content_type, size=None, etag=None,
+                      tracker_data=None, blksize=65535, storage_box=None,
+                      label='file'):
+    """
+    Creates a streaming response for file_obj.
+
+    If the size of the file is known, single byte range requests are
+    honoured with a 206 Partial Content response, so that clients can
+    resume interrupted downloads or fetch segments in parallel.  If-Range
+    validators are compared against etag.
+
+    :param request: the HttpRequest
+    :param file_obj: file-like object to be sent
+    :param str content_type: MIME type of the response
+    :param int size: size of the file in bytes, or None if unknown
+    :param str etag: strong ETag for the file contents, or None
+    :param dict tracker_data: data for an IteratorTracker, or None
+    :param int blksize: read size
+    :param str storage_box: name of the storage box the file is read from,
+        for download metrics
+    :param str label: the kind of download, for the download metrics
+    :returns: response
+    :rtype: StreamingHttpResponse or HttpResponse
+    """
+    byte_range = None
+    if size is not None and _if_range_matches(request, etag):
+        try:
+            byte_range = parse_range_header(
+                request.META.get('HTTP_RANGE'), size)
+        except RangeNotSatisfiable:
+            file_obj.close()
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */%d' % size
+            return response
+    if byte_range is None:
+        iterator = read_file_range(file_obj, 0, None, blksize, storage_box)
+        content_length = size
+        status = 200
+    else:
+        start, end = byte_range
+        content_length = end - start + 1
+        iterator = read_file_range(file_obj, start, content_length, blksize,
+                                   storage_box)
+        status = 206
+    if tracker_data is not None:
+        tracker_data['total_size'] = content_length
+    iterator = IteratorTracker(iterator, tracker_data, label=label)
+    response = StreamingHttpResponse(iterator, status=status,
+                                     content_type=content_type)
+    if size is not None:
+        response['Accept-Ranges'] = 'bytes'
+        response['Content-Length'] = content_length
+    if byte_range is not None:
+        response['Content-Range'] = 'bytes %d-%d/%d' % (start, end, size)
+    if etag is not None:
+        response['ETag'] = etag
+    return response
+
+
+def get_offload_location(dfo):
+    '''
+    returns the value of the DOWNLOAD_OFFLOAD_HEADER which makes the web
+    server send the file of a DataFileObject, or None if the file can't be
+    sent by the web server
+    '''
+    header = getattr(settings, 'DOWNLOAD_OFFLOAD_HEADER', None)
+    if not header or dfo is None or not dfo.uri or \
+            dfo.storage_type in StorageBox.offline_types or \
+            not isinstance(dfo._storage, FileSystemStorage):
+        return None
+    location = getattr(settings, 'DOWNLOAD_OFFLOAD_LOCATIONS', {}).get(
+        dfo.storage_box.name)
+    if header.lower() == 'x-accel-redirect':
+        # nginx needs an internal location for each storage box
+        if location is None:
+            return None
+        return '%s/%s' % (location.rstrip('/'), quote(dfo.uri))
+    if location is None:
+        return dfo.get_full_path()
+    return os.path.join(location, dfo.uri)
+
+
+def get_offload_response(datafile, disposition='attachment',
+                         verified_only=True, dfo=None):
+    '''
+    Creates a response with an X-Accel-Redirect or X-Sendfile header, as
+    set by DOWNLOAD_OFFLOAD_HEADER, so that the web server sends the file
+    of a DataFile instead of the application.  The web server handles
+    range requests for offloaded downloads.
+
+    :param DataFile datafile: the DataFile to send
+    :param str disposition: 'attachment' or 'inline'
+    :param bool verified_only: if False files without verified checksums
+        may be sent
+    :param DataFileObject dfo: the DataFileObject to send, defaults to the
+        DataFile's preferred DataFileObject
+    :returns: response, or None if the download can't be offloaded
+    :rtype: HttpResponse
+    '''
+    header = getattr(settings, 'DOWNLOAD_OFFLOAD_HEADER', None)
+    if not header:
+        return None
+    if dfo is None:
+        dfo = datafile.get_preferred_dfo(verified_only)
+    location = get_offload_location(dfo)
+    if location is None:
+        return None
+    response = HttpResponse(content_type=datafile.get_mimetype())
+    response[header] = location
+    response['Content-Disposition'] = \
+        '%s; filename="%s"' % (disposition, datafile.filename)
+    return response
+
 
 def _create_download_response(request, datafile_id, disposition='attachment'):  # too complex # noqa
     # Get datafile (and return 404 if absent)
@@ -82,6 +362,10 @@ def _create_download_response(request, datafile_id, disposition='attachment'):
         if ignore_verif.lower() in [u'', u'1', u'true']:
             verified_only = False
 
+        response = get_offload_response(datafile, disposition, verified_only)
+        if response is not None:
+            return response
+
         # Get file object for datafile
         file_obj = datafile.get_file(verified_only=verified_only)
         if not file_obj:
@@ -92,9 +376,16 @@ def _create_download_response(request, datafile_id, disposition='attachment'):
                                             "please try again later.",
                                             status=503)
             return return_response_not_found(request)
-        wrapper = FileWrapper(file_obj, blksize=65535)
-        response = StreamingHttpResponse(wrapper,
-                                         content_type=datafile.get_mimetype())
+        # byte ranges are only offered when the recorded size and checksum
+        # have been verified against the stored file
+        if verified_only:
+            size = datafile.size
+            etag = get_datafile_etag(datafile)
+        else:
+            size = etag = None
+        response = get_file_response(
+            request, file_obj, datafile.get_mimetype(), size=size, etag=etag,
+            storage_box=get_storage_box_name(datafile, verified_only))
         response['Content-Disposition'] = \
             '%s; filename="%s"' % (disposition, datafile.filename)
         return response
@@ -187,6 +478,64 @@ def classic_mapper(rootdir):
     return _get_filename
 
 
+def _chunks(items, size=500):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def prefetch_archive_details(datafiles):
+    '''
+    Loads everything the path mappers and the tar stream need for a list of
+    DataFiles with a few queries per chunk of files, instead of several
+    queries per file:
+
+    - DataFiles in the same Dataset share one Dataset instance, whose first
+      Experiment has already been looked up, so path prefixes derived from
+      the dataset and experiment cost no queries
+    - the preferred verified DataFileObject of each DataFile is picked from
+      a single query, and DataFileObjects in the same StorageBox share a
+      box instance with its type and storage options already loaded
+
+    :param list datafiles: DataFile instances, which are updated in place
+    '''
+    datasets = {}
+    for dataset_ids in _chunks({df.dataset_id for df in datafiles}):
+        datasets.update(Dataset.objects.in_bulk(dataset_ids))
+        links = Dataset.experiments.through.objects.filter(
+            dataset_id__in=dataset_ids).select_related('experiment')\
+            .order_by('-experiment__created_time')
+        # the earliest experiment of each dataset is assigned last
+        for link in links:
+            datasets[link.dataset_id]._cached_first_experiment = \
+                link.experiment
+    for df in datafiles:
+        df.dataset = datasets[df.dataset_id]
+
+    by_id = {df.id: df for df in datafiles}
+    boxes = {}
+    preferred = {}
+    for datafile_ids in _chunks(by_id):
+        dfos = DataFileObject.objects.filter(
+            datafile_id__in=datafile_ids, verified=True)\
+            .select_related('storage_box')
+        for dfo in dfos:
+            box = boxes.get(dfo.storage_box_id)
+            if box is None:
+                box = boxes[dfo.storage_box_id] = dfo.storage_box
+                prefetch_related_objects([box], 'options')
+                box._cached_storage_type = box.storage_type
+            dfo.storage_box = box
+            dfo.datafile = by_id[dfo.datafile_id]
+            current = preferred.get(dfo.datafile_id)
+            if current is None or \
+                    StorageBox.type_order.index(box.storage_type) < \
+                    StorageBox.type_order.index(current.storage_type):
+                preferred[dfo.datafile_id] = dfo
+    for datafile_id, dfo in preferred.items():
+        by_id[datafile_id]._cached_preferred_dfo = dfo
+
+
 def _get_datafile_details_for_archive(mapper, datafiles):
     # It would be simplest to do this lazily.  But if we do that, we implicitly
     # passing the database context to the thread that will write the archive,
@@ -194,21 +543,206 @@ def _get_datafile_details_for_archive(mapper, datafiles):
     # populate the list eagerly, but with a file getter rather than the file
     # itself.  If we populate with actual File objects, we risk running out
     # of file descriptors.
+    datafiles = list(datafiles)
+    prefetch_archive_details(datafiles)
     res = []
     for df in datafiles:
         mapped_pathname = mapper(df)
         if mapped_pathname:
-            res.append((df, mapper(df)))
+            res.append((df, mapped_pathname))
     return res
 
 
+class MemberPrefetcher(object):
+    '''
+    Reads the contents of one archive member on a worker thread into a
+    bounded queue, so that slow storage can be read ahead of the member
+    currently being streamed.
+
+    The file object must already be open, so that no database access
+    happens on the worker thread.
+    '''
+
+    def __init__(self, fileobj, size, buffersize, max_chunks, stop_event,
+                 offset=0, storage_box=None):
+        self.fileobj = fileobj
+        self.storage_box = storage_box
+        self.size = size
+        self.offset = offset
+        self.buffersize = buffersize
+        self.stop_event = stop_event
+        self.chunks = queue.Queue(maxsize=max_chunks)
+
+    def run(self):
+        reader = read_file_range(self.fileobj, self.offset,
+                                 self.size - self.offset, self.buffersize,
+                                 self.storage_box)
+        try:
+            for buf in reader:
+                if self.stop_event.is_set():
+                    return
+                self._put(buf)
+            self._put(None)
+        except Exception as e:
+            self._put(e)
+        finally:
+            reader.close()
+
+    def _put(self, item):
+        while not self.stop_event.is_set():
+            try:
+                self.chunks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def __iter__(self):
+        while True:
+            item = self.chunks.get()
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+
+_compression_executor = None
+_compression_executor_lock = threading.Lock()
+
+
+def get_compression_workers():
+    '''
+    number of threads used to compress each archive download, 0 meaning
+    compression happens in the request thread
+    '''
+    workers = getattr(settings, 'DOWNLOAD_COMPRESSION_WORKERS', None)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    return workers
+
+
+def _get_compression_executor():
+    '''
+    returns the worker pool shared by all archive downloads in this
+    process, so concurrent downloads can't use more than
+    DOWNLOAD_COMPRESSION_WORKERS cores between them
+    '''
+    global _compression_executor
+    with _compression_executor_lock:
+        if _compression_executor is None:
+            _compression_executor = ThreadPoolExecutor(
+                max_workers=get_compression_workers())
+        return _compression_executor
+
+
+def gzip_member(data, comp_level=6):
+    '''
+    compresses data into a complete gzip member.  The header has no file
+    name or modification time, so output only depends on the input.
+    '''
+    compressor = zlib.compressobj(comp_level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return b''.join([
+        b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff',
+        compressor.compress(data),
+        compressor.flush(),
+        struct.pack('<LL', crc32(data) & 0xffffffff,
+                    len(data) & 0xffffffff)])
+
+
+class ParallelGzipCompressor(object):
+    '''
+    Compresses a stream into a series of independent gzip members of
+    block_size uncompressed bytes each, like pigz does.  Concatenated
+    gzip members form a valid gzip file, so blocks are compressed on a
+    pool of worker threads (zlib releases the GIL while compressing) and
+    the results are emitted in order.
+    '''
+
+    def __init__(self, comp_level=6, block_size=1024*1024, workers=None):
+        self.comp_level = comp_level
+        self.block_size = block_size
+        if workers is None:
+            workers = get_compression_workers()
+        self.executor = _get_compression_executor() if workers > 0 \
+            else None
+        self.max_pending = 2 * max(workers, 1)
+        self.uncompressed = []
+        self.uncompressed_size = 0
+        self.pending = deque()
+
+    def _submit(self, block):
+        if self.executor is None:
+            return gzip_member(block, self.comp_level)
+        self.pending.append(
+            self.executor.submit(gzip_member, block, self.comp_level))
+        return b''
+
+    def _collect(self, wait_for):
+        '''
+        returns compressed blocks in order, waiting for the oldest ones
+        until no more than wait_for blocks are pending
+        '''
+        result = []
+        while self.pending and (len(self.pending) > wait_for or
+                                self.pending[0].done()):
+            result.append(self.pending.popleft().result())
+        return b''.join(result)
+
+    def compress(self, buf):
+        self.uncompressed.append(buf)
+        self.uncompressed_size += len(buf)
+        if self.uncompressed_size < self.block_size:
+            return b''
+        data = b''.join(self.uncompressed)
+        result = []
+        offset = 0
+        while len(data) - offset >= self.block_size:
+            result.append(self._submit(
+                data[offset:offset + self.block_size]))
+            offset += self.block_size
+        self.uncompressed = [data[offset:]]
+        self.uncompressed_size = len(data) - offset
+        result.append(self._collect(self.max_pending))
+        return b''.join(result)
+
+    def flush(self):
+        result = []
+        if self.uncompressed_size:
+            result.append(self._submit(b''.join(self.uncompressed)))
+        self.uncompressed = []
+        self.uncompressed_size = 0
+        result.append(self._collect(0))
+        return b''.join(result)
+
+
+class ZstdCompressor(object):
+    '''
+    Compresses a stream into zstd frames, using zstd's own worker threads
+    '''
+
+    def __init__(self, comp_level=3, workers=None):
+        if workers is None:
+            workers = get_compression_workers()
+        self.compressobj = zstandard.ZstdCompressor(
+            level=comp_level, threads=workers).compressobj()
+
+    def compress(self, buf):
+        return self.compressobj.compress(buf)
+
+    def flush(self):
+        return self.compressobj.flush()
+
+
 class UncachedTarStream(TarFile):
     '''
     Stream files into a compressed tar stream on the fly
     '''
 
     def __init__(self, mapped_file_objs, filename, do_gzip=False,
-                 buffersize=2*65536, comp_level=6, http_buffersize=65535):
+                 buffersize=2*65536, comp_level=6, http_buffersize=65535,
+                 prefetch_depth=None, prefetch_buffer_size=None,
+                 compression=None, compression_workers=None,
+                 compression_block_size=None):
         self.errors = 'strict'
         self.pax_headers = {}
         self.mode = 'w'
@@ -225,28 +759,59 @@ class UncachedTarStream(TarFile):
         self.filename = filename
         self.buffersize = buffersize
         self.http_buffersize = http_buffersize
-        self.do_gzip = do_gzip
-        if do_gzip:
-            self.binary_buffer = io.BytesIO()
-            self.gzipfile = gzip.GzipFile(bytes(filename), 'w',
-                                          comp_level, self.binary_buffer)
+        if prefetch_depth is None:
+            prefetch_depth = getattr(settings, 'DOWNLOAD_PREFETCH_DEPTH', 2)
+        if prefetch_buffer_size is None:
+            prefetch_buffer_size = getattr(
+                settings, 'DOWNLOAD_PREFETCH_BUFFER_SIZE', 64*1024*1024)
+        self.prefetch_depth = prefetch_depth
+        self.prefetch_buffer_size = prefetch_buffer_size
+        if compression is None and do_gzip:
+            compression = 'gzip'
+        self.compression = compression
+        self.comp_level = comp_level
+        self.compression_workers = compression_workers
+        if compression_block_size is None:
+            compression_block_size = getattr(
+                settings, 'DOWNLOAD_COMPRESSION_BLOCK_SIZE', 1024*1024)
+        self.compression_block_size = compression_block_size
+        self.compressor = None
+        self.deterministic = True
+        self.etag = None
         self.tar_size = self.compute_size()
 
     def compute_size(self):
+        '''
+        computes the size of the uncompressed archive, along with the tar
+        headers of all members, the offset of each member in the archive
+        and an ETag identifying the archive contents
+        '''
         total_size = 0
+        self.member_offsets = []
+        etag_hasher = hashlib.md5()
         for num, fobj in enumerate(self.mapped_file_objs):
             df, name = fobj
+            self.member_offsets.append(total_size)
             tarinfo = self.tarinfo_for_df(df, name)
             self.tarinfos[num] = tarinfo
             tarinfo_buf = tarinfo.tobuf(self.format, self.encoding,
                                         self.errors)
             self.tarinfo_bufs[num] = tarinfo_buf
+            etag_hasher.update(tarinfo_buf)
+            checksum = df.sha512sum or df.md5sum
+            if checksum:
+                etag_hasher.update(checksum.encode())
+            else:
+                self.deterministic = False
             total_size += len(tarinfo_buf)
             size = int(tarinfo.size)
             blocks, remainder = divmod(size, tarfile.BLOCKSIZE)
             if remainder > 0:
                 blocks += 1
             total_size += blocks * tarfile.BLOCKSIZE
+        self.member_offsets.append(total_size)
+        if self.deterministic:
+            self.etag = '"%s"' % etag_hasher.hexdigest()
         blocks, remainder = divmod(total_size, tarfile.RECORDSIZE)
         if remainder > 0:
             blocks += 1
@@ -267,19 +832,24 @@ class UncachedTarStream(TarFile):
             tarinfo.mtime = float(dateformatter(dj_mtime, 'U'))
         else:
             tarinfo.mtime = time.time()
+            # the archive will differ between requests
+            self.deterministic = False
         return tarinfo
 
+    def make_compressor(self):
+        if self.compression == 'gzip':
+            return ParallelGzipCompressor(
+                self.comp_level, self.compression_block_size,
+                self.compression_workers)
+        if self.compression == 'zstd':
+            return ZstdCompressor(workers=self.compression_workers)
+        return None
+
     def compress(self, buf):
-        self.gzipfile.write(buf)
-        self.gzipfile.flush()
-        self.binary_buffer.seek(0)
-        result = self.binary_buffer.read()
-        self.binary_buffer.seek(0)
-        self.binary_buffer.truncate()
-        return result
+        return self.compressor.compress(buf)
 
     def prepare_output(self, uc_buf, remainder):
-        if self.do_gzip:
+        if self.compressor is not None:
             result_buf = self.compress(uc_buf)
         else:
             result_buf = uc_buf
@@ -291,125 +861,573 @@ class UncachedTarStream(TarFile):
             result_buf = result_buf[self.http_buffersize:]
         return stream_buffers, result_buf
 
-    def close_gzip(self):
-        self.gzipfile.close()
-        self.binary_buffer.seek(0)
-        result = self.binary_buffer.read()
-        self.binary_buffer.seek(0)
-        self.binary_buffer.truncate()
+    def close_compressor(self):
+        result = self.compressor.flush()
+        self.compressor = None
         return result
 
-    def make_tar(self):  # noqa
+    def iter_members(self, first=0):
         '''
-        main tar generator. until python 3 needs to be in one function
-        because 'yield's don't bubble up.
+        yields (datafile, tarinfo, tarinfo_buf) for each member, starting
+        with member number first
+        '''
+        for num in range(first, len(self.mapped_file_objs)):
+            df, dummy_name = self.mapped_file_objs[num]
+            yield df, self.tarinfos[num], self.tarinfo_bufs[num]
+
+    def member_data(self, members, data_offset=0):
+        '''
+        yields (tarinfo, tarinfo_buf, data) for each member, where data is
+        an iterator over the member's file contents, starting data_offset
+        bytes into the first member
+        '''
+        for df, tarinfo, tarinfo_buf in members:
+            yield tarinfo, tarinfo_buf, read_file_range(
+                df.file_object, data_offset, tarinfo.size - data_offset,
+                self.buffersize, get_storage_box_name(df))
+            data_offset = 0
+
+    def prefetched_member_data(self, members, data_offset=0):
+        '''
+        like member_data, while the next prefetch_depth members are opened
+        and read on background threads.  The prefetch buffer size is shared
+        between all members being read concurrently.
+        '''
+        max_chunks = max(1, self.prefetch_buffer_size // (
+            (self.prefetch_depth + 1) * self.buffersize))
+        stop_event = threading.Event()
+        executor = ThreadPoolExecutor(max_workers=self.prefetch_depth + 1)
+        pending = deque()
+        try:
+            while True:
+                while len(pending) <= self.prefetch_depth:
+                    try:
+                        df, tarinfo, tarinfo_buf = next(members)
+                    except StopIteration:
+                        break
+                    prefetcher = MemberPrefetcher(
+                        df.file_object, tarinfo.size,
+                        self.buffersize, max_chunks, stop_event,
+                        offset=data_offset,
+                        storage_box=get_storage_box_name(df))
+                    data_offset = 0
+                    executor.submit(prefetcher.run)
+                    pending.append((tarinfo, tarinfo_buf, prefetcher))
+                if not pending:
+                    return
+                yield pending.popleft()
+        finally:
+            # unblocks and stops readers if the download was aborted
+            stop_event.set()
+            executor.shutdown(wait=False)
+
+    def make_tar(self, start=0):  # noqa
+        '''
+        main tar generator
+
+        :param int start: position in the uncompressed archive to start
+            streaming from.  Members before it are skipped without being
+            opened and the first member's data is read from the right
+            offset, using the member offset index built by compute_size
         '''
         remainder_buf = None
-        for num, fobj in enumerate(self.mapped_file_objs):
-            df, dummy_name = fobj
-            fileobj = df.file_object
+        self.compressor = self.make_compressor()
+        first = skip = data_offset = self.offset = 0
+        if start:
+            first = bisect_right(self.member_offsets, start) - 1
+            skip = start - self.member_offsets[first]
+            self.offset = self.member_offsets[first]
+            if first < len(self.tarinfos):
+                data_offset = min(
+                    max(skip - len(self.tarinfo_bufs[first]), 0),
+                    self.tarinfos[first].size)
+        members = self.iter_members(first)
+        if self.prefetch_depth > 0:
+            member_data = self.prefetched_member_data(members, data_offset)
+        else:
+            member_data = self.member_data(members, data_offset)
+        for tarinfo, tarinfo_buf, data in member_data:
             self._check('aw')
-            tarinfo = self.tarinfos[num]
-            buf = self.tarinfo_bufs[num]
+            buf = tarinfo_buf
+            self.offset += len(buf)
+            if skip:
+                buf = buf[skip:]
+                skip = max(skip - len(tarinfo_buf), 0)
+                # the data iterator already starts after these bytes
+                skip -= min(skip, tarinfo.size)
             stream_buffers, remainder_buf = self.prepare_output(
                 buf,
                 remainder_buf)
             for stream_buf in stream_buffers:
                 yield stream_buf
-            self.offset += len(buf or '')
-            if tarinfo.isreg():
-                if tarinfo.size == 0:
-                    continue
-                # split into file read buffer sized chunks
-                blocks, remainder = divmod(tarinfo.size, self.buffersize)
-                for dummy_b in range(blocks):
-                    buf = fileobj.read(self.buffersize)
-                    if len(buf) < self.buffersize:
-                        raise IOError("end of file reached")
-                    # send in http_buffersize sized chunks
-                    stream_buffers, remainder_buf = self.prepare_output(
-                        buf, remainder_buf)
-                    for stream_buf in stream_buffers:
-                        yield stream_buf
-                # in case the file has remaining read bytes
-                if remainder != 0:
-                    buf = fileobj.read(remainder)
-                    if len(buf) < remainder:
-                        raise IOError("end of file reached")
-                    # send remaining file data
-                    stream_buffers, remainder_buf = self.prepare_output(
-                        buf, remainder_buf)
-                    for stream_buf in stream_buffers:
-                        yield stream_buf
+            # send in http_buffersize sized chunks
+            for buf in data:
+                stream_buffers, remainder_buf = self.prepare_output(
+                    buf, remainder_buf)
+                for stream_buf in stream_buffers:
+                    yield stream_buf
+            if tarinfo.isreg() and tarinfo.size > 0:
                 blocks, remainder = divmod(tarinfo.size, tarfile.BLOCKSIZE)
                 if remainder > 0:
                     buf = (tarfile.NUL * (tarfile.BLOCKSIZE - remainder))
+                    buf = buf[skip:]
+                    skip = 0
                     stream_buffers, remainder_buf = self.prepare_output(
                         buf, remainder_buf)
                     for stream_buf in stream_buffers:
                         yield stream_buf
                     blocks += 1
                 self.offset += blocks * tarfile.BLOCKSIZE
-            fileobj.close()
         # fill up the end with zero-blocks
         # (like option -b20 for tar does)
         blocks, remainder = divmod(self.offset, tarfile.RECORDSIZE)
         if remainder > 0:
             buf = tarfile.NUL * (tarfile.RECORDSIZE - remainder)
+            buf = buf[skip:]
             stream_buffers, remainder_buf = self.prepare_output(
                 buf, remainder_buf)
             for stream_buf in stream_buffers:
                 yield stream_buf
         if remainder_buf:
             yield remainder_buf
-        if self.do_gzip:
-            yield self.close_gzip()
+        if self.compressor is not None:
+            yield self.close_compressor()
+
+    def make_tar_range(self, start, end):
+        '''
+        generates the inclusive byte range start-end of the uncompressed
+        archive
+        '''
+        remaining = end - start + 1
+        for buf in self.make_tar(start):
+            if len(buf) >= remaining:
+                yield buf[:remaining]
+                return
+            remaining -= len(buf)
+            yield buf
+
+    @property
+    def seekable(self):
+        '''
+        byte ranges can only be served for uncompressed archives which are
+        identical between requests
+        '''
+        return self.compression is None and self.etag is not None
+
+    @property
+    def content_type(self):
+        return ARCHIVE_CONTENT_TYPES[self.compression][0]
 
-    def get_response(self, tracker_data=None):
-        if self.do_gzip:
-            content_type = 'application/x-gzip'
+    @property
+    def archive_filename(self):
+        '''
+        file name of the archive, including the compression suffix
+        '''
+        return self.filename + ARCHIVE_CONTENT_TYPES[self.compression][1]
+
+    def get_response(self, tracker_data=None, byte_range=None):
+        content_type = self.content_type
+        if self.compression is None:
+            content_length = self.tar_size
+        else:
             content_length = None
-            self.filename += '.gz'
+        if byte_range is None:
+            status = 200
+            file_iterator = self.make_tar()
         else:
-            content_type = 'application/x-tar'
-            content_length = self.tar_size
-        file_iterator = IteratorTracker(self.make_tar(), tracker_data)
-        response = StreamingHttpResponse(file_iterator,
+            status = 206
+            start, end = byte_range
+            content_length = end - start + 1
+            file_iterator = self.make_tar_range(start, end)
+        if tracker_data is not None:
+            tracker_data['total_size'] = content_length
+        file_iterator = IteratorTracker(file_iterator, tracker_data,
+                                        label='tar')
+        response = StreamingHttpResponse(file_iterator, status=status,
                                          content_type=content_type)
         response['Content-Disposition'] = 'attachment; filename="%s"' % \
-                                          self.filename
+                                          self.archive_filename
         response['X-Accel-Buffering'] = 'no'
         if content_length is not None:
             response['Content-Length'] = content_length
+        if self.seekable:
+            response['Accept-Ranges'] = 'bytes'
+            response['ETag'] = self.etag
+        if byte_range is not None:
+            response['Content-Range'] = 'bytes %d-%d/%d' % (
+                start, end, self.tar_size)
         return response
 
 
+class StreamingTarStream(UncachedTarStream):
+    '''
+    Tar stream for archives with very many members, which keeps 16 bytes
+    per member in memory rather than its DataFile and tar header.
+
+    When the archive size is computed, all of the DataFiles are read in
+    chunks, and the ids and sizes of the members are recorded in compact
+    arrays.  Exactly those members, with those sizes, are streamed, so that
+    DataFiles added or changed in between don't make the archive differ
+    from its Content-Length.  Each member's tar header is built just before
+    its data is sent.  The size of a member's header only depends on the
+    length of its path in the GNU tar format, so no headers are kept.
+
+    There is no ETag or member offset index, so byte ranges are not
+    supported and the archive can't be cached, see
+    DOWNLOAD_STREAMING_ARCHIVE_THRESHOLD.
+    '''
+    format = tarfile.GNU_FORMAT
+
+    def __init__(self, datafiles, mapper, filename, chunk_size=2000,
+                 **kwargs):
+        self.datafiles = datafiles
+        self.mapper = mapper
+        self.chunk_size = chunk_size
+        self.num_files = 0
+        self.member_ids = array('q')
+        self.member_sizes = array('q')
+        super().__init__([], filename, **kwargs)
+
+    def mapped_datafiles(self, datafile_ids):
+        for start in range(0, len(datafile_ids), self.chunk_size):
+            chunk = DataFile.objects.filter(
+                id__in=datafile_ids[start:start + self.chunk_size]) \
+                .order_by('id')
+            for mapped_file in _get_datafile_details_for_archive(
+                    self.mapper, chunk):
+                yield mapped_file
+
+    def header_size(self, name):
+        '''
+        size of the GNU tar header for a regular file called name
+        '''
+        size = tarfile.BLOCKSIZE
+        name_length = len(name.encode(self.encoding, self.errors))
+        if name_length > tarfile.LENGTH_NAME:
+            # GNU long name header, followed by the NUL terminated name
+            blocks, remainder = divmod(name_length + 1, tarfile.BLOCKSIZE)
+            if remainder > 0:
+                blocks += 1
+            size += tarfile.BLOCKSIZE + blocks * tarfile.BLOCKSIZE
+        return size
+
+    def compute_size(self):
+        datafile_ids = array('q', self.datafiles.order_by('id')
+                             .values_list('id', flat=True))
+        total_size = 0
+        self.member_ids = array('q')
+        self.member_sizes = array('q')
+        for df, name in self.mapped_datafiles(datafile_ids):
+            size = int(df.get_size())
+            self.member_ids.append(df.id)
+            self.member_sizes.append(size)
+            total_size += self.header_size(name)
+            blocks, remainder = divmod(size, tarfile.BLOCKSIZE)
+            if remainder > 0:
+                blocks += 1
+            total_size += blocks * tarfile.BLOCKSIZE
+        self.num_files = len(self.member_ids)
+        blocks, remainder = divmod(total_size, tarfile.RECORDSIZE)
+        if remainder > 0:
+            blocks += 1
+        total_size = blocks * tarfile.RECORDSIZE
+        return total_size
+
+    def iter_members(self, first=0):
+        for df, name in self.mapped_datafiles(self.member_ids):
+            tarinfo = self.tarinfo_for_df(df, name)
+            # the file may have changed since the archive size was computed
+            tarinfo.size = self.member_sizes[
+                bisect_left(self.member_ids, df.id)]
+            yield df, tarinfo, tarinfo.tobuf(self.format, self.encoding,
+                                             self.errors)
+
+    def make_tar(self, start=0):
+        '''
+        main tar generator, which sends exactly tar_size bytes when the
+        archive is uncompressed, even if members were deleted or renamed
+        since the archive size was computed
+        '''
+        if self.compression is not None:
+            for buf in super().make_tar(start):
+                yield buf
+            return
+        remaining = self.tar_size - start
+        for buf in super().make_tar(start):
+            if len(buf) >= remaining:
+                if len(buf) > remaining:
+                    logger.error('archive %s has grown while it was '
+                                 'streamed, truncating it' % self.filename)
+                yield buf[:remaining]
+                return
+            remaining -= len(buf)
+            yield buf
+        if remaining:
+            logger.error('archive %s has changed while it was streamed, '
+                         'padding it with %d NUL bytes' % (
+                             self.filename, remaining))
+        while remaining > 0:
+            buf = tarfile.NUL * min(remaining, self.http_buffersize)
+            remaining -= len(buf)
+            yield buf
+
+
+def make_tar_stream(datafiles, mapper, filename, compression=None):
+    '''
+    creates the tar stream for an archive, in streaming mode if it has
+    more than DOWNLOAD_STREAMING_ARCHIVE_THRESHOLD members
+
+    :returns: the tar stream and its number of members
+    :rtype: tuple
+    '''
+    streaming_threshold = getattr(
+        settings, 'DOWNLOAD_STREAMING_ARCHIVE_THRESHOLD', None)
+    if isinstance(datafiles, QuerySet) and \
+            streaming_threshold is not None and \
+            datafiles.count() > streaming_threshold:
+        tfs = StreamingTarStream(
+            datafiles, mapper,
+            filename=filename,
+            compression=compression,
+            chunk_size=getattr(
+                settings, 'DOWNLOAD_STREAMING_ARCHIVE_CHUNK_SIZE', 2000))
+        return tfs, tfs.num_files
+    files = _get_datafile_details_for_archive(mapper, datafiles)
+    tfs = UncachedTarStream(
+        files,
+        filename=filename,
+        compression=compression)
+    return tfs, len(files)
+
+
+def get_archive_contents(archive_object):
+    '''
+    returns the verified DataFiles, root directory and file name of the
+    archive of an Experiment or Dataset
+    '''
+    if isinstance(archive_object, Experiment):
+        rootdir = get_filesystem_safe_experiment_name(archive_object)
+        df_ids = DataFileObject.objects.filter(
+            datafile__dataset__experiments=archive_object, verified=True) \
+            .values('datafile_id').distinct()
+    else:
+        rootdir = get_filesystem_safe_dataset_name(archive_object)
+        df_ids = DataFileObject.objects.filter(
+            datafile__dataset=archive_object, verified=True) \
+            .values('datafile_id').distinct()
+    datafiles = DataFile.objects.filter(id__in=df_ids)
+    return datafiles, rootdir, '%s-complete.tar' % rootdir
+
+
+def get_archive_cache_box():
+    '''
+    returns the StorageBox named by ARCHIVE_CACHE_STORAGE_BOX, or None if
+    archives aren't cached
+    '''
+    box_name = getattr(settings, 'ARCHIVE_CACHE_STORAGE_BOX', None)
+    if not box_name:
+        return None
+    try:
+        return StorageBox.objects.get(name=box_name)
+    except StorageBox.DoesNotExist:
+        logger.error('archive cache storage box %s does not exist'
+                     % box_name)
+        return None
+
+
+def archive_cache_key(tfs, comptype):
+    '''
+    The key of a cached archive is a digest of its compression and of the
+    archive's ETag, which covers the checksums of the members and their
+    tar headers, so the member paths given by the organization.  Archives
+    whose members are changed get a new key.
+
+    :returns: the key, or None if the archive can't be cached
+    '''
+    if tfs.etag is None:
+        return None
+    return hashlib.sha256(
+        ('%s %s' % (comptype, tfs.etag)).encode()).hexdigest()
+
+
+class IteratorReader(io.RawIOBase):
+    '''
+    file-like object reading from an iterator of byte strings
+    '''
+
+    def __init__(self, iterator):
+        self.iterator = iterator
+        self.leftover = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self.leftover:
+            try:
+                self.leftover = next(self.iterator)
+            except StopIteration:
+                return 0
+        length = min(len(b), len(self.leftover))
+        b[:length] = self.leftover[:length]
+        self.leftover = self.leftover[length:]
+        return length
+
+
+def build_cached_archive(cached_archive_id, comptype,
+                         organization=DEFAULT_ORGANIZATION):
+    '''
+    writes an archive to the archive cache storage box, then evicts the
+    least recently used archives if the box is over its max_size
+    '''
+    from .models import CachedArchive
+    cached_archive = CachedArchive.objects.select_related(
+        'storage_box', 'experiment', 'dataset').get(id=cached_archive_id)
+    archive_object = cached_archive.experiment or cached_archive.dataset
+    datafiles, rootdir, filename = get_archive_contents(archive_object)
+    tfs, _ = make_tar_stream(datafiles, make_mapper(organization, rootdir),
+                             filename,
+                             ARCHIVE_COMPRESSION.get(comptype, 'gzip'))
+    if archive_cache_key(tfs, comptype) != cached_archive.key:
+        # the archive changed since it was requested
+        cached_archive.delete()
+        return
+    box = cached_archive.storage_box
+    storage = box.get_initialised_storage_instance()
+    uri = 'archives/%s/%s%s' % (cached_archive.key[:2], cached_archive.key,
+                                ARCHIVE_CONTENT_TYPES[tfs.compression][1])
+    try:
+        uri = storage.save(
+            uri, File(io.BufferedReader(IteratorReader(tfs.make_tar()),
+                                        tfs.http_buffersize)))
+    except Exception:
+        cached_archive.delete()
+        raise
+    if not CachedArchive.objects.filter(id=cached_archive.id).update(
+            uri=uri, size=storage.size(uri), complete=True,
+            last_accessed=timezone.now()):
+        # invalidated while it was being written
+        storage.delete(uri)
+        return
+    evict_cached_archives(box)
+
+
+def evict_cached_archives(box):
+    '''
+    deletes the least recently used archives in the archive cache storage
+    box until their total size is within the box's max_size
+    '''
+    if box.max_size is None:
+        return
+    archives = box.cached_archives.filter(complete=True)
+    total_size = archives.aggregate(Sum('size'))['size__sum'] or 0
+    for cached_archive in archives.order_by('last_accessed'):
+        if total_size <= box.max_size:
+            break
+        total_size -= cached_archive.size
+        cached_archive.delete()
+
+
+def get_cached_archive_response(request, archive_object, tfs, comptype,
+                                organization, tracker_data):
+    '''
+    Sends an Experiment or Dataset archive from the archive cache storage
+    box.  If the archive isn't cached yet, a task to write it to the cache
+    is queued and None is returned, so that it is streamed as usual.
+
+    :returns: response, or None if the archive isn't cached
+    '''
+    from .models import CachedArchive
+    from .tasks import cache_archive
+    box = get_archive_cache_box()
+    key = archive_cache_key(tfs, comptype)
+    if box is None or key is None or \
+            (box.max_size is not None and tfs.tar_size > box.max_size):
+        return None
+    now = timezone.now()
+    cached_archive, created = CachedArchive.objects.get_or_create(
+        key=key, defaults={
+            'storage_box': box,
+            'experiment': archive_object
+                          if isinstance(archive_object, Experiment) else None,
+            'dataset': archive_object
+                       if isinstance(archive_object, Dataset) else None})
+    if not cached_archive.complete:
+        stale = now - timedelta(
+            seconds=getattr(settings, 'ARCHIVE_CACHE_BUILD_TIMEOUT', 86400))
+        if created or CachedArchive.objects.filter(
+                id=cached_archive.id, complete=False,
+                last_accessed__lt=stale).update(last_accessed=now):
+            cache_archive.apply_async(
+                args=[cached_archive.id, comptype, organization],
+                priority=box.priority)
+        return None
+    try:
+        file_obj = cached_archive.storage_box \
+            .get_initialised_storage_instance().open(cached_archive.uri, 'rb')
+    except (IOError, OSError):
+        logger.exception('cached archive %s is missing' % cached_archive.uri)
+        cached_archive.delete()
+        return None
+    CachedArchive.objects.filter(id=cached_archive.id).update(
+        last_accessed=now)
+    etag = tfs.etag if tfs.compression is None else '"%s"' % key
+    response = get_file_response(request, file_obj, tfs.content_type,
+                                 size=cached_archive.size, etag=etag,
+                                 tracker_data=tracker_data,
+                                 storage_box=box.name, label='tar')
+    response['Content-Disposition'] = 'attachment; filename="%s"' % \
+                                      tfs.archive_filename
+    return response
+
+
 def _streaming_downloader(request, datafiles, rootdir, filename,
-                          comptype='tgz', organization=DEFAULT_ORGANIZATION):
+                          comptype='tgz', organization=DEFAULT_ORGANIZATION,
+                          archive_object=None):
     '''
     private function to be called by wrappers
     creates download response with given files and names
+
+    Archives of a whole Experiment or Dataset, given as archive_object,
+    are sent from the archive cache when ARCHIVE_CACHE_STORAGE_BOX is set.
     '''
     mapper = make_mapper(organization, rootdir)
     if not mapper:
         return render_error_message(
             request, 'Unknown download organization: %s' % organization,
             status=400)
+    compression = ARCHIVE_COMPRESSION.get(comptype, 'gzip')
+    if compression == 'zstd' and zstandard is None:
+        return render_error_message(
+            request, 'Archive format %s is not available' % comptype,
+            status=400)
     try:
-        files = _get_datafile_details_for_archive(mapper, datafiles)
-        tfs = UncachedTarStream(
-            files,
-            filename=filename,
-            do_gzip=comptype != 'tar')
+        tfs, num_files = make_tar_stream(datafiles, mapper, filename,
+                                         compression)
         tracker_data = dict(
             label='tar',
             session_id=request.COOKIES.get('_ga'),
             ip=request.META.get('REMOTE_ADDR', ''),
             user=request.user,
             total_size=tfs.tar_size,
-            num_files=len(datafiles),
+            num_files=num_files,
             ua=request.META.get('HTTP_USER_AGENT', None))
-        return tfs.get_response(tracker_data)
+        if archive_object is not None:
+            response = get_cached_archive_response(
+                request, archive_object, tfs, comptype, organization,
+                tracker_data)
+            if response is not None:
+                return response
+        byte_range = None
+        if tfs.seekable and _if_range_matches(request, tfs.etag):
+            try:
+                byte_range = parse_range_header(
+                    request.META.get('HTTP_RANGE'), tfs.tar_size)
+            except RangeNotSatisfiable:
+                response = HttpResponse(status=416)
+                response['Content-Range'] = 'bytes */%d' % tfs.tar_size
+                return response
+        return tfs.get_response(tracker_data, byte_range)
     except ValueError:  # raised when replica not verified TODO: custom excptn
         message = """The experiment you are trying to access has not yet been
                      verified completely.
@@ -424,30 +1442,20 @@ def _streaming_downloader(request, datafiles, rootdir, filename,
 def streaming_download_experiment(request, experiment_id, comptype='tgz',
                                   organization=DEFAULT_ORGANIZATION):
     experiment = Experiment.objects.get(id=experiment_id)
-    rootdir = get_filesystem_safe_experiment_name(experiment)
-    filename = '%s-complete.tar' % rootdir
-
-    df_ids = DataFileObject.objects.filter(
-        datafile__dataset__experiments__id=experiment_id, verified=True) \
-                .values('datafile_id').distinct()
-    datafiles = DataFile.objects.filter(id__in=df_ids)
+    datafiles, rootdir, filename = get_archive_contents(experiment)
     return _streaming_downloader(request, datafiles, rootdir, filename,
-                                 comptype, organization)
+                                 comptype, organization,
+                                 archive_object=experiment)
 
 
 @dataset_download_required
 def streaming_download_dataset(request, dataset_id, comptype='tgz',
                                organization=DEFAULT_ORGANIZATION):
     dataset = Dataset.objects.get(id=dataset_id)
-    rootdir = get_filesystem_safe_dataset_name(dataset)
-    filename = '%s-complete.tar' % rootdir
-
-    df_ids = DataFileObject.objects.filter(
-        datafile__dataset=dataset, verified=True) \
-        .values('datafile_id').distinct()
-    datafiles = DataFile.objects.filter(id__in=df_ids)
+    datafiles, rootdir, filename = get_archive_contents(dataset)
     return _streaming_downloader(request, datafiles, rootdir, filename,
-                                 comptype, organization)
+                                 comptype, organization,
+                                 archive_object=dataset)
 
 
 def streaming_download_datafiles(request):  # too complex # noqa
@@ -475,25 +1483,10 @@ def streaming_download_datafiles(request):  # too complex # noqa
             datasets = request.POST.getlist('dataset')
             datafiles = request.POST.getlist('datafile')
 
-            # Generator to produce datafiles from dataset id
-            def get_dataset_datafiles(dsid):
-                for datafile in DataFile.objects.filter(dataset=dsid):
-                    if has_datafile_download_access(
-                            request=request, datafile_id=datafile.id):
-                        yield datafile
-
-            # Generator to produce datafile from datafile id
-            def get_datafile(dfid):
-                datafile = DataFile.objects.get(pk=dfid)
-                if has_datafile_download_access(request=request,
-                                                datafile_id=datafile.id):
-                    yield datafile
-
-            # Take chained generators and turn them into a set of datafiles
-            df_set = set(chain(chain.from_iterable(map(get_dataset_datafiles,
-                                                       datasets)),
-                               chain.from_iterable(map(get_datafile,
-                                                       datafiles))))
+            # the selected datafiles the user may download, in one query
+            df_set = get_downloadable_datafiles(
+                request, DataFile.objects.filter(
+                    Q(dataset__in=datasets) | Q(id__in=datafiles)))
         else:
             return render_error_message(
                 request,
@@ -514,16 +1507,15 @@ def streaming_download_datafiles(request):  # too complex # noqa
             datafile = DataFile.objects.filter(
                 url__endswith=raw_path,
                 dataset__experiment__id=experiment_id)[0]
-            if has_datafile_download_access(request=request,
-                                            datafile_id=datafile.id):
-                df_set = set([datafile])
+            df_set = get_downloadable_datafiles(
+                request, DataFile.objects.filter(pk=datafile.pk))
     else:
         message = "No datasets or datafiles were selected for download"
         return redirect_back_with_error(request, message)
 
-    logger.info('Files for archive command: %s' % df_set)
+    logger.debug('Files for archive command: %s', df_set)
 
-    if not df_set:
+    if not df_set.exists():
         message = ("No verified files were accessible to download in the "
                    "selected dataset(s)")
         return redirect_back_with_error(request, message)
@@ -532,7 +1524,7 @@ def streaming_download_datafiles(request):  # too complex # noqa
         expid = request.POST['expid']
         experiment = Experiment.objects.get(id=expid)
     except (KeyError, Experiment.DoesNotExist):
-        experiment = next(iter(df_set)).dataset.get_first_experiment()
+        experiment = df_set[0].dataset.get_first_experiment()
 
     exp_title = get_filesystem_safe_experiment_name(experiment)
     filename = '%s-selection.tar' % exp_title
@@ -0,0 +1,72 @@
+"""
+Command for comparing the speed of the checksum functions
+"""
+import os
+import time
+from tempfile import NamedTemporaryFile
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from ...models.datafile import compute_checksums, compute_file_checksums
+
+
+class Command(BaseCommand):
+    help = ("Compare the speed of the generic checksum function with the "
+            "one for local files")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--size',
+            default=256,
+            type=int,
+            dest='size',
+            help='Size of the test file in MiB, default 256'
+        )
+        parser.add_argument(
+            '--repeat',
+            default=3,
+            type=int,
+            dest='repeat',
+            help='Number of times to time each function, default 3'
+        )
+        parser.add_argument(
+            '--dir',
+            default=None,
+            dest='dir',
+            help=('Directory to write the test file in, e.g. a mount of a '
+                  'storage box.  Defaults to the system temporary directory.')
+        )
+
+    def handle(self, *args, **options):
+        size = options['size'] * 1024 * 1024
+        compute_md5 = getattr(settings, 'COMPUTE_MD5', True)
+        compute_sha512 = getattr(settings, 'COMPUTE_SHA512', False)
+
+        def generic(file_path):
+            with open(file_path, 'rb') as file_object:
+                return compute_checksums(
+                    file_object, compute_md5, compute_sha512)
+
+        def local(file_path):
+            return compute_file_checksums(
+                file_path, compute_md5, compute_sha512)
+
+        with NamedTemporaryFile(dir=options['dir']) as test_file:
+            block = os.urandom(1024 * 1024)
+            for _ in range(size // len(block)):
+                test_file.write(block)
+            test_file.write(block[:size % len(block)])
+            test_file.flush()
+            results = {}
+            for name, function in (('generic', generic), ('local', local)):
+                best = None
+                for _ in range(options['repeat']):
+                    start = time.perf_counter()
+                    results[name] = function(test_file.name)
+                    elapsed = time.perf_counter() - start
+                    best = elapsed if best is None else min(best, elapsed)
+                self.stdout.write('%s: %.3f s, %.1f MiB/s' % (
+                    name, best, size / 1024 / 1024 / best))
+        if results['generic'] != results['local']:
+            self.stderr.write('the checksums differ: %s' % results)
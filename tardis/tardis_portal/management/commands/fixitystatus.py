@@ -0,0 +1,40 @@
+"""
+Command for reporting the progress of fixity checks in each storage box
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Min, Q
+from django.utils import timezone
+
+from ...models import DataFileObject
+
+
+class Command(BaseCommand):
+    help = "Report the progress of fixity checks in each storage box"
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        cutoff = now - timedelta(
+            seconds=getattr(settings, 'REVERIFY_INTERVAL', 90 * 24 * 3600))
+        verified = Q(verified=True)
+        boxes = DataFileObject.objects.values('storage_box__name').annotate(
+            files=Count('id'),
+            verified_files=Count('id', filter=verified),
+            due=Count('id', filter=verified & (
+                Q(last_verified_time__isnull=True) |
+                Q(last_verified_time__lte=cutoff))),
+            in_progress=Count('id', filter=verified & Q(
+                verify_lease_expiry__gt=now)),
+            failed=Count('id', filter=Q(
+                verified=False, last_verified_time__isnull=False)),
+            oldest=Min('last_verified_time', filter=verified),
+        ).order_by('storage_box__name')
+        for box in boxes:
+            oldest = box['oldest'].isoformat() if box['oldest'] else 'never'
+            self.stdout.write(
+                '%(name)s: %(files)d files, %(verified_files)d verified, '
+                '%(due)d due for a fixity check, %(in_progress)d being '
+                'checked, %(failed)d failed, oldest check %(oldest)s' % dict(
+                    box, name=box['storage_box__name'], oldest=oldest))
@@ -5,8 +5,6 @@ managers.py
 
 """
 
-from datetime import datetime
-
 from django.db import models
 from django.db.models import Q
 from django.core.exceptions import PermissionDenied
@@ -60,68 +58,61 @@ class ExperimentManager(OracleSafeManager):
         query = self._query_all_public() |\
             self._query_owned_and_shared(user)
 
-        return super().get_queryset().filter(
-            query).distinct()
+        return super().get_queryset().filter(query)
 
     def public(self):
         query = self._query_all_public()
-        return super().get_queryset().filter(
-            query).distinct()
+        return super().get_queryset().filter(query)
 
     def owned_and_shared(self, user):
         return super().get_queryset().filter(
-            self._query_owned_and_shared(user)).distinct()
+            self._query_owned_and_shared(user))
 
     def shared(self, user):
-        return super().get_queryset().filter(
-            self._query_shared(user)).distinct()
+        return super().get_queryset().filter(self._query_shared(user))
 
     def _query_owned_and_shared(self, user):
         return self._query_shared(user) | self._query_owned(user)
 
+    def _query_access(self, query):
+        '''
+        experiments with ExperimentAccess rows in effect matching query,
+        looked up with a subquery so that no .distinct() is needed
+        '''
+        from .models.access_control import ExperimentAccess
+        access = ExperimentAccess.objects.filter(query).filter(
+            ExperimentAccess.get_effective_query())
+        return Q(id__in=access.values('experiment_id'))
+
     def _query_shared(self, user):
         '''
         get all shared experiments, not owned ones
         '''
+        from .models.access_control import ExperimentAccess
         # if the user is not authenticated, only tokens apply
         # this is almost duplicate code of end of has_perm in authorisation.py
         # should be refactored, but cannot think of good way atm
         if not user.is_authenticated:
             from .auth.token_auth import TokenGroupProvider
-            query = Q(id=None)
             tgp = TokenGroupProvider()
-            for group in tgp.getGroups(user):
-                query |= Q(objectacls__pluginId=tgp.name,
-                           objectacls__entityId=str(group),
-                           objectacls__canRead=True) &\
-                    (Q(objectacls__effectiveDate__lte=datetime.today())
-                     | Q(objectacls__effectiveDate__isnull=True)) &\
-                    (Q(objectacls__expiryDate__gte=datetime.today())
-                     | Q(objectacls__expiryDate__isnull=True))
-            return query
+            entities = [ExperimentAccess.get_entity(tgp.name, group)
+                        for group in tgp.getGroups(user)]
+            if not entities:
+                return Q(id=None)
+            return self._query_access(Q(entity__in=entities, canRead=True))
 
         # for which experiments does the user have read access
         # based on USER permissions?
-        query = Q(objectacls__pluginId=django_user,
-                  objectacls__entityId=str(user.id),
-                  objectacls__canRead=True,
-                  objectacls__isOwner=False) &\
-            (Q(objectacls__effectiveDate__lte=datetime.today())
-             | Q(objectacls__effectiveDate__isnull=True)) &\
-            (Q(objectacls__expiryDate__gte=datetime.today())
-             | Q(objectacls__expiryDate__isnull=True))
+        query = Q(entity=ExperimentAccess.get_entity(django_user, user.id),
+                  canRead=True, isOwner=False)
 
         # for which does experiments does the user have read access
         # based on GROUP permissions
-        for name, group in user.userprofile.ext_groups:
-            query |= Q(objectacls__pluginId=name,
-                       objectacls__entityId=str(group),
-                       objectacls__canRead=True) &\
-                (Q(objectacls__effectiveDate__lte=datetime.today())
-                 | Q(objectacls__effectiveDate__isnull=True)) &\
-                (Q(objectacls__expiryDate__gte=datetime.today())
-                 | Q(objectacls__expiryDate__isnull=True))
-        return query
+        groups = [ExperimentAccess.get_entity(name, group)
+                  for name, group in user.userprofile.ext_groups]
+        if groups:
+            query |= Q(entity__in=groups, canRead=True)
+        return self._query_access(query)
 
     def _query_all_public(self):
         from .models import Experiment
@@ -159,34 +150,29 @@ class ExperimentManager(OracleSafeManager):
         if not user.is_authenticated:
             return super().get_queryset().none()
 
-        query = self._query_owned(user)
-        for group in user.groups.all():
-            query |= self._query_owned_by_group(group)
-        return super().get_queryset().filter(query).distinct()
+        from .models.access_control import ExperimentAccess
+        entities = [ExperimentAccess.get_entity(django_user, user.id)]
+        entities.extend(
+            ExperimentAccess.get_entity(django_group, group_id)
+            for group_id in user.groups.values_list('id', flat=True))
+        return super().get_queryset().filter(
+            self._query_access(Q(entity__in=entities, isOwner=True)))
 
         # return self.owned_by_user(user)
 
     def _query_owned(self, user, user_id=None):
-        # build the query to filter the ACL table
-        query = Q(objectacls__pluginId=django_user,
-                  objectacls__entityId=str(user_id or user.id),
-                  objectacls__isOwner=True) &\
-                (Q(objectacls__effectiveDate__lte=datetime.today())
-             | Q(objectacls__effectiveDate__isnull=True)) &\
-            (Q(objectacls__expiryDate__gte=datetime.today())
-             | Q(objectacls__expiryDate__isnull=True))
-        return query
+        from .models.access_control import ExperimentAccess
+        return self._query_access(Q(
+            entity=ExperimentAccess.get_entity(
+                django_user, user_id or user.id),
+            isOwner=True))
 
     def _query_owned_by_group(self, group, group_id=None):
-        # build the query to filter the ACL table
-        query = Q(objectacls__pluginId=django_group,
-                  objectacls__entityId=str(group_id or group.id),
-                  objectacls__isOwner=True) &\
-            (Q(objectacls__effectiveDate__lte=datetime.today())
-             | Q(objectacls__effectiveDate__isnull=True)) &\
-            (Q(objectacls__expiryDate__gte=datetime.today())
-             | Q(objectacls__expiryDate__isnull=True))
-        return query
+        from .models.access_control import ExperimentAccess
+        return self._query_access(Q(
+            entity=ExperimentAccess.get_entity(
+                django_group, group_id or group.id),
+            isOwner=True))
 
     def owned_by_user(self, user):
         """
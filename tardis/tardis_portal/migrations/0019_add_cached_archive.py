@@ -0,0 +1,30 @@
+# Generated by Django 2.2.15 on 2026-10-17 06:29
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tardis_portal', '0018_make_default_storage_box_status_online'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CachedArchive',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('uri', models.TextField(blank=True, null=True)),
+                ('size', models.BigIntegerField(blank=True, null=True)),
+                ('complete', models.BooleanField(default=False)),
+                ('created_time', models.DateTimeField(auto_now_add=True)),
+                ('last_accessed', models.DateTimeField(default=django.utils.timezone.now)),
+                ('dataset', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='cached_archives', to='tardis_portal.Dataset')),
+                ('experiment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='cached_archives', to='tardis_portal.Experiment')),
+                ('storage_box', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cached_archives', to='tardis_portal.StorageBox')),
+            ],
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 2.2.15 on 2026-10-17 06:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tardis_portal', '0019_add_cached_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datafileobject',
+            name='verify_lease_expiry',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='datafileobject',
+            index=models.Index(fields=['verified', 'id'], name='dfo_verified_id_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.2.15 on 2026-10-17 06:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tardis_portal', '0020_dfo_verify_lease'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='datafileobject',
+            index=models.Index(fields=['storage_box', 'verified', 'last_verified_time'], name='dfo_fixity_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 2.2.15 on 2026-10-17 06:59
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tardis_portal', '0021_dfo_fixity_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StorageBoxTransfer',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('move', models.BooleanField(default=False)),
+                ('last_dfo_id', models.BigIntegerField(default=0)),
+                ('files_copied', models.IntegerField(default=0)),
+                ('files_skipped', models.IntegerField(default=0)),
+                ('files_failed', models.IntegerField(default=0)),
+                ('files_deleted', models.IntegerField(default=0)),
+                ('started_time', models.DateTimeField(auto_now_add=True)),
+                ('updated_time', models.DateTimeField(auto_now=True)),
+                ('finished_time', models.DateTimeField(blank=True, null=True)),
+                ('dest_box', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='transfers_in', to='tardis_portal.StorageBox')),
+                ('source_box', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='transfers_out', to='tardis_portal.StorageBox')),
+            ],
+        ),
+    ]
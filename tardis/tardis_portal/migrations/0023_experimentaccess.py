@@ -0,0 +1,64 @@
+# Generated by Django 2.2.15 on 2026-10-17 07:14
+
+from datetime import date
+
+from django.db import migrations, models
+from django.db.models import Q
+import django.db.models.deletion
+
+
+def add_experiment_access(apps, schema_editor):
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    Experiment = apps.get_model('tardis_portal', 'Experiment')
+    ExperimentAccess = apps.get_model('tardis_portal', 'ExperimentAccess')
+    ObjectACL = apps.get_model('tardis_portal', 'ObjectACL')
+    content_type = ContentType.objects.filter(
+        app_label='tardis_portal', model='experiment').first()
+    if content_type is None:
+        return
+    today = date.today()
+    acls = ObjectACL.objects.filter(
+        content_type=content_type,
+        object_id__in=Experiment.objects.values('id')).filter(
+            Q(effectiveDate__lte=today) | Q(effectiveDate__isnull=True),
+            Q(expiryDate__gte=today) | Q(expiryDate__isnull=True))
+    ExperimentAccess.objects.bulk_create(
+        (ExperimentAccess(
+            acl_id=acl.id, experiment_id=acl.object_id,
+            entity='%s:%s' % (acl.pluginId, acl.entityId),
+            canRead=acl.canRead, canWrite=acl.canWrite,
+            canDelete=acl.canDelete, isOwner=acl.isOwner,
+            effectiveDate=acl.effectiveDate, expiryDate=acl.expiryDate) for acl in acls.iterator()),
+        batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('tardis_portal', '0022_storageboxtransfer'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExperimentAccess',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entity', models.CharField(max_length=351)),
+                ('canRead', models.BooleanField(default=False)),
+                ('canWrite', models.BooleanField(default=False)),
+                ('canDelete', models.BooleanField(default=False)),
+                ('isOwner', models.BooleanField(default=False)),
+                ('effectiveDate', models.DateField(blank=True, null=True)),
+                ('expiryDate', models.DateField(blank=True, null=True)),
+                ('acl', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='experiment_access', to='tardis_portal.ObjectACL')),
+                ('experiment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='access', to='tardis_portal.Experiment')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='experimentaccess',
+            index=models.Index(fields=['entity', 'experiment'], name='experiment_access_entity_idx'),
+        ),
+        migrations.RunPython(add_experiment_access,
+                             migrations.RunPython.noop),
+    ]
@@ -45,7 +45,7 @@ from django.contrib.auth.models import User, Group
 import tardis.tardis_portal.models.hooks
 
 from .access_control import UserAuthentication, UserProfile, GroupAdmin
-from .access_control import ObjectACL
+from .access_control import ObjectACL, ExperimentAccess
 from .facility import Facility
 from .instrument import Instrument
 from .experiment import Experiment, ExperimentAuthor
@@ -55,6 +55,8 @@ from .datafile import DataFileObject
 from .storage import StorageBox
 from .storage import StorageBoxOption
 from .storage import StorageBoxAttribute
+from .transfer import StorageBoxTransfer
+from .archive import CachedArchive
 
 from .jti import JTI
 
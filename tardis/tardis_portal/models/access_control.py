@@ -195,7 +195,7 @@ class ObjectACL(models.Model):
     :attribute canWrite: gives the user write access
     :attribute canDelete: gives the user delete permission
     :attribute isOwner: the experiment owner flag.
-    :attribute effectiveDate: the date when access takes into effect
+    :attribute effectiveDate: the date when access takes effect
     :attribute expiryDate: the date when access ceases
     :attribute aclOwnershipType: system-owned or user-owned.
 
@@ -265,6 +265,128 @@ class ObjectACL(models.Model):
         return acl_effective_query
 
 
+@python_2_unicode_compatible
+class ExperimentAccess(models.Model):
+    """Materialised copy of the experiment ObjectACLs which are in effect,
+    so that the experiments a user can access are found with one indexed
+    lookup instead of joining ObjectACLs with an OR for each group
+
+    There is one row per unexpired ObjectACL, kept in sync by the signal
+    handlers in :mod:`~tardis.tardis_portal.models.hooks`.  The
+    sweep_experiment_access task removes expired rows and repairs the rows
+    of ACLs which were changed without signals.
+
+    :attribute acl: the ObjectACL
+    :attribute experiment: the experiment the ACL applies to
+    :attribute entity: the ACL's pluginId and entityId, see
+        :meth:`get_entity`
+    :attribute effectiveDate: the date when access takes effect
+    :attribute expiryDate: the date when access ceases
+    """
+
+    acl = models.OneToOneField(ObjectACL, related_name='experiment_access',
+                               on_delete=models.CASCADE)
+    experiment = models.ForeignKey('Experiment', related_name='access',
+                                   on_delete=models.CASCADE)
+    entity = models.CharField(max_length=351)
+    canRead = models.BooleanField(default=False)
+    canWrite = models.BooleanField(default=False)
+    canDelete = models.BooleanField(default=False)
+    isOwner = models.BooleanField(default=False)
+    effectiveDate = models.DateField(null=True, blank=True)
+    expiryDate = models.DateField(null=True, blank=True)
+
+    class Meta:
+        app_label = 'tardis_portal'
+        indexes = [models.Index(fields=['entity', 'experiment'],
+                                name='experiment_access_entity_idx')]
+
+    def __str__(self):
+        return '%s | %i' % (self.entity, self.experiment_id)
+
+    @staticmethod
+    def get_entity(plugin_id, entity_id):
+        return '%s:%s' % (plugin_id, entity_id)
+
+    @classmethod
+    def get_effective_query(cls):
+        return cls.get_unexpired_query() & (
+            Q(effectiveDate__lte=datetime.today()) |
+            Q(effectiveDate__isnull=True))
+
+    @classmethod
+    def get_unexpired_query(cls):
+        return Q(expiryDate__gte=datetime.today()) | Q(expiryDate__isnull=True)
+
+    @classmethod
+    def from_acl(cls, acl):
+        return cls(acl=acl, experiment_id=acl.object_id,
+                   entity=cls.get_entity(acl.pluginId, acl.entityId),
+                   canRead=acl.canRead, canWrite=acl.canWrite,
+                   canDelete=acl.canDelete, isOwner=acl.isOwner,
+                   effectiveDate=acl.effectiveDate, expiryDate=acl.expiryDate)
+
+    @classmethod
+    def unexpired_acls(cls):
+        """
+        :return: the experiment ObjectACLs which are in effect or are yet to
+            take effect
+        :rtype: QuerySet
+        """
+        from .experiment import Experiment
+        return ObjectACL.objects.filter(
+            content_type=ContentType.objects.get_for_model(Experiment),
+            object_id__in=Experiment.objects.values('id')).filter(
+                cls.get_unexpired_query())
+
+    @classmethod
+    def sync_acl(cls, acl):
+        """
+        Creates, updates or deletes the row of one ObjectACL
+        """
+        from .experiment import Experiment
+        if acl.content_type_id != \
+                ContentType.objects.get_for_model(Experiment).id:
+            return
+        if cls.unexpired_acls().filter(id=acl.id).exists():
+            access = cls.from_acl(acl)
+            access.id = getattr(cls.objects.filter(acl=acl).first(), 'id',
+                                None)
+            access.save()
+        else:
+            cls.objects.filter(acl_id=acl.id).delete()
+
+    @classmethod
+    def sweep(cls):
+        """
+        Reconciles the rows with the ObjectACLs, for the ACLs which were
+        changed without sending signals, e.g. by QuerySet.update() or when
+        loading fixtures: removes the rows of ACLs which have expired or no
+        longer apply to an experiment, updates the rows which differ from
+        their ACL and adds the missing rows
+
+        :return: the number of rows removed, updated and added
+        :rtype: tuple(int, int, int)
+        """
+        acls = cls.unexpired_acls()
+        removed, _ = cls.objects.exclude(acl__in=acls).delete()
+        fields = ['experiment', 'entity', 'canRead', 'canWrite', 'canDelete',
+                  'isOwner', 'effectiveDate', 'expiryDate']
+        stale = []
+        for access in cls.objects.select_related('acl').iterator():
+            synced = cls.from_acl(access.acl)
+            if any(getattr(access, field) != getattr(synced, field)
+                   for field in ['experiment_id'] + fields[1:]):
+                synced.id = access.id
+                stale.append(synced)
+        cls.objects.bulk_update(stale, fields, batch_size=1000)
+        added = cls.objects.bulk_create(
+            (cls.from_acl(acl)
+             for acl in acls.filter(experiment_access__isnull=True)),
+            batch_size=1000)
+        return removed, len(stale), len(added)
+
+
 def create_user_api_key(sender, **kwargs):
     """
     Auto-create ApiKey objects using Tastypie's create_api_key
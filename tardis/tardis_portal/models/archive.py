@@ -0,0 +1,67 @@
+import logging
+
+from django.db import models
+from django.db.models.signals import pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.encoding import python_2_unicode_compatible
+
+from .dataset import Dataset
+from .experiment import Experiment
+from .storage import StorageBox
+
+logger = logging.getLogger(__name__)
+
+
+@python_2_unicode_compatible
+class CachedArchive(models.Model):
+    '''
+    An experiment or dataset archive which has been written to the archive
+    cache storage box, so that it can be sent again without being rebuilt.
+
+    :attribute key: digest of the archive's member checksums, paths and
+        compression, see :func:`tardis.tardis_portal.download.archive_cache_key`
+    :attribute complete: False while the archive is being written
+    :attribute last_accessed: when the archive was last sent, or when
+        writing it started, used for least recently used eviction
+    '''
+
+    key = models.CharField(max_length=64, unique=True)
+    storage_box = models.ForeignKey(StorageBox,
+                                    related_name='cached_archives',
+                                    on_delete=models.CASCADE)
+    experiment = models.ForeignKey(Experiment, null=True, blank=True,
+                                   related_name='cached_archives',
+                                   on_delete=models.CASCADE)
+    dataset = models.ForeignKey(Dataset, null=True, blank=True,
+                                related_name='cached_archives',
+                                on_delete=models.CASCADE)
+    uri = models.TextField(null=True, blank=True)
+    size = models.BigIntegerField(null=True, blank=True)
+    complete = models.BooleanField(default=False)
+    created_time = models.DateTimeField(auto_now_add=True)
+    last_accessed = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        app_label = 'tardis_portal'
+
+    def __str__(self):
+        return 'Cached archive %s in %s' % (self.key, self.storage_box)
+
+    def delete_data(self):
+        storage = self.storage_box.get_initialised_storage_instance()
+        storage.delete(self.uri)
+
+
+@receiver(pre_delete, sender=CachedArchive,
+          dispatch_uid='cached_archive_delete')
+def delete_cached_archive(sender, instance, **kwargs):
+    '''
+    Deletes the archive file, before deleting the database record
+    '''
+    if not instance.uri:
+        return
+    try:
+        instance.delete_data()
+    except Exception:
+        logger.exception('could not delete cached archive %s' % instance.uri)
@@ -1,6 +1,9 @@
 import hashlib
 import logging
+import os
 import re
+import threading
+import time
 from contextlib import contextmanager
 from tempfile import NamedTemporaryFile
 from urllib.parse import quote
@@ -11,6 +14,7 @@ import mimetypes
 
 from django.conf import settings
 from django.core.files import File
+from django.core.files.storage import FileSystemStorage
 from django.urls import reverse
 from django.db import models
 from django.db import transaction
@@ -24,11 +28,18 @@ from django.utils.encoding import python_2_unicode_compatible
 import magic
 
 from .. import tasks
+from ..storage.placement import tracking_write
 from .dataset import Dataset
 from .storage import StorageBox, StorageBoxOption, StorageBoxAttribute
 
 logger = logging.getLogger(__name__)
 
+MIMETYPE_DETECTION_BYTES = 1024
+'''
+Number of bytes at the start of a file which libmagic reads to detect its
+MIME type
+'''
+
 IMAGE_FILTER = (Q(mimetype__startswith='image/') &
                 ~Q(mimetype='image/x-icon')) |\
     (Q(datafileparameterset__datafileparameter__name__units__startswith="image"))  # noqa
@@ -94,7 +105,8 @@ class DataFile(models.Model):
         for box in s_boxes:
             newfile = DataFileObject(datafile=self,
                                      storage_box=box)
-            newfile.save()
+            # writing the file verifies it, or queues its verification
+            newfile.save(skip_verify=True)
             newfile.file_object = file_object
         if oldobjs:
             for obj in oldobjs:
@@ -139,7 +151,7 @@ class DataFile(models.Model):
             if dataset_boxes.count() == 1:
                 return dataset_boxes[0]
         # TODO: select one accessible to the owner of the file
-        return StorageBox.get_default_storage()
+        return StorageBox.get_default_storage(size=self.size)
 
     def get_receiving_storage_box(self):
         default_box = self.get_default_storage_box()
@@ -198,7 +210,9 @@ class DataFile(models.Model):
             if self.size < 0:
                 raise Exception('Invalid Datafile size (must be >= 0): %d' %
                                 self.size)
-        self.update_mimetype(save=False)
+        # The MIME type is left empty until the file is verified, and then
+        # detected from bytes read to calculate its checksums, rather than
+        # by opening it, see DataFileObject.after_verification
 
         super().save(*args, **kwargs)
 
@@ -274,6 +288,9 @@ class DataFile(models.Model):
 
     def get_preferred_dfo(self, verified_only=True):
         if verified_only:
+            cached_dfo = getattr(self, '_cached_preferred_dfo', None)
+            if cached_dfo is not None:
+                return cached_dfo
             obj_query = self.file_objects.filter(verified=True)
         else:
             obj_query = self.file_objects.all()
@@ -402,26 +419,39 @@ class DataFile(models.Model):
     def _has_delete_perm(self, user_obj):
         return self._has_any_perm(user_obj)
 
-    def update_mimetype(self, mimetype=None, force=False, save=True):
+    def update_mimetype(self, mimetype=None, force=False, save=True,
+                        head=None, read_file=True):
+        """
+        Sets the MIME type if it is empty, or if force is set
+
+        :param str mimetype: the MIME type, detected if None
+        :param bytes head: the first bytes of the file, to detect the MIME
+            type from without opening the file
+        :param bool read_file: open the file to detect the MIME type if head
+            isn't given, otherwise it is guessed from the filename
+        """
         if self.mimetype is not None and self.mimetype != '' and not force:
             return self.mimetype
-        fo = self.file_object
-        if mimetype is None and fo is not None:
-            m = magic.Magic(mime_and_encoding=True)
-            mimetype = m.from_buffer(fo.read(1024))
-            fo.close()
+        if mimetype is None and head is None and read_file:
+            try:
+                fo = self.file_object
+                if fo is not None:
+                    head = fo.read(MIMETYPE_DETECTION_BYTES)
+                    fo.close()
+            except IOError:
+                logger.debug('could not read DataFile with id %s to detect '
+                             'its MIME type' % self.id)
+        if mimetype is None and head is not None:
+            mimetype = detect_mimetype(head)
         if mimetype is None:
             mimetype, encoding = mimetypes.guess_type(self.filename)
             if mimetype is not None and encoding is not None:
                 mimetype = '%s; %s' % (mimetype, encoding)
             mimetype = mimetype or 'application/octet-stream'
-        if ';' in mimetype:
-            mt, enc = mimetype.split(';')
-            if enc.endswith('charset=binary'):
-                mimetype = mt
         self.mimetype = mimetype
-        if save:
-            self.save()
+        if save and self.id is not None:
+            # only the MIME type changed, so skip the checks in save()
+            super().save(update_fields=['mimetype'])
         return mimetype
 
     @property
@@ -457,6 +487,9 @@ class DataFileObject(models.Model):
         with filename ``file1.txt`` which belongs to
         a :class:`~tardis.tardis_portal.models.dataset.Dataset`
         with a description of ``dataset1`` and an ID of ``12345``.
+    :attribute verify_lease_expiry: Set when the ``verify_dfos`` task queues
+        this ``DataFileObject`` for verification, so that later sweeps skip
+        it until it has been verified or the lease expires.
     """
 
     datafile = models.ForeignKey(DataFile, related_name='file_objects',
@@ -467,12 +500,20 @@ class DataFileObject(models.Model):
     created_time = models.DateTimeField(auto_now_add=True)
     verified = models.BooleanField(default=False)
     last_verified_time = models.DateTimeField(blank=True, null=True)
+    verify_lease_expiry = models.DateTimeField(blank=True, null=True)
 
     _initial_values = None
 
     class Meta:
         app_label = 'tardis_portal'
         unique_together = ['datafile', 'storage_box']
+        indexes = [
+            models.Index(fields=['verified', 'id'],
+                         name='dfo_verified_id_idx'),
+            models.Index(fields=['storage_box', 'verified',
+                                 'last_verified_time'],
+                         name='dfo_fixity_idx'),
+        ]
 
     def __str__(self):
         try:
@@ -495,7 +536,8 @@ class DataFileObject(models.Model):
     def _current_values(self):
         return model_to_dict(self, fields=[
             field.name for field in self._meta.fields
-            if field.name not in ['verified', 'last_verified_time']])
+            if field.name not in ['verified', 'last_verified_time',
+                                  'verify_lease_expiry']])
 
     @property
     def _changed(self):
@@ -513,11 +555,14 @@ class DataFileObject(models.Model):
         from amqp.exceptions import AMQPError
 
         reverify = kwargs.pop('reverify', False)
+        skip_verify = kwargs.pop('skip_verify', False)
         super().save(*args, **kwargs)
         if self._changed:
             self._initial_values = self._current_values
         elif not reverify:
             return
+        if skip_verify:
+            return
 
         try:
             shadow = 'dfo_verify location:%s' % self.storage_box.name
@@ -603,16 +648,46 @@ class DataFileObject(models.Model):
 
         :type file_object: Python File object
         """
+        result, database_update = self.write_file(file_object)
+        self.verified = False
+        if result:
+            # the bytes written match the DataFile, so the file doesn't need
+            # to be read back to verify it
+            self.record_verification(result, database_update, save=False)
+        self.save(skip_verify=self.verified)
+        if self.verified:
+            self.after_verification()
+
+    def write_file(self, file_object):
+        """
+        Writes the contents of a file object to the storage box and checks
+        the bytes written against the DataFile, without saving anything to
+        the database.  This can run in a worker thread if the uri has been
+        set and the datafile and storage box have been loaded.
+
+        :type file_object: Python File object
+        :return: whether the bytes written verified, and the DataFile fields
+            to update, see :meth:`check_file`
+        :rtype: tuple(bool, dict)
+        """
         if file_object.closed:
             file_object = File(file_object)
             file_object.open(mode='rb')
         file_object.seek(0)
-        self.uri = self._storage.save(self.uri or self.create_set_uri(),
-                                      file_object)  # TODO: define behaviour
-        # when overwriting existing files
+        hashing_file = HashingFile(
+            file_object,
+            compute_md5=getattr(settings, 'COMPUTE_MD5', True),
+            compute_sha512=getattr(settings, 'COMPUTE_SHA512', False))
+        with tracking_write(self.storage_box, self.datafile.size):
+            self.uri = self._storage.save(
+                self.uri or self.create_set_uri(),
+                hashing_file)  # TODO: define behaviour
+            # when overwriting existing files
+        written = hashing_file.checksums
         file_object.close()
-        self.verified = False
-        self.save()
+        if written is None:
+            return False, {}
+        return self.check_file(written=written)
 
     @property
     def _storage(self):
@@ -633,7 +708,8 @@ class DataFileObject(models.Model):
         """
         copies verified file to new storage box
         checks for existing copy
-        triggers async verification if not disabled
+        the copy is verified from the bytes written, and an existing unverified
+        copy is queued for verification if not disabled
         :param StorageBox dest_box: StorageBox instance
         :param bool verify:
         :returns: DataFileObject of copy
@@ -659,25 +735,20 @@ class DataFileObject(models.Model):
                 copy = DataFileObject(
                     datafile=self.datafile,
                     storage_box=dest_box)
-                copy.save()
+                # writing the file verifies it, or queues its verification
+                copy.save(skip_verify=True)
                 copy.file_object = self.file_object
         except Exception as e:
             logger.error(
                 'file copy failed for dfo id: %s, with error: %s' %
                 (self.id, str(e)))
             return False
-        if verify:
-            shadow = 'dfo_verify location:%s' % copy.storage_box.name
-            tasks.dfo_verify.apply_async(
-                args=[copy.id],
-                priority=copy.priority,
-                shadow=shadow)
         return copy
 
     def move_file(self, dest_box=None):
         """
         moves a file
-        copies first, then synchronously verifies
+        copies first, then synchronously verifies by reading the copy back
         deletes file if copy is true copy and has been verified
 
         :param StorageBox dest_box: StorageBox instance
@@ -685,17 +756,22 @@ class DataFileObject(models.Model):
         :rtype: DataFileObject
         """
         copy = self.copy_file(dest_box=dest_box, verify=False)
-        if copy and copy.id != self.id and (copy.verified or copy.verify()):
+        # the bytes written were hashed on their way to storage, which
+        # doesn't show that the destination stored them intact
+        if copy and copy.id != self.id and copy.verify():
             self.delete()
         return copy
 
-    def calculate_checksums(self, compute_md5=True, compute_sha512=False):
+    def calculate_checksums(self, compute_md5=True, compute_sha512=False,
+                            head_size=0):
         """Calculates checksums for a DataFileObject instance
 
         :param compute_md5: whether to compute md5 default=True
         :type compute_md5: bool
         :param compute_sha512: whether to compute sha512, default=True
         :type compute_sha512: bool
+        :param int head_size: number of bytes from the start of the file to
+            return as 'head'
 
         :return: the checksums as {'md5sum': result, 'sha512sum': result}
         :rtype: dict
@@ -711,11 +787,45 @@ class DataFileObject(models.Model):
             module_path, method_name = calculate_checksum_method.rsplit('.', 1)
             module = import_module(module_path)
             calculate_checksums = getattr(module, method_name)
+            if head_size:
+                return calculate_checksums(self, compute_md5, compute_sha512,
+                                           head_size=head_size)
             return calculate_checksums(self, compute_md5, compute_sha512)
 
-        return compute_checksums(self.file_object, compute_md5, compute_sha512)
+        if isinstance(self._storage, FileSystemStorage):
+            cached_file_object = getattr(self, '_cached_file_object', None)
+            if cached_file_object is not None:
+                cached_file_object.close()
+            return compute_file_checksums(
+                self._storage.path(self.uri or self._create_uri()),
+                compute_md5, compute_sha512, head_size=head_size)
 
-    def verify(self, add_checksums=True, add_size=True):  # too complex # noqa
+        return compute_checksums(self.file_object, compute_md5, compute_sha512,
+                                 head_size=head_size)
+
+    def verify(self, add_checksums=True, add_size=True):
+        result, database_update = self.check_file(add_checksums, add_size)
+        self.record_verification(result, database_update)
+        return result
+
+    def check_file(self, add_checksums=True, add_size=True,  # too complex # noqa
+                   written=None):
+        """
+        Compares the size and checksums of the stored file with the
+        DataFile's, without writing anything to the database.  Only the
+        file is read, so this can run in a worker thread as long as the
+        datafile and storage box have already been loaded.
+
+        :param bool add_checksums: fill in checksums missing from the DataFile
+        :param bool add_size: fill in a size missing from the DataFile
+        :param dict written: size and checksums calculated while writing the
+            file, see :attr:`HashingFile.checksums`, to use instead of
+            reading the file back
+        :return: whether the file verified, and the DataFile fields to update,
+            including the MIME type detected from the bytes which were hashed
+            if the DataFile has none
+        :rtype: tuple(bool, dict)
+        """
         compute_md5 = getattr(settings, 'COMPUTE_MD5', True)
         compute_sha512 = getattr(settings, 'COMPUTE_SHA512', False)
         comparisons = ['size']
@@ -737,7 +847,8 @@ class DataFileObject(models.Model):
         io_error_str = 'no error'
         actual = {}
         try:
-            actual['size'] = self.file_object.size
+            actual['size'] = written['size'] if written \
+                else self.file_object.size
             if not empty_value['size'] and \
                actual['size'] == database['size']:
                 same_values['size'] = True
@@ -746,9 +857,14 @@ class DataFileObject(models.Model):
                 if add_size:
                     database_update['size'] = actual['size']
             if same_values.get('size', True):
-                actual.update(self.calculate_checksums(
+                actual.update(written or self.calculate_checksums(
                     compute_md5=compute_md5,
-                    compute_sha512=compute_sha512))
+                    compute_sha512=compute_sha512,
+                    head_size=0 if df.mimetype else MIMETYPE_DETECTION_BYTES))
+                if not df.mimetype and actual.get('head') is not None:
+                    mimetype = detect_mimetype(actual['head'])
+                    if mimetype:
+                        database_update['mimetype'] = mimetype
 
                 def collate_checksums(sum_type):
                     if empty_value[sum_type] and add_checksums:
@@ -768,12 +884,7 @@ class DataFileObject(models.Model):
             io_error_str = str(ioe)
 
         result = all(same_value for same_value in same_values.values())
-        if result:
-            if database_update:
-                for key, val in database_update.items():
-                    setattr(df, key, val)
-                df.save()
-        else:
+        if not result:
             reasons = []
             if io_error:
                 reasons = [io_error_str]
@@ -787,14 +898,37 @@ class DataFileObject(models.Model):
             logger.debug('DataFileObject with id %d did not verify. '
                          'Reasons: %s' %
                          (self.id, ' '.join(reasons)))
+        return result, database_update
 
+    def record_verification(self, result, database_update, save=True):
+        """
+        Stores the outcome of :meth:`check_file`
+
+        :param bool result: whether the file verified
+        :param dict database_update: DataFile fields to update if it verified
+        :param bool save: save the verified flag and time of this
+            DataFileObject, False when the caller saves them in bulk
+        """
+        df = self.datafile
+        if result and database_update:
+            for key, val in database_update.items():
+                setattr(df, key, val)
+            df.save(update_fields=list(database_update))
         self.verified = result
         self.last_verified_time = timezone.now()
-        self.save(update_fields=['verified', 'last_verified_time'])
-        df.update_mimetype()
+        self.verify_lease_expiry = None
+        if save:
+            self.save(update_fields=['verified', 'last_verified_time',
+                                     'verify_lease_expiry'])
+            self.after_verification()
+
+    def after_verification(self):
+        """
+        Follow-up work once the verification has been saved
+        """
+        self.datafile.update_mimetype()
         if getattr(settings, 'USE_FILTERS', False):
             self.apply_filters()
-        return result
 
     def apply_filters(self):
         from django.core.files.storage import FileSystemStorage
@@ -843,12 +977,12 @@ class DataFileObject(models.Model):
 @receiver(pre_delete, sender=DataFileObject, dispatch_uid='dfo_delete')
 def delete_dfo(sender, instance, **kwargs):
     '''
-    Deletes the actual file / object, before deleting the database record
+    Deletes the actual file / object, before deleting the database record,
+    unless the caller has already deleted it
     '''
-    can_delete = getattr(
-        instance.storage_box.attributes.filter(key='can_delete').first(),
-        'value', 'True')
-    if can_delete.lower() == 'true' and instance.uri:
+    if getattr(instance, '_data_deleted', False):
+        return
+    if instance.storage_box.can_delete and instance.uri:
         try:
             instance.delete_data()
         except NotImplementedError:
@@ -865,7 +999,8 @@ def delete_dfo(sender, instance, **kwargs):
 def compute_checksums(file_object,
                       compute_md5=True,
                       compute_sha512=False,
-                      close_file=True):
+                      close_file=True,
+                      head_size=0):
     """Computes checksums for a python file object
 
     :param object file_object: Python File object
@@ -874,8 +1009,11 @@ def compute_checksums(file_object,
     :param compute_sha512: whether to compute sha512, default=True
     :type compute_sha512: bool
     :param bool close_file: whether to close the file_object, default=True
+    :param int head_size: number of bytes from the start of the file to
+        return as 'head', default=0
 
-    :return: the checksums as {'md5sum': result, 'sha512sum': result}
+    :return: the checksums as {'md5sum': result, 'sha512sum': result}, and
+        'head' if head_size was given
     :rtype: dict
     """
     blocksize = 0
@@ -890,8 +1028,11 @@ def compute_checksums(file_object,
         results['sha512sum'] = sha512_hasher
     update_fns = {'md5sum': lambda x, y: x.update(y),
                   'sha512sum': lambda x, y: x.update(y)}
+    head = b''
     file_object.seek(0)
     for chunk in iter(lambda: file_object.read(32 * blocksize), b''):
+        if len(head) < head_size:
+            head += chunk[:head_size - len(head)]
         for key, val in results.items():
             update_fns[key](val, chunk)
     if close_file:
@@ -900,4 +1041,327 @@ def compute_checksums(file_object,
         file_object.seek(0)
     final_fns = {'md5sum': lambda x: x.hexdigest(),
                  'sha512sum': lambda x: x.hexdigest()}
-    return {key: final_fns[key](val) for key, val in results.items()}
+    checksums = {key: final_fns[key](val) for key, val in results.items()}
+    if head_size:
+        checksums['head'] = head
+    return checksums
+
+
+def compute_file_checksums(file_path,
+                           compute_md5=True,
+                           compute_sha512=False,
+                           buffer_size=1024 * 1024,
+                           head_size=0):
+    """Computes checksums for a file on a local filesystem
+
+    This is faster than :func:`compute_checksums` for local files: the file
+    is read into one reusable buffer, which is passed to each hasher without
+    being copied, and the kernel is told that the file will be read
+    sequentially, so that it reads ahead.
+
+    :param str file_path: path of the file
+    :param compute_md5: whether to compute md5 default=True
+    :type compute_md5: bool
+    :param compute_sha512: whether to compute sha512, default=True
+    :type compute_sha512: bool
+    :param int buffer_size: number of bytes to read at a time
+    :param int head_size: number of bytes from the start of the file to
+        return as 'head', default=0
+
+    :return: the checksums as {'md5sum': result, 'sha512sum': result}, and
+        'head' if head_size was given
+    :rtype: dict
+    """
+    head = b''
+    hashers = {}
+    if compute_md5:
+        hashers['md5sum'] = hashlib.new('md5')
+    if compute_sha512:
+        hashers['sha512sum'] = hashlib.new('sha512')
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+    with open(file_path, 'rb', buffering=0) as file_object:
+        if hasattr(os, 'posix_fadvise'):
+            try:
+                os.posix_fadvise(file_object.fileno(), 0, 0,
+                                 os.POSIX_FADV_SEQUENTIAL)
+            except OSError:
+                pass
+        for size in iter(lambda: file_object.readinto(buffer), 0):
+            chunk = view[:size]
+            if len(head) < head_size:
+                head += chunk[:head_size - len(head)].tobytes()
+            for hasher in hashers.values():
+                hasher.update(chunk)
+    checksums = {key: hasher.hexdigest() for key, hasher in hashers.items()}
+    if head_size:
+        checksums['head'] = head
+    return checksums
+
+
+_magic_lock = threading.Lock()
+_magic = None
+
+
+def detect_mimetype(head):
+    """Detects the MIME type of a file from its first bytes
+
+    One libmagic handle is opened per process, the first time it is needed,
+    instead of loading the magic database for each file.  libmagic handles
+    aren't thread safe, so the handle is used by one thread at a time.
+
+    :param bytes head: the first :data:`MIMETYPE_DETECTION_BYTES` of the file
+    :return: the MIME type and encoding, e.g. 'text/plain; charset=us-ascii',
+        without the encoding of binary files, or None if libmagic failed
+    :rtype: str
+    """
+    global _magic
+    try:
+        with _magic_lock:
+            if _magic is None:
+                _magic = magic.Magic(mime_and_encoding=True)
+            mimetype = _magic.from_buffer(bytes(head))
+    except Exception:
+        logger.warning('libmagic could not detect a MIME type',
+                       exc_info=True)
+        return None
+    if ';' in mimetype:
+        mt, enc = mimetype.split(';')
+        if enc.endswith('charset=binary'):
+            mimetype = mt
+    return mimetype
+
+
+def delete_dfos_concurrently(dfos, max_workers=None):
+    """Deletes DataFileObjects and their files, deleting several files at once
+
+    The files are deleted in a pool of threads, as the pre_delete receiver
+    :func:`delete_dfo` would delete them, and then the database records are
+    deleted together.  A DataFileObject is kept if its file couldn't be
+    deleted for any reason other than an OSError, which usually means that
+    the file is already gone.
+
+    :param dfos: DataFileObjects, with their storage boxes loaded
+    :type dfos: list of DataFileObject
+    :param int max_workers: number of files to delete at once, defaults to
+        CLEANUP_DELETE_WORKERS
+    :return: the DataFileObjects which were deleted
+    :rtype: list of DataFileObject
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from django.db import router
+    from django.db.models.deletion import Collector
+
+    if not dfos:
+        return []
+    if max_workers is None:
+        max_workers = getattr(settings, 'CLEANUP_DELETE_WORKERS', 8)
+    boxes = {dfo.storage_box_id: dfo.storage_box for dfo in dfos}
+    can_delete = {box_id: box.can_delete for box_id, box in boxes.items()}
+    storages = {box_id: box.get_initialised_storage_instance()
+                for box_id, box in boxes.items() if can_delete[box_id]}
+    for dfo in dfos:
+        if dfo.storage_box_id in storages:
+            dfo._cached_storage = storages[dfo.storage_box_id]
+
+    def delete_data(dfo):
+        if not dfo.uri or not can_delete[dfo.storage_box_id]:
+            return True
+        try:
+            dfo.delete_data()
+        except OSError:
+            logger.debug('could not delete the file of DataFileObject with '
+                         'id %d, it may not exist' % dfo.id)
+        except NotImplementedError:
+            logger.info('deletion not supported on storage box %s, '
+                        'for dfo id %s' % (dfo.storage_box, dfo.id))
+        except Exception:
+            logger.exception('could not delete the file of DataFileObject '
+                             'with id %d' % dfo.id)
+            return False
+        return True
+
+    with ThreadPoolExecutor(
+            max_workers=max(1, min(max_workers, len(dfos)))) as executor:
+        deleted = [dfo for dfo, data_deleted
+                   in zip(dfos, executor.map(delete_data, dfos))
+                   if data_deleted]
+    for dfo in deleted:
+        dfo._data_deleted = True
+    if deleted:
+        collector = Collector(using=router.db_for_write(DataFileObject))
+        collector.collect(deleted)
+        collector.delete()
+    return deleted
+
+
+class HashingFile(File):
+    """Wraps a file which is being written to storage, calculating its size
+    and checksums from the bytes which the storage backend reads from it
+
+    The checksums are only available when the whole file was read exactly
+    once, in order.  Seeking back to the start begins again, but any other
+    jump discards them.
+    """
+
+    def __init__(self, file_object, compute_md5=True, compute_sha512=False):
+        super().__init__(file_object, getattr(file_object, 'name', None))
+        self._algorithms = {}
+        if compute_md5:
+            self._algorithms['md5sum'] = 'md5'
+        if compute_sha512:
+            self._algorithms['sha512sum'] = 'sha512'
+        self._restart(file_object.tell())
+
+    def _restart(self, position):
+        self._position = position
+        self._head = b''
+        if position == 0:
+            self._hashers = {key: hashlib.new(algorithm)
+                             for key, algorithm in self._algorithms.items()}
+        else:
+            self._hashers = None
+
+    def _update(self, data):
+        if self._hashers is not None:
+            if not isinstance(data, bytes):
+                self._hashers = None
+            else:
+                if len(self._head) < MIMETYPE_DETECTION_BYTES:
+                    self._head += data[
+                        :MIMETYPE_DETECTION_BYTES - len(self._head)]
+                for hasher in self._hashers.values():
+                    hasher.update(data)
+        self._position += len(data)
+        return data
+
+    def read(self, *args, **kwargs):
+        return self._update(self.file.read(*args, **kwargs))
+
+    def readline(self, *args, **kwargs):
+        return self._update(self.file.readline(*args, **kwargs))
+
+    def readlines(self, *args, **kwargs):
+        return [self._update(line)
+                for line in self.file.readlines(*args, **kwargs)]
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def seek(self, *args, **kwargs):
+        result = self.file.seek(*args, **kwargs)
+        position = self.file.tell()
+        if position != self._position:
+            self._restart(position)
+        return result
+
+    @property
+    def checksums(self):
+        """
+        :return: the size, checksums and first bytes as {'size': size,
+            'md5sum': result, 'sha512sum': result, 'head': bytes}, or None
+            if they weren't calculated from the whole file
+        :rtype: dict
+        """
+        if self._hashers is None or self._position != self.size:
+            return None
+        checksums = {key: hasher.hexdigest()
+                     for key, hasher in self._hashers.items()}
+        checksums['size'] = self._position
+        checksums['head'] = self._head
+        return checksums
+
+
+class ByteRateLimiter(object):
+    """Paces reads from several threads to an average number of bytes per
+    second, by giving each read a start time after the reads before it
+    """
+
+    def __init__(self, bytes_per_second):
+        self.bytes_per_second = bytes_per_second
+        self._lock = threading.Lock()
+        self._next_start = time.monotonic()
+
+    def wait(self, num_bytes):
+        """
+        blocks until num_bytes may be read
+        """
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_start)
+            self._next_start = start + num_bytes / self.bytes_per_second
+        if start > now:
+            time.sleep(start - now)
+
+
+def verify_dfos_concurrently(dfo_ids, max_workers=None, reverify=False,
+                             bytes_per_second=None):
+    """Verifies a batch of DataFileObjects, hashing several files at once
+
+    The files are read and hashed in a pool of threads, which run in
+    parallel because hashlib releases the GIL for large buffers.  All
+    database access stays in the calling thread: the DataFileObjects are
+    loaded with one query and their results are written back with one bulk
+    update.  DataFileObjects which are already verified are skipped, unless
+    reverify is set.
+
+    :param dfo_ids: ids of the DataFileObjects to verify
+    :type dfo_ids: list of int
+    :param int max_workers: number of files to hash at once, defaults to the
+        verify_concurrency of the storage box of each DataFileObject
+    :param bool reverify: check DataFileObjects which have already been
+        verified again, without repeating the work which follows their
+        first verification
+    :param int bytes_per_second: limit on the average rate at which files
+        are read, or None
+    :return: the verification results as {dfo_id: result}
+    :rtype: dict
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    dfos = DataFileObject.objects.filter(id__in=dfo_ids)
+    if not reverify:
+        dfos = dfos.filter(verified=False)
+    dfos = list(dfos.select_related('datafile', 'storage_box')
+                .prefetch_related('storage_box__options'))
+    if not dfos:
+        return {}
+    boxes = {dfo.storage_box_id: dfo.storage_box for dfo in dfos}
+    # share one storage instance per box between the worker threads
+    storages = {box_id: box.get_initialised_storage_instance()
+                for box_id, box in boxes.items()}
+    for dfo in dfos:
+        dfo._cached_storage = storages[dfo.storage_box_id]
+    if max_workers is None:
+        max_workers = min(box.verify_concurrency for box in boxes.values())
+    max_workers = max(1, min(max_workers, len(dfos)))
+
+    limiter = ByteRateLimiter(bytes_per_second) if bytes_per_second else None
+
+    def check(dfo):
+        try:
+            if limiter is not None:
+                limiter.wait(dfo.datafile.size or 0)
+            return dfo.check_file()
+        except Exception:
+            logger.exception('verification of DataFileObject with id %d '
+                             'failed' % dfo.id)
+            return None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        checks = list(executor.map(check, dfos))
+
+    checked = []
+    for dfo, outcome in zip(dfos, checks):
+        if outcome is None:
+            continue
+        dfo.record_verification(*outcome, save=False)
+        checked.append(dfo)
+    DataFileObject.objects.bulk_update(
+        checked, ['verified', 'last_verified_time', 'verify_lease_expiry'])
+    if not reverify:
+        for dfo in checked:
+            dfo.after_verification()
+    return {dfo.id: dfo.verified for dfo in checked}
@@ -75,6 +75,9 @@ class Dataset(models.Model):
         return self.description
 
     def get_first_experiment(self):
+        cached_experiment = getattr(self, '_cached_first_experiment', None)
+        if cached_experiment is not None:
+            return cached_experiment
         return self.experiments.order_by('created_time')[:1].get()
 
     def get_path(self):
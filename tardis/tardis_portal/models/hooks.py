@@ -1,9 +1,13 @@
 import logging
 
 from django.conf import settings
+from django.db.models import Q
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 
+from .access_control import ExperimentAccess, ObjectACL
+from .archive import CachedArchive
+from .datafile import DataFile
 from .experiment import Experiment, ExperimentAuthor
 from .parameters import ExperimentParameter, ExperimentParameterSet
 
@@ -53,3 +57,47 @@ def post_save_experiment_parameter(sender, **kwargs):
 def post_save_experiment(sender, **kwargs):
     experiment = kwargs['instance']
     publish_public_expt_rifcs(experiment)
+
+
+# ## Archive cache hooks ## #
+# the DataFile fields which change the contents of its archives, unlike e.g.
+# the MIME type or the checksums filled in by verification
+ARCHIVE_FIELDS = {'dataset', 'dataset_id', 'filename', 'directory', 'size',
+                  'modification_time', 'deleted'}
+
+
+@receiver(post_save, sender=DataFile)
+@receiver(post_delete, sender=DataFile)
+def invalidate_cached_archives(sender, **kwargs):
+    """
+    Queues the deletion of the cached archives of a DataFile's dataset and
+    experiments when the DataFile changes.  The archives would no longer be
+    sent anyway, as they are keyed by the checksums and paths of their
+    members, so this only frees their space sooner.
+    """
+    if not getattr(settings, 'ARCHIVE_CACHE_STORAGE_BOX', None) or \
+            kwargs.get('raw', False):
+        return
+    update_fields = kwargs.get('update_fields')
+    if update_fields and not ARCHIVE_FIELDS.intersection(update_fields):
+        return
+    datafile = kwargs['instance']
+    cached_archive_ids = list(CachedArchive.objects.filter(
+        Q(dataset_id=datafile.dataset_id) |
+        Q(experiment__datasets__id=datafile.dataset_id)).values_list(
+            'id', flat=True).distinct())
+    if cached_archive_ids:
+        from ..tasks import delete_cached_archives
+        delete_cached_archives.apply_async(args=[cached_archive_ids])
+
+
+# ## Experiment access hooks ## #
+@receiver(post_save, sender=ObjectACL)
+def post_save_objectacl(sender, **kwargs):
+    """
+    Keeps the ExperimentAccess row of an experiment ACL in sync.  Rows are
+    deleted along with their ACL or experiment, and ACLs loaded from
+    fixtures are added by the sweep_experiment_access task.
+    """
+    if not kwargs.get('raw', False):
+        ExperimentAccess.sync_acl(kwargs['instance'])
@@ -2,7 +2,6 @@ import base64
 import os
 import logging
 import pickle
-import random
 
 from django.conf import settings
 from django.db import models
@@ -76,6 +75,9 @@ class StorageBox(models.Model):
 
     @property
     def storage_type(self):
+        cached_storage_type = getattr(self, '_cached_storage_type', None)
+        if cached_storage_type is not None:
+            return cached_storage_type
         try:
             storage_type = self.attributes.get(key='type').value
             return StorageBox.TYPES.get(
@@ -97,6 +99,16 @@ class StorageBox(models.Model):
         except StorageBoxAttribute.DoesNotExist:
             return False
 
+    @property
+    def can_delete(self):
+        '''
+        Whether files are deleted from this box along with their
+        DataFileObjects
+        '''
+        can_delete = getattr(
+            self.attributes.filter(key='can_delete').first(), 'value', 'True')
+        return can_delete.lower() == 'true'
+
     @property
     def priority(self):
         '''
@@ -106,6 +118,34 @@ class StorageBox(models.Model):
             self.attributes.filter(key='priority').first(),
             'value', settings.DEFAULT_TASK_PRIORITY))
 
+    @property
+    def verify_concurrency(self):
+        '''
+        Number of files in this box which a verification task hashes at once
+        '''
+        return int(getattr(
+            self.attributes.filter(key='verify_concurrency').first(),
+            'value', getattr(settings, 'VERIFY_CONCURRENCY', 4)))
+
+    @property
+    def reverify_concurrency(self):
+        '''
+        Number of files in this box which are read at once to re-verify them
+        '''
+        return int(getattr(
+            self.attributes.filter(key='reverify_concurrency').first(),
+            'value', getattr(settings, 'REVERIFY_CONCURRENCY', 1)))
+
+    @property
+    def reverify_bytes_per_second(self):
+        '''
+        Rate at which files in this box are read to re-verify them
+        '''
+        return int(getattr(
+            self.attributes.filter(key='reverify_bytes_per_second').first(),
+            'value',
+            getattr(settings, 'REVERIFY_BYTES_PER_SECOND', 10 * 1024 * 1024)))
+
     def get_options_as_dict(self):
         opts_dict = {}
         # using ugly for loop for python 2.6 compatibility
@@ -128,21 +168,34 @@ class StorageBox(models.Model):
         """
         Get cache box if set up
         """
-        caches = [box for box in self.child_boxes.all()
+        from ..storage.placement import get_placement_policy
+        caches = [box for box in self.child_boxes.order_by('id')
                   if box.storage_type == StorageBox.CACHE]
-        if len(caches) == 1:
-            return caches[0]
-        if len(caches) > 1:
-            return caches[random.choice(range(len(caches)))]
-        return None
+        return get_placement_policy().choose(caches)
 
     def copy_files(self, dest_box=None):
-        for dfo in self.file_objects.all():
-            dfo.copy_file(dest_box)
+        """
+        Copies the verified files to another box, resuming an interrupted
+        copy if there is one
+
+        :param StorageBox dest_box: defaults to the default storage box
+        """
+        from .transfer import StorageBoxTransfer
+        if dest_box is None:
+            dest_box = StorageBox.get_default_storage()
+        StorageBoxTransfer.resume(self, dest_box).run()
 
     def move_files(self, dest_box=None):
-        for dfo in self.file_objects.all():
-            dfo.move_file(dest_box)
+        """
+        Moves the verified files to another box, resuming an interrupted
+        move if there is one
+
+        :param StorageBox dest_box: defaults to the default storage box
+        """
+        from .transfer import StorageBoxTransfer
+        if dest_box is None:
+            dest_box = StorageBox.get_default_storage()
+        StorageBoxTransfer.resume(self, dest_box, move=True).run()
 
     def copy_to_master(self):
         if getattr(self, 'master_box'):
@@ -153,31 +206,32 @@ class StorageBox(models.Model):
             self.move_files(self.master_box)
 
     @classmethod
-    def get_default_storage(cls, location=None, user=None):
+    def get_default_storage(cls, location=None, user=None, size=None):
         '''
         gets default storage box or get local storage box with given base
         location or create one if it doesn't exist.
 
         policies:
-        Have a StorageBoxAttribute: key='default', value=True
+        Have a StorageBoxAttribute: key='default', value=True, if several
+        boxes have one the STORAGE_PLACEMENT_POLICY chooses between them
         find a storage box where location is DEFAULT_STORAGE_BASE_DIR
         create a default storage box at DEFAULT_STORAGE_BASE_DIR
         lowest id storage box is default
         no storage box defined, use hard coded default for now  TODO: consider removing this
 
-        Would be nice: get largest free space one, test for authorisation
+        Would be nice: test for authorisation
+
+        :param int size: size of the file to be stored, if known
         '''
         if location is None:
-            try:
-                # TODO: test for authorisation,
-                # e.g. user.has_perm('storage_box.write', box)
-                # TODO: check for free space, e.g. run SQL as on stats page to
-                # get total size on box,
-                # compute max(list, key=lambda x:max_size-size)
-                return StorageBox.objects.get(attributes__key='default',
-                                              attributes__value='True')
-            except StorageBox.DoesNotExist:
-                pass  # continue with other options
+            from ..storage.placement import get_placement_policy
+            # TODO: test for authorisation,
+            # e.g. user.has_perm('storage_box.write', box)
+            default_boxes = list(StorageBox.objects.filter(
+                attributes__key='default',
+                attributes__value='True').order_by('id'))
+            if default_boxes:
+                return get_placement_policy().choose(default_boxes, size)
         default_location = getattr(settings, "DEFAULT_STORAGE_BASE_DIR", None)
         if location is not None or default_location is not None:
             box_location = location or default_location
@@ -0,0 +1,221 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import models
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+from django.utils.encoding import python_2_unicode_compatible
+
+from .datafile import (DataFileObject, delete_dfos_concurrently,
+                       verify_dfos_concurrently)
+from .storage import StorageBox
+
+logger = logging.getLogger(__name__)
+
+
+@python_2_unicode_compatible
+class StorageBoxTransfer(models.Model):
+    '''
+    Copies or moves the verified files in one storage box to another,
+    recording its progress so that an interrupted transfer resumes where
+    it stopped.
+
+    :attribute last_dfo_id: checkpoint, the source box's DataFileObjects
+        are transferred in id order, and those up to this id are done
+    :attribute files_copied: files copied and verified
+    :attribute files_skipped: files which already had a verified copy
+    :attribute files_failed: files which couldn't be copied or whose copy
+        didn't verify, or, when moving, whose copy didn't read back intact
+    :attribute files_deleted: source files deleted after being moved
+    :attribute finished_time: None until all of the files have been
+        transferred
+    '''
+
+    source_box = models.ForeignKey(StorageBox, related_name='transfers_out',
+                                   on_delete=models.CASCADE)
+    dest_box = models.ForeignKey(StorageBox, related_name='transfers_in',
+                                 on_delete=models.CASCADE)
+    move = models.BooleanField(default=False)
+    last_dfo_id = models.BigIntegerField(default=0)
+    files_copied = models.IntegerField(default=0)
+    files_skipped = models.IntegerField(default=0)
+    files_failed = models.IntegerField(default=0)
+    files_deleted = models.IntegerField(default=0)
+    started_time = models.DateTimeField(auto_now_add=True)
+    updated_time = models.DateTimeField(auto_now=True)
+    finished_time = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        app_label = 'tardis_portal'
+
+    def __str__(self):
+        return '%s %s to %s' % ('Move' if self.move else 'Copy',
+                                self.source_box, self.dest_box)
+
+    @classmethod
+    def resume(cls, source_box, dest_box, move=False):
+        '''
+        Returns the unfinished transfer between two boxes, or a new one
+        '''
+        transfer = cls.objects.filter(
+            source_box=source_box, dest_box=dest_box, move=move,
+            finished_time__isnull=True).order_by('-id').first()
+        if transfer is None:
+            transfer = cls.objects.create(
+                source_box=source_box, dest_box=dest_box, move=move)
+        return transfer
+
+    def run(self, batch_size=None, max_workers=None):
+        '''
+        Transfers the remaining files, saving the progress after each batch
+
+        :param int batch_size: number of DataFileObjects per batch, defaults
+            to TRANSFER_BATCH_SIZE
+        :param int max_workers: number of files to copy at once, defaults to
+            TRANSFER_WORKERS
+        '''
+        if batch_size is None:
+            batch_size = getattr(settings, 'TRANSFER_BATCH_SIZE', 100)
+        if max_workers is None:
+            max_workers = getattr(settings, 'TRANSFER_WORKERS', 4)
+        if self.source_box_id != self.dest_box_id:
+            while self.run_batch(batch_size, max_workers):
+                pass
+        self.finished_time = timezone.now()
+        self.save()
+        logger.info('%s finished: %d files copied, %d already copied, '
+                    '%d failed, %d deleted' % (
+                        self, self.files_copied, self.files_skipped,
+                        self.files_failed, self.files_deleted))
+
+    def run_batch(self, batch_size, max_workers):
+        '''
+        Transfers the next batch of files
+
+        :return: False if there were no files left to transfer
+        :rtype: bool
+        '''
+        dest_copies = DataFileObject.objects.filter(
+            datafile_id=OuterRef('datafile_id'), storage_box=self.dest_box)
+        dfos = list(
+            self.source_box.file_objects
+            .filter(verified=True, id__gt=self.last_dfo_id)
+            .annotate(copy_id=Subquery(dest_copies.values('id')[:1]),
+                      copy_verified=Subquery(
+                          dest_copies.values('verified')[:1]))
+            .select_related('datafile__dataset', 'storage_box')
+            .order_by('id')[:batch_size])
+        if not dfos:
+            return False
+        last_dfo_id = dfos[-1].id
+
+        transferred = [dfo for dfo in dfos if dfo.copy_verified]
+        self.files_skipped += len(transferred)
+        to_copy = [dfo for dfo in dfos if dfo.copy_id is None]
+
+        # copies left unverified, e.g. by an interrupted transfer
+        unverified = {dfo.copy_id: dfo for dfo in dfos
+                      if dfo.copy_id is not None and not dfo.copy_verified}
+        results = verify_dfos_concurrently(list(unverified),
+                                           max_workers=max_workers)
+        bad_copies = [copy_id for copy_id in unverified
+                      if not results.get(copy_id)]
+        read_back = set()
+        for copy_id, result in results.items():
+            if result:
+                transferred.append(unverified[copy_id])
+                read_back.add(copy_id)
+                self.files_copied += 1
+        delete_dfos_concurrently(list(
+            DataFileObject.objects.filter(id__in=bad_copies)
+            .select_related('storage_box')))
+        to_copy.extend(unverified[copy_id] for copy_id in bad_copies)
+
+        copied, copies_read_back = self._copy_files(to_copy, max_workers)
+        transferred.extend(copied)
+        read_back.update(copies_read_back)
+        self.files_copied += len(copied)
+        self.files_failed += len(to_copy) - len(copied)
+
+        if self.move:
+            # the copies verified from the bytes written are read back
+            # before the only other copy of their files is deleted
+            results = verify_dfos_concurrently(
+                [dfo.copy_id for dfo in transferred
+                 if dfo.copy_id not in read_back],
+                max_workers=max_workers, reverify=True)
+            moved = [dfo for dfo in transferred
+                     if dfo.copy_id in read_back or results.get(dfo.copy_id)]
+            self.files_failed += len(transferred) - len(moved)
+            self.files_deleted += len(delete_dfos_concurrently(
+                moved, max_workers=max_workers))
+        self.last_dfo_id = last_dfo_id
+        self.save()
+        return True
+
+    def _copy_files(self, dfos, max_workers):
+        '''
+        Copies files to the destination box, several at once, and verifies
+        the copies, setting the copy_id of each source DataFileObject
+
+        :return: the source DataFileObjects which were copied, and the ids of
+            the copies which were verified by reading them back rather than
+            from the bytes written
+        :rtype: tuple(list of DataFileObject, set of int)
+        '''
+        if not dfos:
+            return [], set()
+        source_storage = self.source_box.get_initialised_storage_instance()
+        dest_storage = self.dest_box.get_initialised_storage_instance()
+        copies = []
+        for dfo in dfos:
+            dfo._cached_storage = source_storage
+            copy = DataFileObject(datafile=dfo.datafile,
+                                  storage_box=self.dest_box)
+            copy._cached_storage = dest_storage
+            copy.create_set_uri()
+            copy.save(skip_verify=True)
+            dfo.copy_id = copy.id
+            copies.append(copy)
+
+        def copy_file(pair):
+            dfo, copy = pair
+            try:
+                return copy.write_file(dfo.file_object)
+            except Exception:
+                logger.exception('could not copy DataFileObject with id %d '
+                                 'to storage box %s' % (dfo.id, self.dest_box))
+                return None
+
+        with ThreadPoolExecutor(
+                max_workers=max(1, min(max_workers, len(dfos)))) as executor:
+            outcomes = list(executor.map(copy_file, zip(dfos, copies)))
+
+        written = []
+        to_verify = []
+        failed = []
+        for dfo, copy, outcome in zip(dfos, copies, outcomes):
+            if outcome is None:
+                failed.append(copy)
+                continue
+            result, database_update = outcome
+            if result:
+                copy.record_verification(result, database_update, save=False)
+            else:
+                to_verify.append(copy.id)
+            written.append(copy)
+        DataFileObject.objects.bulk_update(
+            written, ['uri', 'verified', 'last_verified_time',
+                      'verify_lease_expiry'])
+        for copy in written:
+            if copy.verified:
+                copy.after_verification()
+        # copies whose checksums couldn't be calculated while writing them
+        results = verify_dfos_concurrently(to_verify, max_workers=max_workers)
+        failed.extend(copy for copy in written
+                      if not copy.verified and not results.get(copy.id))
+        delete_dfos_concurrently(failed, max_workers=max_workers)
+        failed_ids = {copy.datafile_id for copy in failed}
+        return ([dfo for dfo in dfos if dfo.datafile_id not in failed_ids],
+                {copy_id for copy_id, result in results.items() if result})
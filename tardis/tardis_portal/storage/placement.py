@@ -0,0 +1,250 @@
+"""
+Placement policies choose the storage box for new files, among several boxes
+which could hold them, e.g. the boxes with a 'default' attribute or the cache
+boxes of a box.
+
+The policy is set by STORAGE_PLACEMENT_POLICY.  The default,
+:class:`LeastLoadedPolicy`, balances writes using the statistics which each
+process keeps about the boxes: the bytes they hold, the writes in progress
+and the recent write latency.
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from importlib import import_module
+
+from django.conf import settings
+from django.db.models import Sum
+
+logger = logging.getLogger(__name__)
+
+MIB = 1024 * 1024
+
+# weight of the latest write in the moving average of the write latency
+LATENCY_SMOOTHING = 0.2
+
+
+class BoxStats(object):
+    '''
+    What this process knows about the load on one storage box
+
+    :attribute used_bytes: bytes in the box when they were last counted,
+        plus the files placed in it since, or None if not counted yet
+    :attribute counted_time: when used_bytes was counted
+    :attribute writes: number of writes to the box in progress
+    :attribute latency: moving average of the seconds taken to write a MiB
+        to the box, counting smaller files as a MiB, or None
+    '''
+
+    def __init__(self):
+        self.used_bytes = None
+        self.counted_time = None
+        self.writes = 0
+        self.latency = None
+
+
+_stats_lock = threading.Lock()
+_stats = {}
+
+
+def _get_stats(box_id):
+    # callers must hold _stats_lock
+    if box_id not in _stats:
+        _stats[box_id] = BoxStats()
+    return _stats[box_id]
+
+
+def get_box_stats(boxes):
+    '''
+    Returns the statistics of several storage boxes, counting the bytes used
+    in those whose count is older than PLACEMENT_USAGE_CACHE_SECONDS with one
+    query
+
+    :param boxes: the storage boxes
+    :type boxes: list of StorageBox
+    :return: {box_id: BoxStats}, copies which the caller can keep
+    :rtype: dict
+    '''
+    from ..models import DataFileObject
+
+    max_age = getattr(settings, 'PLACEMENT_USAGE_CACHE_SECONDS', 300)
+    now = time.monotonic()
+    with _stats_lock:
+        stale = [box.id for box in boxes
+                 if _get_stats(box.id).counted_time is None or
+                 now - _get_stats(box.id).counted_time > max_age]
+    if stale:
+        used = dict(
+            DataFileObject.objects.filter(storage_box_id__in=stale)
+            .values_list('storage_box_id')
+            .annotate(used=Sum('datafile__size'))
+            .order_by())
+        with _stats_lock:
+            for box_id in stale:
+                stats = _get_stats(box_id)
+                stats.used_bytes = used.get(box_id) or 0
+                stats.counted_time = now
+    result = {}
+    with _stats_lock:
+        for box in boxes:
+            stats = BoxStats()
+            stats.__dict__.update(_get_stats(box.id).__dict__)
+            result[box.id] = stats
+    return result
+
+
+def record_placement(box, size):
+    '''
+    Adds a file written to a storage box to the bytes it holds, until they
+    are next counted
+    '''
+    if not size:
+        return
+    with _stats_lock:
+        stats = _get_stats(box.id)
+        if stats.used_bytes is not None:
+            stats.used_bytes += size
+
+
+@contextmanager
+def tracking_write(box, size=None):
+    '''
+    Counts a write to a storage box as in progress while the block runs.
+    If it succeeds, the time it took is added to the box's write latency
+    and the bytes written to the bytes it holds, see
+    :func:`record_placement`.  Choosing a box doesn't count, as the caller
+    may end up writing elsewhere.
+
+    :param StorageBox box: the box being written to
+    :param int size: bytes being written, if known
+    '''
+    with _stats_lock:
+        _get_stats(box.id).writes += 1
+    start = time.monotonic()
+    succeeded = False
+    try:
+        yield
+        succeeded = True
+    finally:
+        seconds = (time.monotonic() - start) * MIB / max(size or 0, MIB)
+        with _stats_lock:
+            stats = _get_stats(box.id)
+            stats.writes -= 1
+            if succeeded:
+                if stats.latency is None:
+                    stats.latency = seconds
+                else:
+                    stats.latency += LATENCY_SMOOTHING * (
+                        seconds - stats.latency)
+        if succeeded:
+            record_placement(box, size)
+
+
+def has_room(box, stats, size=None):
+    '''
+    Whether a file fits in a storage box.  Boxes without a max_size are
+    never full.
+    '''
+    if not box.max_size or stats.used_bytes is None:
+        return True
+    return stats.used_bytes + (size or 0) <= box.max_size
+
+
+class PlacementPolicy(object):
+    '''
+    Base class of placement policies
+    '''
+
+    def choose(self, boxes, size=None):
+        '''
+        Chooses the box for a new file
+
+        :param boxes: candidate boxes, ordered by id
+        :type boxes: list of StorageBox
+        :param int size: size of the file, if known
+        :return: the box, or None if there are no candidates
+        :rtype: StorageBox
+        '''
+        raise NotImplementedError
+
+
+class FirstBoxPolicy(PlacementPolicy):
+    '''
+    Always chooses the first box
+    '''
+
+    def choose(self, boxes, size=None):
+        return boxes[0] if boxes else None
+
+
+class LeastLoadedPolicy(PlacementPolicy):
+    '''
+    Chooses the least loaded box which has room for the file.
+
+    The load of a box is the time expected for a write to finish: its recent
+    write latency multiplied by the writes already in progress plus one.
+    Boxes whose load is within PLACEMENT_LOAD_TOLERANCE of the lowest count
+    as equally loaded, and among those the box with the smallest fraction of
+    its max_size used is chosen, so that writes spread over boxes which
+    perform alike.  If no box has room, the one with the most free space is
+    chosen.
+    '''
+
+    def choose(self, boxes, size=None):
+        if len(boxes) <= 1:
+            return boxes[0] if boxes else None
+        stats = get_box_stats(boxes)
+        candidates = [box for box in boxes
+                      if has_room(box, stats[box.id], size)]
+        if not candidates:
+            box = max(boxes, key=lambda box: (
+                box.max_size or 0) - (stats[box.id].used_bytes or 0))
+            logger.warning('none of the storage boxes %s has room for %s '
+                           'bytes, using %s' % (
+                               ', '.join(str(box) for box in boxes),
+                               size, box))
+            return box
+
+        known = [stats[box.id].latency for box in candidates
+                 if stats[box.id].latency is not None]
+        # boxes without any writes yet are assumed to be as fast as the
+        # fastest box
+        default_latency = min(known) if known else 1.0
+
+        def load(box):
+            latency = stats[box.id].latency
+            if latency is None:
+                latency = default_latency
+            return (stats[box.id].writes + 1) * latency
+
+        def used_fraction(box):
+            if not box.max_size:
+                return 0.0
+            return (stats[box.id].used_bytes or 0) / box.max_size
+
+        lowest = min(load(box) for box in candidates)
+        tolerance = getattr(settings, 'PLACEMENT_LOAD_TOLERANCE', 0.25)
+        box = min((box for box in candidates
+                   if load(box) <= lowest * (1 + tolerance)),
+                  key=lambda box: (used_fraction(box),
+                                   stats[box.id].writes,
+                                   stats[box.id].used_bytes or 0))
+        return box
+
+
+_policies = {}
+
+
+def get_placement_policy():
+    '''
+    Returns the placement policy named by STORAGE_PLACEMENT_POLICY
+    '''
+    policy_path = getattr(
+        settings, 'STORAGE_PLACEMENT_POLICY',
+        'tardis.tardis_portal.storage.placement.LeastLoadedPolicy')
+    if policy_path not in _policies:
+        module_path, class_name = policy_path.rsplit('.', 1)
+        _policies[policy_path] = getattr(
+            import_module(module_path), class_name)()
+    return _policies[policy_path]
@@ -1,10 +1,12 @@
 import logging
+from itertools import groupby
+from operator import itemgetter
 
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.sites.models import Site
 from django.db import transaction
-from django.db.models import Q
+from django.db.models import Count, Q
 
 from tardis.celery import tardis_app
 from .email import email_user
@@ -15,53 +17,181 @@ logger = logging.getLogger(__name__)
 
 @tardis_app.task(name="tardis_portal.cleanup_dfs", ignore_result=True)
 def cleanup_dfs(**kwargs):
-    from .models import DataFile, DataFileObject
-    dfs = DataFile.objects.raw('''
-        SELECT df.id
-        FROM tardis_portal_datafile AS df
-        LEFT JOIN tardis_portal_datafileobject AS dfo
-        ON dfo.datafile_id = df.id
-        WHERE dfo.id IS NULL
-    ''')
-    for df in dfs:
-        dfid = df.id
-        if DataFileObject.objects.filter(datafile_id=dfid).count() == 0:
-            DataFile.objects.get(id=dfid).delete()
+    '''
+    deletes DataFiles which have no DataFileObjects, CLEANUP_BATCH_SIZE at
+    a time
+    '''
+    from django.conf import settings
+    from .models import DataFile
+    batch_size = getattr(settings, 'CLEANUP_BATCH_SIZE', 1000)
+    orphans = DataFile.objects.filter(file_objects__isnull=True)
+    deleted = 0
+    last_id = 0
+    while True:
+        df_ids = list(orphans.filter(id__gt=last_id).order_by('id')
+                      .values_list('id', flat=True)[:batch_size])
+        if not df_ids:
+            break
+        last_id = df_ids[-1]
+        # the filter is applied again, in case DataFileObjects were added
+        _, counts = orphans.filter(id__in=df_ids).delete()
+        deleted += counts.get(DataFile._meta.label, 0)
+    logger.info('cleanup_dfs deleted %d DataFiles without DataFileObjects'
+                % deleted)
 
 
 @tardis_app.task(name="tardis_portal.cleanup_dfos", ignore_result=True)
 def cleanup_dfos(**kwargs):
-    import pytz
-    from datetime import datetime, timedelta
+    '''
+    deletes DataFileObjects which are still unverified a day after they were
+    created, and the DataFiles left without any DataFileObjects, in batches
+    of CLEANUP_BATCH_SIZE
+    '''
+    from datetime import timedelta
     from django.conf import settings
+    from django.utils import timezone
     from .models import DataFile, DataFileObject
-    tz = pytz.timezone(settings.TIME_ZONE)
-    wait_until = datetime.now(tz) - timedelta(hours=24)
-    dfos = DataFileObject.objects.filter(created_time__lte=wait_until,
+    from .models.datafile import delete_dfos_concurrently
+    batch_size = getattr(settings, 'CLEANUP_BATCH_SIZE', 1000)
+    wait_until = timezone.now() - timedelta(hours=24)
+    stale = DataFileObject.objects.filter(created_time__lte=wait_until,
                                          verified=False)
-    for dfo in dfos:
-        dfid = dfo.datafile_id
-        try:
-            dfo.delete()
-        except OSError:
-            # we can't delete file if it does not exist
-            dfo.uri = None
-            dfo.save(update_fields=['uri'])
-            dfo.delete()
-        finally:
-            if DataFileObject.objects.filter(datafile_id=dfid).count() == 0:
-                DataFile.objects.get(id=dfid).delete()
+    deleted_dfos = 0
+    deleted_dfs = 0
+    last_id = 0
+    while True:
+        dfos = list(stale.filter(id__gt=last_id).order_by('id')
+                    .select_related('storage_box')[:batch_size])
+        if not dfos:
+            break
+        last_id = dfos[-1].id
+        deleted = delete_dfos_concurrently(dfos)
+        deleted_dfos += len(deleted)
+        _, counts = DataFile.objects.filter(
+            id__in={dfo.datafile_id for dfo in deleted},
+            file_objects__isnull=True).delete()
+        deleted_dfs += counts.get(DataFile._meta.label, 0)
+    logger.info('cleanup_dfos deleted %d unverified DataFileObjects and %d '
+                'DataFiles' % (deleted_dfos, deleted_dfs))
 
 
 @tardis_app.task(name="tardis_portal.verify_dfos", ignore_result=True)
 def verify_dfos(**kwargs):
-    from .models import DataFileObject
-    dfos_to_verify = DataFileObject.objects.filter(verified=False)
-    kwargs['transaction_lock'] = kwargs.get('transaction_lock', True)
-    for dfo in dfos_to_verify:
-        kwargs['priority'] = dfo.priority
-        kwargs['shadow'] = 'dfo_verify location:%s' % dfo.storage_box.name
-        dfo_verify.apply_async(args=[dfo.id], **kwargs)
+    '''
+    queues verification of all unverified DataFileObjects
+
+    Each DataFileObject is leased for VERIFY_LEASE_DURATION seconds when it
+    is queued, and sweeps skip leased DataFileObjects, so running this again
+    while earlier tasks are still waiting doesn't queue them twice.
+    Verifying a DataFileObject releases its lease.
+    '''
+    from datetime import timedelta
+    from django.conf import settings
+    from django.utils import timezone
+    from .models import DataFileObject, StorageBox
+    batch_size = max(1, getattr(settings, 'VERIFY_BATCH_SIZE', 100))
+    page_size = getattr(settings, 'VERIFY_SWEEP_PAGE_SIZE', 1000)
+    lease_duration = timedelta(
+        seconds=getattr(settings, 'VERIFY_LEASE_DURATION', 6 * 3600))
+    transaction_lock = kwargs.pop('transaction_lock', True)
+    boxes = {}
+    last_id = 0
+    while True:
+        now = timezone.now()
+        unleased = Q(verify_lease_expiry__isnull=True) | \
+            Q(verify_lease_expiry__lte=now)
+        page = list(DataFileObject.objects
+                    .filter(unleased, verified=False, id__gt=last_id)
+                    .order_by('id')
+                    .values_list('id', flat=True)[:page_size])
+        if not page:
+            break
+        last_id = page[-1]
+        # only queue the DataFileObjects which this sweep managed to lease,
+        # in case another sweep is running at the same time
+        lease_expiry = now + lease_duration
+        DataFileObject.objects.filter(unleased, id__in=page, verified=False)\
+            .update(verify_lease_expiry=lease_expiry)
+        leased = DataFileObject.objects\
+            .filter(id__in=page, verify_lease_expiry=lease_expiry)\
+            .order_by('storage_box_id', 'id')\
+            .values_list('storage_box_id', 'id')
+        for sbox_id, group in groupby(leased, key=itemgetter(0)):
+            if sbox_id not in boxes:
+                boxes[sbox_id] = StorageBox.objects.get(id=sbox_id)
+            sbox = boxes[sbox_id]
+            kwargs['priority'] = sbox.priority
+            dfo_ids = [dfo_id for _, dfo_id in group]
+            if batch_size == 1:
+                kwargs['shadow'] = 'dfo_verify location:%s' % sbox.name
+                for dfo_id in dfo_ids:
+                    dfo_verify.apply_async(
+                        args=[dfo_id],
+                        kwargs={'transaction_lock': transaction_lock},
+                        **kwargs)
+                continue
+            kwargs['shadow'] = 'dfo_verify_batch location:%s' % sbox.name
+            for start in range(0, len(dfo_ids), batch_size):
+                dfo_verify_batch.apply_async(
+                    args=[sbox_id, dfo_ids[start:start + batch_size]],
+                    **kwargs)
+
+
+@tardis_app.task(name="tardis_portal.reverify_dfos", ignore_result=True)
+def reverify_dfos(**kwargs):
+    '''
+    queues fixity checks of the verified DataFileObjects in each online
+    storage box, starting with the ones which were verified longest ago
+
+    Each box gets one re-verification task at a time, reading at most
+    REVERIFY_PERIOD seconds' worth of its reverify_bytes_per_second budget.
+    Boxes whose previous task still holds leases are skipped.
+    '''
+    from datetime import timedelta
+    from django.conf import settings
+    from django.db.models import F
+    from django.utils import timezone
+    from .models import DataFileObject, StorageBox
+    period = getattr(settings, 'REVERIFY_PERIOD', 600)
+    interval = timedelta(
+        seconds=getattr(settings, 'REVERIFY_INTERVAL', 90 * 24 * 3600))
+    max_files = getattr(settings, 'REVERIFY_MAX_FILES', 10000)
+    lease_duration = timedelta(
+        seconds=getattr(settings, 'VERIFY_LEASE_DURATION', 6 * 3600))
+    now = timezone.now()
+    unleased = Q(verify_lease_expiry__isnull=True) | \
+        Q(verify_lease_expiry__lte=now)
+    for sbox in StorageBox.objects.all():
+        if sbox.storage_type in StorageBox.offline_types:
+            continue
+        box_dfos = DataFileObject.objects.filter(
+            storage_box=sbox, verified=True)
+        if box_dfos.filter(verify_lease_expiry__gt=now).exists():
+            continue
+        due = box_dfos.filter(Q(last_verified_time__isnull=True) |
+                              Q(last_verified_time__lte=now - interval))\
+            .order_by(F('last_verified_time').asc(nulls_first=True), 'id')\
+            .values_list('id', 'datafile__size')
+        budget = sbox.reverify_bytes_per_second * period
+        dfo_ids = []
+        for dfo_id, size in due[:max_files]:
+            dfo_ids.append(dfo_id)
+            budget -= size or 0
+            if budget <= 0:
+                break
+        if not dfo_ids:
+            continue
+        lease_expiry = now + lease_duration
+        box_dfos.filter(unleased, id__in=dfo_ids)\
+            .update(verify_lease_expiry=lease_expiry)
+        dfo_ids = list(
+            box_dfos.filter(id__in=dfo_ids, verify_lease_expiry=lease_expiry)
+            .values_list('id', flat=True))
+        if not dfo_ids:
+            continue
+        kwargs['priority'] = sbox.priority
+        kwargs['shadow'] = 'dfo_reverify_batch location:%s' % sbox.name
+        dfo_reverify_batch.apply_async(args=[sbox.id, dfo_ids], **kwargs)
 
 
 @tardis_app.task(name='tardis_portal.ingest_received_files', ignore_result=True)
@@ -114,6 +244,29 @@ def cache_done_notify(results, user_id, site_id, ct_id, obj_ids):
     return "all done"
 
 
+@tardis_app.task(name='tardis_portal.cache_archive', ignore_result=True)
+def cache_archive(cached_archive_id, comptype, organization):
+    """
+    Write an experiment or dataset archive to the archive cache storage
+    box, so that later downloads don't need to rebuild it.
+    """
+    from .download import build_cached_archive
+    build_cached_archive(cached_archive_id, comptype, organization)
+
+
+@tardis_app.task(name='tardis_portal.delete_cached_archives',
+                 ignore_result=True)
+def delete_cached_archives(cached_archive_ids):
+    """
+    Delete cached archives and their files from the archive cache storage
+    box, e.g. after one of their members changed.
+    """
+    from .models import CachedArchive
+    for cached_archive in CachedArchive.objects.filter(
+            id__in=cached_archive_ids).select_related('storage_box'):
+        cached_archive.delete()
+
+
 # "method tasks"
 # StorageBox
 @tardis_app.task(name="tardis_portal.storage_box.copy_files", ignore_result=True)
@@ -152,10 +305,13 @@ def sbox_cache_files(sbox_id):
     from .models import StorageBox
     sbox = StorageBox.objects.get(id=sbox_id)
     shadow = 'dfo_cache_file location:%s' % sbox.name
-    for dfo in DataFileObject.objects.filter(storage_box=sbox, verified=True):
-        if DataFileObject.objects.filter(datafile=dfo.datafile).count() == 1:
-            dfo_cache_file.apply_async(
-                args=[dfo.id], priority=sbox.priority, shadow=shadow)
+    dfo_ids = DataFileObject.objects.filter(
+        storage_box=sbox, verified=True).annotate(
+            copies=Count('datafile__file_objects')).filter(
+                copies=1).values_list('id', flat=True)
+    for dfo_id in dfo_ids.iterator():
+        dfo_cache_file.apply_async(
+            args=[dfo_id], priority=sbox.priority, shadow=shadow)
 
 
 @tardis_app.task(name='tardis_portal.storage_box.copy_to_master', ignore_result=True)
@@ -222,6 +378,64 @@ def dfo_verify(dfo_id, *args, **kwargs):
     return dfo.verify(*args, **kwargs)
 
 
+@tardis_app.task(name="tardis_portal.dfo.verify_batch", ignore_result=True)
+def dfo_verify_batch(sbox_id, dfo_ids, **kwargs):
+    '''
+    verifies a block of DataFileObjects from one storage box, hashing up to
+    the box's verify_concurrency files at once
+    '''
+    from .models import StorageBox
+    from .models.datafile import verify_dfos_concurrently
+    sbox = StorageBox.objects.get(id=sbox_id)
+    return verify_dfos_concurrently(
+        dfo_ids, max_workers=sbox.verify_concurrency)
+
+
+@tardis_app.task(name="tardis_portal.dfo.reverify_batch", ignore_result=True)
+def dfo_reverify_batch(sbox_id, dfo_ids, **kwargs):
+    '''
+    checks the fixity of verified DataFileObjects from one storage box,
+    within the box's re-verification budget
+    '''
+    import time
+    from .models import DataFileObject, StorageBox
+    from .models.datafile import verify_dfos_concurrently
+    sbox = StorageBox.objects.get(id=sbox_id)
+    start = time.monotonic()
+    try:
+        results = verify_dfos_concurrently(
+            dfo_ids, max_workers=sbox.reverify_concurrency, reverify=True,
+            bytes_per_second=sbox.reverify_bytes_per_second)
+    finally:
+        # release the leases of files which couldn't be checked
+        DataFileObject.objects.filter(id__in=dfo_ids)\
+            .update(verify_lease_expiry=None)
+    failed = sorted(dfo_id for dfo_id, result in results.items()
+                    if not result)
+    for dfo_id in failed:
+        logger.error('DataFileObject with id %d in storage box %s failed '
+                     'its fixity check' % (dfo_id, sbox.name))
+    logger.info('re-verified %d of %d files in storage box %s in %.0f '
+                'seconds, %d failed' % (
+                    len(results), len(dfo_ids), sbox.name,
+                    time.monotonic() - start, len(failed)))
+    return results
+
+
+@tardis_app.task(name='tardis_portal.sweep_experiment_access',
+                 ignore_result=True)
+def sweep_experiment_access(**kwargs):
+    '''
+    removes expired ExperimentAccess rows and repairs those of ACLs which
+    were changed without signals
+    '''
+    from .models import ExperimentAccess
+    removed, updated, added = ExperimentAccess.sweep()
+    if removed or updated or added:
+        logger.info('removed %d, updated %d and added %d experiment access '
+                    'rows' % (removed, updated, added))
+
+
 @tardis_app.task(name='tardis_portal.clear_sessions', ignore_result=True)
 def clear_sessions(**kwargs):
     """Clean up expired sessions using Django management command."""
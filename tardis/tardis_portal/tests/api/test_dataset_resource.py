@@ -85,6 +85,24 @@ class DatasetResourceTest(MyTardisResourceTestCase):
         self.assertEqual(returned_object['instrument']['id'],
                          self.extra_instrument.id)
 
+    def test_get_dataset_list(self):
+        # datasets in experiments which the user can't access aren't listed
+        other_ds = Dataset.objects.create(description="Other dataset")
+        other_ds.experiments.add(self.exp)
+        # and datasets in more than one accessible experiment are listed once
+        public_exp = Experiment.objects.create(
+            title='public exp', created_by=self.user,
+            public_access=Experiment.PUBLIC_ACCESS_FULL)
+        self.ds_no_instrument.experiments.add(public_exp)
+        output = self.api_client.get('/api/v1/dataset/',
+                                     authentication=self.get_credentials())
+        returned_data = json.loads(output.content.decode())
+        self.assertEqual(returned_data['meta']['total_count'], 3)
+        self.assertEqual(
+            {obj['id'] for obj in returned_data['objects']},
+            {self.ds_no_instrument.id, self.ds_with_instrument.id,
+             self.ds_with_instrument2.id})
+
     def test_post_dataset(self):
         exp_id = Experiment.objects.first().id
         post_data = {
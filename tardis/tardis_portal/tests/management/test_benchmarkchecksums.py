@@ -0,0 +1,21 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import SimpleTestCase
+
+
+class BenchmarkChecksumsTestCase(SimpleTestCase):
+
+    def testBenchmarkChecksums(self):
+        '''
+        Just test that we can run
+        ./manage.py benchmarkchecksums
+        and that both functions agree
+        '''
+        out = StringIO()
+        err = StringIO()
+        call_command('benchmarkchecksums', size=1, repeat=1,
+                     stdout=out, stderr=err)
+        self.assertIn('generic: ', out.getvalue())
+        self.assertIn('local: ', out.getvalue())
+        self.assertEqual(err.getvalue(), '')
@@ -0,0 +1,27 @@
+from io import StringIO
+
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.test import TestCase
+
+from ...models import Dataset, DataFile
+
+
+class FixityStatusTestCase(TestCase):
+
+    def testFixityStatus(self):
+        dataset = Dataset.objects.create(description='fixity')
+        datafile = DataFile(dataset=dataset, filename='checked.txt', size=4,
+                            md5sum='098f6bcd4621d373cade4e832627b4f6')
+        datafile.save()
+        datafile.file_object = ContentFile(b'test', 'checked.txt')
+        dfo = datafile.file_objects.get()
+        self.assertTrue(dfo.verified)
+
+        out = StringIO()
+        call_command('fixitystatus', stdout=out)
+        self.assertIn(
+            '%s: 1 files, 1 verified, 0 due for a fixity check, '
+            '0 being checked, 0 failed, oldest check %s' % (
+                dfo.storage_box.name, dfo.last_verified_time.isoformat()),
+            out.getvalue())
@@ -6,9 +6,17 @@ tests_datafileobject.py
 .. moduleauthor::  James Wettenhall <james.wettenhall@monash.edu>
 
 """
+import hashlib
+from unittest.mock import patch
+
 from django.conf import settings
+from django.core.files.base import ContentFile
 
+from tardis.tardis_portal import tasks
 from tardis.tardis_portal.models import Dataset, DataFile, DataFileObject
+from tardis.tardis_portal.models import datafile as datafile_module
+from tardis.tardis_portal.models.datafile import (
+    compute_checksums, compute_file_checksums)
 
 from . import ModelTestCase
 
@@ -37,3 +45,101 @@ class DataFileObjectTestCase(ModelTestCase):
         self.assertIsNotNone(dfo.id)
         dfo.delete()
         self.assertIsNone(dfo.id)
+
+    def test_verify_while_writing(self):
+        dataset = Dataset(description="dataset description")
+        dataset.save()
+        content = b'written once'
+        datafile = DataFile(dataset=dataset, filename='written.txt',
+                            size=len(content))
+        datafile.save(require_checksums=False)
+        with patch.object(tasks.dfo_verify, 'apply_async') as queue:
+            datafile.file_object = ContentFile(content, 'written.txt')
+        # the checksum was calculated while writing, without queueing a
+        # verification which would read the file back
+        dfo = datafile.file_objects.get()
+        self.assertTrue(dfo.verified)
+        self.assertIsNotNone(dfo.last_verified_time)
+        queue.assert_not_called()
+        datafile.refresh_from_db()
+        self.assertEqual(datafile.md5sum, hashlib.md5(content).hexdigest())
+
+        # a mismatch is left for dfo_verify to report
+        datafile = DataFile(dataset=dataset, filename='mismatch.txt',
+                            size=len(content),
+                            md5sum=hashlib.md5(b'something else').hexdigest())
+        datafile.save()
+        with patch.object(tasks.dfo_verify, 'apply_async') as queue:
+            datafile.file_object = ContentFile(content, 'mismatch.txt')
+        self.assertFalse(datafile.file_objects.get().verified)
+        queue.assert_called_once()
+
+    def test_local_checksums(self):
+        dataset = Dataset(description="dataset description")
+        dataset.save()
+        content = b'0123456789' * 1000
+        datafile = DataFile(dataset=dataset, filename='local.txt',
+                            size=len(content),
+                            md5sum=hashlib.md5(content).hexdigest())
+        datafile.save()
+        datafile.file_object = ContentFile(content, 'local.txt')
+        dfo = datafile.file_objects.get()
+
+        expected = {'md5sum': hashlib.md5(content).hexdigest(),
+                    'sha512sum': hashlib.sha512(content).hexdigest()}
+        self.assertEqual(
+            compute_file_checksums(dfo.get_full_path(), compute_sha512=True,
+                                   buffer_size=4096),
+            expected)
+        self.assertEqual(
+            compute_checksums(dfo.file_object, compute_sha512=True),
+            expected)
+        self.assertEqual(dfo.calculate_checksums(compute_sha512=True),
+                         expected)
+        self.assertTrue(dfo.verify())
+
+    @patch.object(datafile_module, '_magic', None)
+    @patch('magic.Magic')
+    def test_mimetype_detection(self, mock_magic):
+        """
+        The MIME type of a new file is detected once it is verified, from
+        the bytes which were hashed, with one libmagic handle
+        """
+        mock_magic.return_value.from_buffer.return_value = \
+            'text/plain; charset=us-ascii'
+        dataset = Dataset(description="dataset description")
+        dataset.save()
+        content = b'0123456789' * 1000
+        self.assertEqual(
+            compute_checksums(ContentFile(content), head_size=16)['head'],
+            content[:16])
+        for filename in ('first.dat', 'second.dat'):
+            datafile = DataFile(dataset=dataset, filename=filename,
+                                size=len(content),
+                                md5sum=hashlib.md5(content).hexdigest())
+            datafile.save()
+            self.assertEqual(datafile.mimetype, '')
+            with patch.object(DataFile, 'get_file') as get_file:
+                datafile.file_object = ContentFile(content, filename)
+            get_file.assert_not_called()
+            datafile = DataFile.objects.get(id=datafile.id)
+            self.assertEqual(datafile.mimetype, 'text/plain; charset=us-ascii')
+        mock_magic.assert_called_once_with(mime_and_encoding=True)
+        mock_magic.return_value.from_buffer.assert_called_with(
+            content[:datafile_module.MIMETYPE_DETECTION_BYTES])
+
+        dfo = datafile.file_objects.get()
+        self.assertEqual(
+            compute_file_checksums(dfo.get_full_path(), buffer_size=100,
+                                   head_size=1024)['head'],
+            content[:1024])
+
+        # saving a file doesn't guess its MIME type from the filename, so
+        # it is still detected from its bytes when it is verified again
+        datafile.mimetype = ''
+        datafile.save()
+        self.assertEqual(datafile.mimetype, '')
+        self.assertTrue(dfo.verify())
+        datafile.refresh_from_db()
+        self.assertEqual(datafile.mimetype, 'text/plain; charset=us-ascii')
+        self.assertEqual(mock_magic.return_value.from_buffer.call_count, 3)
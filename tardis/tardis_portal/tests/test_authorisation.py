@@ -1,7 +1,8 @@
 import json
 import logging
+from datetime import date, timedelta
 
-from unittest.mock import patch
+from unittest.mock import Mock, patch
 
 from django.test import TestCase
 from django.test.client import Client
@@ -10,7 +11,8 @@ from django.contrib.auth.models import User, Group, Permission, AnonymousUser
 
 from ..auth.localdb_auth import django_user
 from ..auth.localdb_auth import auth_key as localdb_auth_key
-from ..models import ObjectACL, Experiment
+from .. import tasks
+from ..models import ObjectACL, Experiment, ExperimentAccess
 
 logger = logging.getLogger(__name__)
 
@@ -611,6 +613,99 @@ class ObjectACLTestCase(TestCase):
         self.assertNotEqual(mock_webpack_get_bundle.call_count, 0)
 
 
+    def testPermissionCache(self):
+        user = User.objects.get(id=self.user2.id)
+        self.assertTrue(
+            user.has_perm('tardis_acls.view_experiment', self.experiment2))
+        # the user's ACLs are loaded once and reused
+        with self.assertNumQueries(0):
+            self.assertTrue(user.has_perm(
+                'tardis_acls.owns_experiment', self.experiment2))
+            self.assertTrue(user.has_perm(
+                'tardis_acls.delete_experiment', self.experiment2))
+            self.assertFalse(user.has_perm(
+                'tardis_acls.delete_experiment', self.experiment1))
+            self.assertFalse(user.has_perm(
+                'tardis_acls.view_experiment', self.experiment1))
+        # and reloaded when ACLs change
+        acl = ObjectACL(
+            pluginId=django_user,
+            entityId=str(user.id),
+            content_object=self.experiment1,
+            canRead=True,
+            aclOwnershipType=ObjectACL.OWNER_OWNED,
+            )
+        acl.save()
+        self.assertTrue(
+            user.has_perm('tardis_acls.view_experiment', self.experiment1))
+        acl.delete()
+        self.assertFalse(
+            user.has_perm('tardis_acls.view_experiment', self.experiment1))
+
+    def testExperimentAccess(self):
+        today = date.today()
+        self.assertEqual(
+            list(Experiment.safe.owned(self.user1)), [self.experiment1])
+        self.assertEqual(
+            list(Experiment.safe.owned_by_user_id(self.user2.id)),
+            [self.experiment2])
+
+        def days_later(days):
+            return patch(
+                'tardis.tardis_portal.models.access_control.datetime',
+                Mock(today=Mock(return_value=today + timedelta(days=days))))
+
+        # ACLs are only used once they are in effect
+        group = Group.objects.create(name='owners')
+        self.user2.groups.add(group)
+        acl = ObjectACL(
+            pluginId='django_group',
+            entityId=str(group.id),
+            content_object=self.experiment1,
+            isOwner=True,
+            effectiveDate=today + timedelta(days=1),
+            expiryDate=today + timedelta(days=1),
+            aclOwnershipType=ObjectACL.OWNER_OWNED,
+            )
+        acl.save()
+        self.assertTrue(ExperimentAccess.objects.filter(acl=acl).exists())
+        self.assertNotIn(self.experiment1, Experiment.safe.owned(self.user2))
+        with days_later(1):
+            self.assertEqual(
+                set(Experiment.safe.owned(self.user2)),
+                {self.experiment1, self.experiment2})
+
+        # and until they expire
+        with days_later(2):
+            self.assertNotIn(self.experiment1,
+                             Experiment.safe.owned(self.user2))
+            tasks.sweep_experiment_access.apply()
+        self.assertFalse(ExperimentAccess.objects.filter(acl=acl).exists())
+
+        # the sweep repairs the rows of ACLs changed without signals
+        ObjectACL.objects.filter(id=acl.id).update(
+            effectiveDate=None, expiryDate=None)
+        tasks.sweep_experiment_access.apply()
+        self.assertIn(self.experiment1, Experiment.safe.owned(self.user2))
+        ObjectACL.objects.filter(id=acl.id).update(
+            isOwner=False, canRead=True)
+        tasks.sweep_experiment_access.apply()
+        access = ExperimentAccess.objects.get(acl=acl)
+        self.assertFalse(access.isOwner)
+        self.assertTrue(access.canRead)
+        self.assertNotIn(self.experiment1, Experiment.safe.owned(self.user2))
+        ObjectACL.objects.filter(id=acl.id).update(
+            expiryDate=today - timedelta(days=1))
+        tasks.sweep_experiment_access.apply()
+        self.assertFalse(ExperimentAccess.objects.filter(acl=acl).exists())
+
+        # deleting an ACL deletes its access
+        ObjectACL.objects.filter(
+            pluginId=django_user, entityId=str(self.user2.id)).delete()
+        self.assertFalse(ExperimentAccess.objects.filter(
+            entity='%s:%s' % (django_user, self.user2.id)).exists())
+        self.assertFalse(Experiment.safe.owned(self.user2).exists())
+
     def testOwnedExperiments(self):
         user = AnonymousUser()
         # not logged in
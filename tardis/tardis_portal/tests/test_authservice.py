@@ -1,4 +1,6 @@
 # -*- coding: utf-8 -*-
+from unittest.mock import patch
+
 from django.test import TestCase
 from django.test.client import Client
 from django.test.utils import override_settings
@@ -56,6 +58,17 @@ class MockGroupProvider(GroupProvider):
             yield group
 
 
+class CountingGroupProvider(MockGroupProvider):
+
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+
+    def getGroups(self, user):
+        self.calls += 1
+        return super().getGroups(user)
+
+
 class MockRequest(HttpRequest):
 
     def setPost(self, field, value):
@@ -134,6 +147,52 @@ class AuthServiceTestCase(TestCase):
         self.assertTrue(b',1)' in r.content)
         self.assertTrue(b',3)' in r.content)
 
+    def testGroupsCache(self):
+        from django.contrib.auth.models import Group
+        from ..auth import AuthService
+        s = MockSettings()
+        s.GROUP_PROVIDERS = ('tardis.tardis_portal.tests.test_authservice.'
+                             'CountingGroupProvider',)
+        a = AuthService(settings=s)
+        a._manual_init()
+        provider = a._group_providers[0]
+        groups = [('mockdb', '2'), ('mockdb', '1')]
+        self.assertEqual(a.getGroups(self.user1), groups)
+        self.assertEqual(a.getGroups(self.user1), groups)
+        self.assertEqual(provider.calls, 1)
+        a.getGroups(self.user2)
+        self.assertEqual(provider.calls, 2)
+
+        # the cached groups are removed when the user logs in
+        c = Client()
+        self.assertTrue(c.login(username='mockdb_user1', password='secret'))
+        self.assertEqual(a.getGroups(self.user1), groups)
+        self.assertEqual(provider.calls, 3)
+
+        # or their Django groups change
+        group = Group.objects.create(name='Group 789')
+        group.user_set.add(self.user1)
+        a.getGroups(self.user1)
+        self.assertEqual(provider.calls, 4)
+        a.getGroups(self.user2)
+        self.assertEqual(provider.calls, 4)
+
+        # a lock left behind by a process which died is only waited on for
+        # GROUPS_LOCK_WAIT_SECONDS
+        from ..auth import authservice
+        cache = authservice.get_groups_cache()
+        authservice.invalidate_groups([self.user2.id])
+        version = authservice._get_groups_version(cache, self.user2.id, 300)
+        cache.set('ext_groups:%s:%s:%s:lock' % (
+            provider.name, self.user2.id, version), True)
+        with patch.object(authservice, 'GROUPS_LOCK_WAIT_SECONDS', 0):
+            a.getGroups(self.user2)
+        self.assertEqual(provider.calls, 5)
+
+        with self.settings(GROUPS_CACHE_SECONDS=0):
+            a.getGroups(self.user1)
+        self.assertEqual(provider.calls, 6)
+
     def testGroupSearch(self):
         from ..auth import AuthService
         s = MockSettings()
@@ -11,12 +11,14 @@ import hashlib
 import os
 import shutil
 import tempfile
+from unittest.mock import patch
 
 from django.test import TestCase
 
 from ..models.dataset import Dataset
 from ..models.datafile import DataFile, DataFileObject
 from ..models.storage import StorageBox, StorageBoxAttribute
+from ..models.transfer import StorageBoxTransfer
 
 
 class CopyMoveTestCase(TestCase):
@@ -103,6 +105,104 @@ class CopyMoveTestCase(TestCase):
         self.assertEqual(
             DataFileObject.objects.filter(datafile=self.datafile).count(), 1)
 
+    def test_move_unreadable_copy(self):
+        """
+        Test that a file isn't deleted when its copy doesn't read back
+        """
+        self.assertTrue(self.dfo.verify())
+        with patch.object(DataFileObject, 'verify', return_value=False):
+            copy = self.dfo.move_file(self.second_box)
+        self.assertTrue(copy)
+        self.assertTrue(os.path.exists(self.dfo.get_full_path()))
+        self.assertEqual(
+            DataFileObject.objects.filter(datafile=self.datafile).count(), 2)
+
+    def _create_second_file(self):
+        datafile = DataFile.objects.create(
+            dataset=self.dataset, filename="file2.txt", size=4,
+            md5sum=hashlib.md5(b'blah').hexdigest())
+        dfo = DataFileObject.objects.create(
+            datafile=datafile, storage_box=self.default_storage_box,
+            uri="test-dataset-%s/file2.txt" % self.dataset.id)
+        with open(dfo.get_full_path(), 'w') as file_obj:
+            file_obj.write(u'blah')
+        self.assertTrue(dfo.verify())
+        return dfo
+
+    def test_copy_files(self):
+        """
+        Test copying all of the files in a storage box, resuming from the
+        checkpoint of an interrupted copy
+        """
+        self.assertTrue(self.dfo.verify())
+        second_dfo = self._create_second_file()
+        interrupted = StorageBoxTransfer.objects.create(
+            source_box=self.default_storage_box, dest_box=self.second_box,
+            last_dfo_id=self.dfo.id)
+        self.default_storage_box.copy_files(self.second_box)
+        interrupted.refresh_from_db()
+        self.assertIsNotNone(interrupted.finished_time)
+        self.assertEqual(interrupted.files_copied, 1)
+        copies = DataFileObject.objects.filter(storage_box=self.second_box)
+        self.assertEqual(
+            [copy.datafile_id for copy in copies], [second_dfo.datafile_id])
+        self.assertTrue(copies[0].verified)
+        with open(copies[0].get_full_path()) as file_obj:
+            self.assertEqual(file_obj.read(), u'blah')
+
+        # A new transfer copies the rest and skips the existing copy
+        self.default_storage_box.copy_files(self.second_box)
+        transfer = StorageBoxTransfer.objects.latest('id')
+        self.assertEqual(transfer.files_copied, 1)
+        self.assertEqual(transfer.files_skipped, 1)
+        self.assertEqual(
+            DataFileObject.objects.filter(
+                storage_box=self.second_box, verified=True).count(), 2)
+        self.assertEqual(
+            DataFileObject.objects.filter(
+                storage_box=self.default_storage_box).count(), 2)
+
+    def test_move_files(self):
+        """
+        Test moving all of the files in a storage box
+        """
+        self.assertTrue(self.dfo.verify())
+        self._create_second_file()
+        self.default_storage_box.move_files(self.second_box)
+        transfer = StorageBoxTransfer.objects.get()
+        self.assertTrue(transfer.move)
+        self.assertEqual(transfer.files_copied, 2)
+        self.assertEqual(transfer.files_deleted, 2)
+        self.assertFalse(DataFileObject.objects.filter(
+            storage_box=self.default_storage_box).exists())
+        self.assertEqual(
+            DataFileObject.objects.filter(
+                storage_box=self.second_box, verified=True).count(), 2)
+
+    def test_move_files_unreadable_copies(self):
+        """
+        Test that moving files keeps those whose copies don't read back
+        """
+        self.assertTrue(self.dfo.verify())
+        self._create_second_file()
+        check_file = DataFileObject.check_file
+
+        def unreadable(dfo, *args, **kwargs):
+            # hashing the bytes written succeeds, reading them back fails
+            if kwargs.get('written') is None:
+                return False, {}
+            return check_file(dfo, *args, **kwargs)
+
+        with patch.object(DataFileObject, 'check_file', autospec=True,
+                          side_effect=unreadable):
+            self.default_storage_box.move_files(self.second_box)
+        transfer = StorageBoxTransfer.objects.get()
+        self.assertEqual(transfer.files_failed, 2)
+        self.assertEqual(transfer.files_deleted, 0)
+        self.assertEqual(
+            DataFileObject.objects.filter(
+                storage_box=self.default_storage_box).count(), 2)
+
     def test_cache(self):
         """
         Test caching a file from a slow-access storage box
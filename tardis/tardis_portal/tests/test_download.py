@@ -12,14 +12,21 @@ from tarfile import is_tarfile, TarFile
 from tempfile import NamedTemporaryFile
 from urllib.parse import quote
 
+from unittest import skipIf
 from unittest.mock import patch
 
-from django.test import TestCase
+from django.test import RequestFactory, TestCase, override_settings
 from django.test.client import Client
 
 from django.conf import settings
-from django.contrib.auth.models import User
-
+from django.contrib.auth.models import AnonymousUser, User
+
+from tardis.analytics.metrics import metrics_view, prometheus_client
+from ..auth.decorators import get_downloadable_datafiles
+from ..auth.decorators import has_datafile_download_access
+from ..auth.localdb_auth import django_user
+from ..download import download_datafile
+from ..models.access_control import ObjectACL
 from ..models.experiment import Experiment
 from ..models.dataset import Dataset
 from ..models.datafile import DataFile, DataFileObject
@@ -354,6 +361,159 @@ class DownloadTestCase(TestCase):
                     for ds in self.experiment2.datasets.all()]),
             simpleNames=True, noTxt=True)
 
+    def testDownloadRange(self):
+        client = Client()
+        url = '/download/datafile/%i/' % self.datafile1.id
+        etag = '"sha512-%s"' % self.datafile1.sha512sum
+
+        response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(int(response['Content-Length']), 13)
+
+        response = client.get(url, HTTP_RANGE='bytes=6-10')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 6-10/13')
+        self.assertEqual(b"".join(response.streaming_content), b'World')
+
+        # resume from an offset
+        response = client.get(url, HTTP_RANGE='bytes=6-', HTTP_IF_RANGE=etag)
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b"".join(response.streaming_content), b'World!\n')
+
+        # suffix range
+        response = client.get(url, HTTP_RANGE='bytes=-2')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b"".join(response.streaming_content), b'!\n')
+
+        # stale validator means the whole file is sent
+        response = client.get(url, HTTP_RANGE='bytes=6-',
+                              HTTP_IF_RANGE='"sha512-stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content),
+                         b'Hello World!\n')
+
+        response = client.get(url, HTTP_RANGE='bytes=13-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */13')
+
+    @patch('webpack_loader.loader.WebpackLoader.get_bundle')
+    def testDownloadOffload(self, mock_webpack_get_bundle):
+        client = Client()
+        url = '/download/datafile/%i/' % self.datafile1.id
+        dfo = self.datafile1.file_objects.get()
+        dfo.verify()
+
+        with override_settings(DOWNLOAD_OFFLOAD_HEADER='X-Sendfile'):
+            response = client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['X-Sendfile'], dfo.get_full_path())
+            self.assertEqual(response.content, b'')
+            self.assertIn('filename="testfile.txt"',
+                          response['Content-Disposition'])
+
+        # nginx needs an internal location for the storage box
+        with override_settings(DOWNLOAD_OFFLOAD_HEADER='X-Accel-Redirect'):
+            response = client.get(url)
+            self.assertFalse(response.has_header('X-Accel-Redirect'))
+            self.assertEqual(b"".join(response.streaming_content),
+                             b'Hello World!\n')
+        with override_settings(
+                DOWNLOAD_OFFLOAD_HEADER='X-Accel-Redirect',
+                DOWNLOAD_OFFLOAD_LOCATIONS={
+                    dfo.storage_box.name: '/protected/store/'}):
+            response = client.get(url)
+            self.assertEqual(response['X-Accel-Redirect'],
+                             '/protected/store/%s' % quote(dfo.uri))
+
+        # the offload header is only sent to users allowed to download
+        with override_settings(DOWNLOAD_OFFLOAD_HEADER='X-Sendfile'):
+            response = client.get(
+                '/download/datafile/%i/' % self.datafile2.id)
+            self.assertEqual(response.status_code, 403)
+            self.assertFalse(response.has_header('X-Sendfile'))
+
+    def testDownloadableDatafiles(self):
+        request = RequestFactory().get('/')
+        datafiles = DataFile.objects.filter(
+            id__in=[self.datafile1.id, self.datafile2.id])
+
+        def check_downloadable(expected):
+            for datafile in datafiles:
+                self.assertEqual(
+                    has_datafile_download_access(request, datafile.id),
+                    datafile in expected)
+            with self.assertNumQueries(1):
+                downloadable = list(
+                    get_downloadable_datafiles(request, datafiles))
+            self.assertEqual(sorted(df.id for df in downloadable),
+                             sorted(df.id for df in expected))
+
+        # only the public experiment's files can be downloaded anonymously
+        request.user = AnonymousUser()
+        check_downloadable([self.datafile1])
+
+        ObjectACL(pluginId=django_user,
+                  entityId=str(self.user.id),
+                  content_object=self.experiment2,
+                  canRead=True,
+                  isOwner=True,
+                  aclOwnershipType=ObjectACL.OWNER_OWNED).save()
+        request.user = self.user
+        check_downloadable([self.datafile1, self.datafile2])
+
+        # metadata only public access doesn't allow downloads
+        self.experiment1.public_access = Experiment.PUBLIC_ACCESS_METADATA
+        self.experiment1.save()
+        check_downloadable([self.datafile2])
+
+    @skipIf(prometheus_client is None, 'prometheus_client is not installed')
+    @override_settings(METRICS_ENABLED=True,
+                       METRICS_ALLOWED_IPS=['127.0.0.0/8'])
+    def testDownloadMetrics(self):
+        box_name = self.datafile1.get_preferred_dfo().storage_box.name
+        request = RequestFactory().get('/')
+        request.user = AnonymousUser()
+        self.assertEqual(metrics_view(request).status_code, 200)
+
+        # other clients need the bearer token
+        scraper = RequestFactory().get('/', REMOTE_ADDR='10.1.2.3')
+        self.assertEqual(metrics_view(scraper).status_code, 403)
+        with override_settings(METRICS_BEARER_TOKEN='secret'):
+            self.assertEqual(metrics_view(scraper).status_code, 403)
+            scraper.META['HTTP_AUTHORIZATION'] = 'Bearer secret'
+            self.assertEqual(metrics_view(scraper).status_code, 200)
+
+        def sample(name, labels):
+            return prometheus_client.REGISTRY.get_sample_value(
+                name, labels) or 0
+
+        downloads = sample('mytardis_downloads_total',
+                           {'label': 'file', 'status': 'complete'})
+        sent = sample('mytardis_download_bytes_total', {'label': 'file'})
+        reads = sample('mytardis_storage_box_read_seconds_count',
+                       {'storage_box': box_name})
+
+        response = download_datafile(request, datafile_id=self.datafile1.id)
+        self.assertEqual(b"".join(response.streaming_content),
+                         b'Hello World!\n')
+        response.close()
+
+        self.assertEqual(sample('mytardis_downloads_total',
+                                {'label': 'file', 'status': 'complete'}),
+                         downloads + 1)
+        self.assertEqual(sample('mytardis_download_bytes_total',
+                                {'label': 'file'}), sent + 13)
+        self.assertGreater(sample('mytardis_storage_box_read_seconds_count',
+                                  {'storage_box': box_name}), reads)
+        content = metrics_view(request).content.decode()
+        self.assertIn('mytardis_download_time_to_first_byte_seconds_bucket',
+                      content)
+
+        with override_settings(METRICS_ENABLED=False):
+            self.assertEqual(metrics_view(request).status_code, 404)
+
     def testDatasetFile(self):
         # check registered text file for physical file meta information
         df = DataFile.objects.get(pk=self.datafile1.id)  # skipping test # noqa # pylint: disable=W0101
@@ -166,3 +166,25 @@ class LDAPTest(TestCase):
                          [{'id': 'full',
                            'members': ['testuser1', 'testuser2', 'testuser3'],
                            'display': 'Full Group'}])
+
+    def test_connection_pool(self):
+        from ..auth.ldap_auth import ldap_auth
+        l = ldap_auth(force_create=True)
+        l.getGroupById('full')
+        self.assertEqual(len(l._pool._idle), 1)
+        conn = l._pool._idle[0][0]
+
+        # the connection is reused
+        self.assertEqual(list(l.getGroupsForEntity('testuser1')),
+                         [{'id': 'full', 'display': 'Full Group'},
+                          {'id': 'systems', 'display': 'Systems Services'}])
+        self.assertEqual(len(l._pool._idle), 1)
+        self.assertIs(l._pool._idle[0][0], conn)
+
+        # and replaced if it fails its check
+        with self.settings(LDAP_POOL_CHECK_SECONDS=-1):
+            conn.unbind_s()
+            self.assertEqual(l.getGroupById('full'),
+                             {'id': 'full', 'display': 'Full Group'})
+        self.assertEqual(len(l._pool._idle), 1)
+        self.assertIsNot(l._pool._idle[0][0], conn)
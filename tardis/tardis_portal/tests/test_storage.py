@@ -5,11 +5,14 @@ http://docs.djangoproject.com/en/dev/topics/testing/
 .. moduleauthor::  Grischa Meyer <grischa@gmail.com>
 
 """
-from django.test import TestCase
+from unittest.mock import patch
 
-from ..models import StorageBox, StorageBoxOption
+from django.test import TestCase, override_settings
+
+from ..models import StorageBox, StorageBoxOption, StorageBoxAttribute
 from ..models import Dataset
-from ..models import DataFile
+from ..models import DataFile, DataFileObject
+from ..storage import placement
 
 
 class ModelTestCase(TestCase):
@@ -54,3 +57,73 @@ class ModelTestCase(TestCase):
 
     def tearDown(self):
         self.test_box.delete()
+
+
+class PlacementTestCase(TestCase):
+
+    def setUp(self):
+        placement._stats.clear()
+        self.boxes = []
+        for name in ('first', 'second'):
+            box = StorageBox.objects.create(name=name, max_size=1000)
+            StorageBoxAttribute.objects.create(
+                storage_box=box, key='default', value='True')
+            self.boxes.append(box)
+        dataset = Dataset.objects.create(description="dataset description")
+        self.datafile = DataFile.objects.create(
+            dataset=dataset, filename='file.txt', size=600, md5sum='bogus')
+
+    def tearDown(self):
+        placement._stats.clear()
+
+    def place(self, size):
+        box = StorageBox.get_default_storage(size=size)
+        # writes which take no time, so that the boxes are equally loaded
+        with patch.object(placement.time, 'monotonic', return_value=0.0):
+            with placement.tracking_write(box, size):
+                pass
+        return box.name
+
+    def test_spread_writes(self):
+        # choosing a box doesn't count a file as placed in it, e.g. when
+        # the file is written to the receiving box instead
+        self.assertEqual(
+            StorageBox.get_default_storage(size=100).name, 'first')
+        self.assertEqual(
+            StorageBox.get_default_storage(size=100).name, 'first')
+        chosen = [self.place(100) for _ in range(4)]
+        self.assertEqual(chosen, ['first', 'second', 'first', 'second'])
+        with override_settings(STORAGE_PLACEMENT_POLICY=(
+                'tardis.tardis_portal.storage.placement.FirstBoxPolicy')):
+            self.assertEqual(
+                StorageBox.get_default_storage(size=100).name, 'first')
+
+    def test_free_space(self):
+        DataFileObject.objects.create(
+            datafile=self.datafile, storage_box=self.boxes[1], uri='a')
+        self.assertEqual(self.place(500), 'first')
+        self.assertEqual(self.place(450), 'first')
+        # neither box has room for 500 more bytes, so the one with the most
+        # free space is chosen
+        self.assertEqual(self.place(500), 'second')
+
+    def test_load(self):
+        with placement.tracking_write(self.boxes[0]):
+            self.assertEqual(StorageBox.get_default_storage().name, 'second')
+        stats = placement.get_box_stats(self.boxes)
+        self.assertEqual(stats[self.boxes[0].id].writes, 0)
+        self.assertIsNotNone(stats[self.boxes[0].id].latency)
+        with placement.tracking_write(self.boxes[1]):
+            with placement.tracking_write(self.boxes[1]):
+                self.assertEqual(
+                    StorageBox.get_default_storage().name, 'first')
+
+    def test_cache_box(self):
+        for box in self.boxes:
+            StorageBoxAttribute.objects.create(
+                storage_box=box, key='type', value='cache')
+            box.master_box = self.datafile.get_receiving_storage_box()
+            box.save()
+        master_box = self.boxes[0].master_box
+        with placement.tracking_write(self.boxes[0]):
+            self.assertEqual(master_box.cache_box, self.boxes[1])
@@ -1,17 +1,28 @@
+import gzip
 import hashlib
 import os
 
 from tarfile import TarFile
-from tempfile import NamedTemporaryFile
+from shutil import rmtree
+from tempfile import NamedTemporaryFile, mkdtemp
 
 from io import BytesIO
+from unittest import skipIf
 from urllib.parse import quote
 
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.urls import reverse
-from django.test import Client, TestCase
+from django.test import Client, RequestFactory, TestCase
+from django.test import override_settings
 
+from ..download import StreamingTarStream, UncachedTarStream
+from ..download import _get_datafile_details_for_archive, classic_mapper
+from ..download import make_mapper, zstandard
+from ..download import get_archive_contents, get_cached_archive_response
+from ..download import evict_cached_archives, make_tar_stream
+from ..models import CachedArchive, StorageBox, StorageBoxOption
+from ..models.datafile import DataFile
 from ..models.experiment import Experiment
 
 
@@ -91,3 +102,224 @@ class TarDownloadTestCase(TestCase):
                     self.assertEqual(
                         os.stat(os.path.join('/tmp', full_path)).st_size,
                         int(df.size))
+
+    def test_tar_stream_prefetch(self):
+        files = _get_datafile_details_for_archive(
+            classic_mapper('prefetch'), self.dfs)
+
+        def make_tar(**kwargs):
+            tfs = UncachedTarStream(files, filename='prefetch.tar',
+                                    buffersize=1024, **kwargs)
+            return b''.join(tfs.make_tar())
+
+        sequential = make_tar(prefetch_depth=0)
+        self.assertEqual(
+            sequential, make_tar(prefetch_depth=4))
+        # a budget smaller than one read buffer still makes progress
+        self.assertEqual(
+            sequential, make_tar(prefetch_depth=4, prefetch_buffer_size=1))
+        tf = TarFile(fileobj=BytesIO(sequential))
+        self.assertEqual(len(tf.getmembers()), len(self.dfs))
+
+    def test_tar_stream_compression(self):
+        files = _get_datafile_details_for_archive(
+            classic_mapper('compression'), self.dfs)
+
+        def make_tar(**kwargs):
+            tfs = UncachedTarStream(files, filename='compression.tar',
+                                    compression_block_size=4096, **kwargs)
+            return b''.join(tfs.make_tar())
+
+        uncompressed = make_tar()
+        # blocks compressed in the request thread and in the worker pool
+        # give the same series of gzip members
+        sequential = make_tar(compression='gzip', compression_workers=0)
+        self.assertEqual(sequential,
+                         make_tar(compression='gzip', compression_workers=4))
+        self.assertEqual(gzip.decompress(sequential), uncompressed)
+        tf = TarFile.open(fileobj=BytesIO(sequential), mode='r:gz')
+        self.assertEqual(len(tf.getmembers()), len(self.dfs))
+
+    @skipIf(zstandard is None, 'zstandard is not installed')
+    def test_tar_stream_zstd(self):
+        files = _get_datafile_details_for_archive(
+            classic_mapper('zstd'), self.dfs)
+        uncompressed = b''.join(UncachedTarStream(
+            files, filename='zstd.tar').make_tar())
+        tfs = UncachedTarStream(files, filename='zstd.tar',
+                                compression='zstd', compression_workers=2)
+        response = tfs.get_response()
+        self.assertEqual(response['Content-Type'], 'application/zstd')
+        self.assertIn('zstd.tar.zst', response['Content-Disposition'])
+        compressed = b''.join(response.streaming_content)
+        self.assertEqual(
+            zstandard.ZstdDecompressor().decompressobj().decompress(
+                compressed), uncompressed)
+
+    def test_tar_stream_ranges(self):
+        files = _get_datafile_details_for_archive(
+            classic_mapper('ranges'), self.dfs)
+        tfs = UncachedTarStream(files, filename='ranges.tar',
+                                buffersize=1024, prefetch_depth=0)
+        archive = b''.join(tfs.make_tar())
+        self.assertEqual(len(archive), tfs.tar_size)
+        self.assertTrue(tfs.seekable)
+        header_size = len(tfs.tarinfo_bufs[0])
+        member_offset = tfs.member_offsets[3]
+        positions = [
+            (0, tfs.tar_size - 1),
+            (5, 100),
+            (member_offset, member_offset),
+            # inside a member's data, spanning into the next member
+            (member_offset + header_size + 700, tfs.member_offsets[5] + 3),
+            # inside a member's padding
+            (tfs.member_offsets[4] - 2, tfs.member_offsets[4] + 10),
+            # inside the zero blocks at the end of the archive
+            (tfs.member_offsets[-1] + 1, tfs.tar_size - 1),
+        ]
+        for prefetch_depth in (0, 2):
+            for start, end in positions:
+                tfs = UncachedTarStream(files, filename='ranges.tar',
+                                        buffersize=1024,
+                                        prefetch_depth=prefetch_depth)
+                self.assertEqual(
+                    b''.join(tfs.make_tar_range(start, end)),
+                    archive[start:end + 1])
+
+    def test_tar_experiment_download_range(self):
+        url = reverse(
+            'tardis.tardis_portal.download.streaming_download_experiment',
+            args=(self.exp.id, 'tar'))
+        response = self.client.get(url)
+        archive = b''.join(response.streaming_content)
+        etag = response['ETag']
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+
+        response = self.client.get(url, HTTP_RANGE='bytes=1000-',
+                                   HTTP_IF_RANGE=etag)
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'],
+                         'bytes 1000-%d/%d' % (len(archive) - 1,
+                                               len(archive)))
+        self.assertEqual(b''.join(response.streaming_content),
+                         archive[1000:])
+
+        response = self.client.get(url, HTTP_RANGE='bytes=%d-' % len(archive))
+        self.assertEqual(response.status_code, 416)
+
+    def test_streaming_tar_stream(self):
+        datafiles = DataFile.objects.filter(dataset=self.ds)
+        for rootdir in ('short', 'long' * 40):
+            for prefetch_depth in (0, 2):
+                tfs = StreamingTarStream(
+                    datafiles, classic_mapper(rootdir),
+                    filename='streaming.tar', chunk_size=7,
+                    prefetch_depth=prefetch_depth)
+                self.assertEqual(tfs.num_files, len(self.dfs))
+                archive = b''.join(tfs.make_tar())
+                self.assertEqual(len(archive), tfs.tar_size)
+                self.assertFalse(tfs.seekable)
+                tf = TarFile(fileobj=BytesIO(archive))
+                for df in self.dfs:
+                    member = tf.extractfile(
+                        os.path.join(rootdir, str(self.ds.id), df.filename))
+                    self.assertEqual(len(member.read()), int(df.size))
+
+    def test_streaming_tar_stream_changes(self):
+        datafiles = DataFile.objects.filter(dataset=self.ds)
+        tfs = StreamingTarStream(
+            datafiles, classic_mapper('root'),
+            filename='streaming.tar', chunk_size=7, prefetch_depth=0)
+        # files added, deleted or changed after the archive size was
+        # computed don't change the archive's length
+        added = self.ds.datafile_set.create(
+            filename='added.txt', size=3, md5sum=self.dfs[0].md5sum)
+        added.file_object = BytesIO(b'new')
+        self.dfs[0].delete()
+        DataFile.objects.filter(id=self.dfs[1].id).update(size=10 ** 6)
+        archive = b''.join(tfs.make_tar())
+        self.assertEqual(len(archive), tfs.tar_size)
+        tf = TarFile(fileobj=BytesIO(archive))
+        names = [os.path.basename(name) for name in tf.getnames()]
+        self.assertEqual(sorted(names),
+                         sorted(df.filename for df in self.dfs[1:]))
+        member = tf.extractfile(tf.getmembers()[0])
+        self.assertEqual(len(member.read()), int(self.dfs[1].size))
+
+    def test_archive_details_queries(self):
+        # the number of queries doesn't depend on the number of files:
+        # datafiles, datasets, first experiments, datafile objects, and
+        # the storage box's options and type
+        mapper = make_mapper('deep-storage', 'root')
+        with self.assertNumQueries(6):
+            files = _get_datafile_details_for_archive(
+                mapper, DataFile.objects.filter(dataset=self.ds))
+            tfs = UncachedTarStream(files, filename='queries.tar',
+                                    prefetch_depth=0)
+            archive = b''.join(tfs.make_tar())
+        self.assertEqual(len(archive), tfs.tar_size)
+        self.assertEqual(
+            files[0][1],
+            os.path.join('root',
+                         quote(self.ds.description,
+                               safe=settings.SAFE_FILESYSTEM_CHARACTERS),
+                         files[0][0].directory, files[0][0].filename))
+
+    def test_archive_cache(self):
+        location = mkdtemp()
+        self.addCleanup(rmtree, location)
+        box = StorageBox.objects.create(name='archive cache',
+                                        max_size=10 * 1024 * 1024)
+        StorageBoxOption.objects.create(storage_box=box, key='location',
+                                        value=location)
+        datafiles, rootdir, filename = get_archive_contents(self.exp)
+        request = RequestFactory().get('/')
+
+        def get_response():
+            tfs, _ = make_tar_stream(
+                datafiles, make_mapper('classic', rootdir), filename,
+                'gzip')
+            return tfs, get_cached_archive_response(
+                request, self.exp, tfs, 'tgz', 'classic', None)
+
+        with override_settings(ARCHIVE_CACHE_STORAGE_BOX='archive cache'):
+            # the first download queues the archive to be cached
+            tfs, response = get_response()
+            self.assertIsNone(response)
+            cached_archive = CachedArchive.objects.get()
+            self.assertTrue(cached_archive.complete)
+            tfs, response = get_response()
+            self.assertEqual(response['Content-Type'], 'application/x-gzip')
+            self.assertEqual(int(response['Content-Length']),
+                             cached_archive.size)
+            # counted as an archive download
+            self.assertEqual(response._iterator.label, 'tar')
+            content = b''.join(response.streaming_content)
+            self.assertEqual(
+                gzip.decompress(content),
+                b''.join(UncachedTarStream(
+                    _get_datafile_details_for_archive(
+                        make_mapper('classic', rootdir), datafiles),
+                    filename=filename).make_tar()))
+
+            # least recently used archives are evicted
+            stale_archive = CachedArchive.objects.create(
+                key='stale', storage_box=box, experiment=self.exp,
+                uri='archives/stale.tar.gz', size=1, complete=True,
+                last_accessed=cached_archive.created_time)
+            box.max_size = cached_archive.size
+            box.save()
+            evict_cached_archives(box)
+            self.assertFalse(CachedArchive.objects.filter(
+                id=stale_archive.id).exists())
+            self.assertTrue(CachedArchive.objects.filter(
+                id=cached_archive.id).exists())
+
+            # but not when only a member DataFile's metadata changes
+            self.dfs[0].mimetype = 'text/plain'
+            self.dfs[0].save(update_fields=['mimetype'])
+            self.assertTrue(CachedArchive.objects.exists())
+
+            # changing a member DataFile invalidates its archives
+            self.dfs[0].save()
+            self.assertFalse(CachedArchive.objects.exists())
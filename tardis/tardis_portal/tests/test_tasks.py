@@ -1,12 +1,20 @@
 import hashlib
+import os
+from datetime import timedelta
 from os import urandom
+from unittest.mock import patch
 
 from django.core.files.base import ContentFile
 from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils import timezone
 
-from ..models import Experiment, Dataset, DataFile, User
+from ..models import (Experiment, Dataset, DataFile, DataFileObject,
+                      StorageBoxAttribute, User)
 
-from ..tasks import verify_dfos
+from ..tasks import (cleanup_dfos, cleanup_dfs, dfo_reverify_batch,
+                     dfo_verify_batch, reverify_dfos, verify_dfos)
+from .. import tasks
 
 
 class BackgroundTaskTestCase(TestCase):
@@ -15,6 +23,10 @@ class BackgroundTaskTestCase(TestCase):
     def setUp(self):
         self.dataset = self._create_dataset()
 
+    def tearDown(self):
+        # deleting the DataFileObjects deletes the files the tests wrote
+        self.dataset.delete()
+
     def _create_dataset(self):
         user = User.objects.create_user('testuser', 'user@email.test', 'pwd')
         user.save()
@@ -66,3 +78,134 @@ class BackgroundTaskTestCase(TestCase):
         # verify explicitly to catch Exceptions hidden by celery
         datafile.verify()
         self.assertFalse(datafile.file_objects.get().verified)
+
+    def test_batch_verification(self):
+        dfos = []
+        for i in range(5):
+            content = urandom(1024)
+            cf = ContentFile(content, 'batch_testfile_%d' % i)
+            datafile = DataFile(dataset=self.dataset)
+            datafile.filename = cf.name
+            datafile.size = len(content)
+            datafile.md5sum = hashlib.md5(
+                content if i else b'corrupted').hexdigest()
+            datafile.save()
+            datafile.file_object = cf
+            dfo = datafile.file_objects.get()
+            dfo.verified = False
+            dfo.save(update_fields=['verified'])
+            dfos.append(dfo)
+
+        results = dfo_verify_batch(dfos[0].storage_box.id,
+                                   [dfo.id for dfo in dfos])
+        self.assertEqual(results, {dfo.id: i > 0
+                                   for i, dfo in enumerate(dfos)})
+        for i, dfo in enumerate(dfos):
+            dfo.refresh_from_db()
+            self.assertEqual(dfo.verified, i > 0)
+            self.assertIsNotNone(dfo.last_verified_time)
+
+    def test_verification_lease(self):
+        content = urandom(1024)
+        cf = ContentFile(content, 'lease_testfile')
+        datafile = DataFile(dataset=self.dataset)
+        datafile.filename = cf.name
+        datafile.size = len(content)
+        datafile.md5sum = hashlib.md5(content).hexdigest()
+        datafile.save()
+        datafile.file_object = cf
+        dfo = datafile.file_objects.get()
+        dfo.verified = False
+        dfo.save(update_fields=['verified'])
+
+        with patch.object(tasks.dfo_verify_batch, 'apply_async') as queue:
+            verify_dfos()
+            verify_dfos()
+        # the second sweep skips the leased DataFileObject
+        queue.assert_called_once()
+        self.assertEqual(queue.call_args[1]['args'],
+                         [dfo.storage_box.id, [dfo.id]])
+        dfo.refresh_from_db()
+        self.assertIsNotNone(dfo.verify_lease_expiry)
+
+        # verifying it releases the lease
+        dfo_verify_batch(*queue.call_args[1]['args'])
+        dfo.refresh_from_db()
+        self.assertTrue(dfo.verified)
+        self.assertIsNone(dfo.verify_lease_expiry)
+
+    @override_settings(REVERIFY_PERIOD=1)
+    def test_reverification(self):
+        dfos = []
+        for i in range(3):
+            content = urandom(1024)
+            cf = ContentFile(content, 'fixity_testfile_%d' % i)
+            datafile = DataFile(dataset=self.dataset)
+            datafile.filename = cf.name
+            datafile.size = len(content)
+            datafile.md5sum = hashlib.md5(content).hexdigest()
+            datafile.save()
+            datafile.file_object = cf
+            dfo = datafile.file_objects.get()
+            dfo.last_verified_time = timezone.now() - timedelta(days=100 - i)
+            dfo.save(update_fields=['last_verified_time'])
+            dfos.append(dfo)
+        sbox = dfos[0].storage_box
+        # a budget of two files per sweep
+        StorageBoxAttribute.objects.create(
+            storage_box=sbox, key='reverify_bytes_per_second', value='2048')
+
+        with patch.object(tasks.dfo_reverify_batch, 'apply_async') as queue:
+            reverify_dfos()
+            reverify_dfos()
+        # the files verified longest ago are checked first, and the second
+        # sweep waits for the first one to finish
+        queue.assert_called_once()
+        self.assertEqual(queue.call_args[1]['args'],
+                         [sbox.id, [dfos[0].id, dfos[1].id]])
+
+        # bit rot
+        DataFile.objects.filter(id=dfos[1].datafile.id).update(
+            md5sum=hashlib.md5(b'something else').hexdigest())
+        results = dfo_reverify_batch(*queue.call_args[1]['args'])
+        self.assertEqual(results, {dfos[0].id: True, dfos[1].id: False})
+        for dfo in dfos:
+            dfo.refresh_from_db()
+            self.assertIsNone(dfo.verify_lease_expiry)
+        self.assertTrue(dfos[0].verified)
+        self.assertGreater(dfos[0].last_verified_time,
+                           timezone.now() - timedelta(minutes=1))
+        self.assertFalse(dfos[1].verified)
+
+    def test_cleanup(self):
+        datafiles = []
+        for i in range(3):
+            content = urandom(1024)
+            cf = ContentFile(content, 'cleanup_testfile_%d' % i)
+            datafile = DataFile(dataset=self.dataset)
+            datafile.filename = cf.name
+            datafile.size = len(content)
+            datafile.md5sum = hashlib.md5(content).hexdigest()
+            datafile.save()
+            datafile.file_object = cf
+            datafiles.append(datafile)
+        stale = datafiles[0].file_objects.get()
+        file_path = stale.get_full_path()
+        DataFileObject.objects.filter(id=stale.id).update(
+            verified=False,
+            created_time=timezone.now() - timedelta(days=2))
+        # unverified, but recent
+        DataFileObject.objects.filter(datafile=datafiles[1]).update(
+            verified=False)
+        orphan = DataFile.objects.create(
+            dataset=self.dataset, filename='orphan', size=0, md5sum='0')
+
+        with self.settings(CLEANUP_BATCH_SIZE=1):
+            cleanup_dfos()
+            cleanup_dfs()
+        self.assertFalse(os.path.exists(file_path))
+        self.assertEqual(
+            set(DataFile.objects.values_list('id', flat=True)),
+            {datafiles[1].id, datafiles[2].id})
+        self.assertEqual(DataFileObject.objects.count(), 2)
+        self.assertFalse(DataFile.objects.filter(id=orphan.id).exists())
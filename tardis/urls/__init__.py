@@ -9,6 +9,7 @@ from django.conf import settings
 from django.contrib.staticfiles.urls import staticfiles_urlpatterns
 from django.views.static import serve
 
+from tardis.analytics.metrics import metrics_view
 from tardis.app_config import get_tardis_apps
 from tardis.app_config import format_app_name_for_url
 from tardis.tardis_portal.views import IndexView
@@ -116,6 +117,9 @@ urlpatterns = [
     # Token login
     url(r'^token/', include(token_urls)),
 
+    # Prometheus metrics
+    url(r'^metrics$', metrics_view, name='tardis.analytics.metrics'),
+
     # Class-based views that may be overriden by apps
     url(r'', include(overridable_urls)),
 ]
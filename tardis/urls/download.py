@@ -20,21 +20,21 @@ download_urls = [
         streaming_download_experiment,
         name='tardis.tardis_portal.download.streaming_download_experiment'),
     url(r'^experiment/(?P<experiment_id>\d+)/'
-        r'(?P<comptype>[a-z]{3})/$',  # tgz or tar
+        r'(?P<comptype>[a-z]{3}|tar\.zst)/$',  # tgz, tar or tar.zst
         streaming_download_experiment,
         name='tardis.tardis_portal.download.streaming_download_experiment'),
     url(r'^experiment/(?P<experiment_id>\d+)/'
-        r'(?P<comptype>[a-z]{3})/(?P<organization>[^/]+)/$',
+        r'(?P<comptype>[a-z]{3}|tar\.zst)/(?P<organization>[^/]+)/$',
      streaming_download_experiment),
     url(r'^dataset/(?P<dataset_id>\d+)/$',
         streaming_download_dataset,
         name='tardis.tardis_portal.download.streaming_download_dataset'),
     url(r'^dataset/(?P<dataset_id>\d+)/'
-        r'(?P<comptype>[a-z]{3})/$',  # tgz or tar
+        r'(?P<comptype>[a-z]{3}|tar\.zst)/$',  # tgz, tar or tar.zst
         streaming_download_dataset,
         name='tardis.tardis_portal.download.streaming_download_dataset'),
     url(r'^dataset/(?P<dataset_id>\d+)/'
-        r'(?P<comptype>[a-z]{3})/(?P<organization>[^/]+)/$',
+        r'(?P<comptype>[a-z]{3}|tar\.zst)/(?P<organization>[^/]+)/$',
         streaming_download_dataset,
         name='tardis.tardis_portal.download.streaming_download_dataset'),
     url(r'^api_key/$', download_api_key,